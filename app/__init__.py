@@ -17,6 +17,11 @@ def create_app(config_class=Config):
     def load_user(user_id):
         return db.session.get(Usuario, int(user_id))
 
+    # Registra os eventos que mantêm produtos.preco_efetivo materializado e os que
+    # criam o índice full-text junto com a tabela de produtos no db.create_all()
+    from app.services import preco_service  # noqa: F401
+    from app.services.busca_service import BuscaService
+
     # Garantir criação de tabelas se o banco estiver vazio (primeira execução)
     # Evita erro "no such table: usuarios" quando migrations não foram aplicadas
     with app.app_context():
@@ -28,6 +33,10 @@ def create_app(config_class=Config):
         if not required.intersection(tables):
             db.create_all()
 
+        # Índice full-text do catálogo (FTS5 no SQLite, tsvector/GIN no PostgreSQL):
+        # só confere se a migração o criou; nenhuma DDL ou carga na inicialização
+        BuscaService.verificar_indice(app)
+
     from app.blueprints.main import main_bp
     app.register_blueprint(main_bp)
 
@@ -56,8 +65,9 @@ def create_app(config_class=Config):
     app.register_blueprint(webhooks_bp, url_prefix='/webhooks')
 
     # Registrar comandos CLI personalizados
-    from app.cli_commands import cli
+    from app.cli_commands import cli, scheduler
     app.cli.add_command(cli)
+    app.cli.add_command(scheduler)
 
     # Adicionar filtros personalizados
     import hashlib
@@ -1,7 +1,7 @@
 from flask import render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
 from app.extensions import db
-from app.models.core import Usuario, Produtor, Cliente, Produto, Pedido, ItemPedido, Notificacao, PontoRetirada, TaxaEntrega, Contato
+from app.models.core import Usuario, Produtor, Cliente, Produto, Pedido, ItemPedido, Notificacao, PontoRetirada, TaxaEntrega, Contato, PerfisCarregamento
 from . import admin_bp
 
 def admin_required(f):
@@ -75,7 +75,7 @@ def usuarios():
 @login_required
 @admin_required
 def pedidos():
-    pedidos = Pedido.query.order_by(Pedido.data.desc()).all()
+    pedidos = Pedido.query.options(*PerfisCarregamento.admin_pedidos()).order_by(Pedido.data.desc()).all()
     return render_template('admin/pedidos.html', pedidos=pedidos)
 
 @admin_bp.route('/pedidos/<int:pedido_id>/status', methods=['POST'], endpoint='atualizar_status_pedido')
@@ -253,6 +253,8 @@ def produtores_editar(id):
         produtor.cidade = request.form.get('cidade')
         produtor.estado = request.form.get('estado')
         produtor.bio = request.form.get('bio')
+        from app.services.busca_service import BuscaService
+        BuscaService().indexar_produtos_do_produtor(produtor)
         db.session.commit()
         flash('Produtor atualizado!', 'success')
         return redirect(url_for('admin.produtores_list'))
@@ -276,6 +278,7 @@ def seed_produtos():
     from random import randint, uniform, choice
     # Garantir categorias base
     from app.models.core import Categoria
+    from app.services.lote_service import inserir_em_lote
     categorias = Categoria.query.all()
     if not categorias:
         base = [
@@ -285,8 +288,7 @@ def seed_produtos():
             ('Grãos', 'Cereais e farinhas', 'grain'),
             ('Laticínios', 'Leite e derivados', 'milk')
         ]
-        for nome, desc, icone in base:
-            db.session.add(Categoria(nome=nome, descricao=desc, icone=icone))
+        inserir_em_lote(Categoria, [{'nome': nome, 'descricao': desc, 'icone': icone} for nome, desc, icone in base])
         db.session.commit()
         categorias = Categoria.query.all()
     # Selecionar um produtor ou criar dummy
@@ -295,30 +297,37 @@ def seed_produtos():
         produtor = Produtor(nome='Produtor Demo', descricao='Produtor de demonstração', usuario_id=None)
         db.session.add(produtor)
         db.session.commit()
-    # Criar 100 produtos
-    created = 0
+    # Criar 100 produtos em INSERTs de várias linhas
+    from app.models.core import ProdutoTag
+    from app.services.tag_service import obter_tags, dividir_tags
+    from app.services.preco_service import atualizar_precos_efetivos
+    from app.services.sugestao_service import reconstruir_indice_sugestoes
+    tags_demo = obter_tags(dividir_tags('orgânico, local'))
+    registros = []
     for i in range(1, 101):
         nome = f"Produto Demo {i}"
-        if Produto.query.filter_by(nome=nome).first():
-            continue
-        categoria = choice(categorias)
-        preco = round(uniform(3.0, 50.0), 2)
-        estoque = round(uniform(10, 200), 1)
-        unidade = choice(['kg', 'un', 'molho', 'litro'])
-        produto = Produto(
-            nome=nome,
-            descricao=f"Descrição do {nome} com qualidade e origem local.",
-            preco=preco,
-            unidade=unidade,
-            categoria_id=categoria.id,
-            estoque=estoque,
-            imagens='',
-            tags='orgânico, local',
-            produtor_id=produtor.id
-        )
-        db.session.add(produto)
-        created += 1
+        registros.append({
+            'nome': nome,
+            'descricao': f"Descrição do {nome} com qualidade e origem local.",
+            'preco': round(uniform(3.0, 50.0), 2),
+            'unidade': choice(['kg', 'un', 'molho', 'litro']),
+            'categoria_id': choice(categorias).id,
+            'estoque': round(uniform(10, 200), 1),
+            'imagens': '',
+            'tags': 'orgânico, local',
+            'produtor_id': produtor.id,
+        })
+    inseridos = inserir_em_lote(Produto, registros, retornar_chaves=True, unicos=('nome',))
+    inserir_em_lote(ProdutoTag, [
+        {'produto_id': registro['id'], 'tag_id': tag.id} for registro in inseridos for tag in tags_demo
+    ])
+    created = len(inseridos)
+    # INSERT direto na tabela não passa pelos eventos do ORM: preço efetivo, busca e sugestões
+    atualizar_precos_efetivos()
+    from app.services.busca_service import BuscaService
+    BuscaService().indexar_produtos_do_produtor(produtor)
     db.session.commit()
+    reconstruir_indice_sugestoes()
     flash(f'{created} produtos de demonstração adicionados com sucesso!', 'success')
     return redirect(url_for('produtos_bp.catalogo'))
 
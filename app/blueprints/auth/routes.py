@@ -4,6 +4,7 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import URLSafeTimedSerializer
 from app.extensions import db
 from app.models.core import Usuario, Produtor, Cliente
+from app.services.carrinho_service import mesclar_carrinho_anonimo
 from . import auth_bp
 
 @auth_bp.route('/login', methods=['GET', 'POST'], endpoint='login')
@@ -16,6 +17,9 @@ def login():
         user = Usuario.query.filter_by(email=email).first()
         if user and user.check_senha(senha):
             login_user(user)
+            # Leva para a conta os itens colocados no carrinho antes do login
+            mesclar_carrinho_anonimo(user)
+            db.session.commit()
             flash('Login realizado com sucesso!', 'success')
             return redirect(url_for('main_bp.index'))
         else:
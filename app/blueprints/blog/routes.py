@@ -2,9 +2,11 @@ import os
 from flask import render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
+from sqlalchemy import func
 from app.extensions import db
 from app.models.core import PostBlog, ComentarioBlog, Usuario
 from app.blueprints.admin.routes import admin_required
+from app.services.cache_http_service import condicional
 from . import blog_bp
 from datetime import datetime, timezone
 def produtor_ou_admin_required(f):
@@ -81,7 +83,19 @@ def index():
     posts = query.order_by(PostBlog.criado_em.desc()).all()
     return render_template('blog/index.html', posts=posts, categoria_selecionada=categoria)
 
+def _versao_post(slug):
+    """Versão do post publicado e dos seus comentários"""
+    post = db.session.query(PostBlog.id, PostBlog.atualizado_em).filter_by(slug=slug, publicado=True).first()
+    if not post:
+        return None
+    total, ultimo_comentario = db.session.query(
+        func.count(ComentarioBlog.id), func.max(ComentarioBlog.criado_em)
+    ).filter(ComentarioBlog.post_id == post.id).one()
+    datas = [d for d in (post.atualizado_em, ultimo_comentario) if d]
+    return (post.atualizado_em, total, ultimo_comentario), max(datas) if datas else None
+
 @blog_bp.route('/<slug>', endpoint='ver_post')
+@condicional(_versao_post)
 def ver_post(slug):
     """Exibe um post específico"""
     post = PostBlog.query.filter_by(slug=slug, publicado=True).first_or_404() 
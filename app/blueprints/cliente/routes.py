@@ -1,7 +1,8 @@
-from flask import render_template, redirect, url_for, flash, request, session
+from flask import render_template, redirect, url_for, flash, request, abort
 from flask_login import login_required, current_user
 from app.extensions import db
-from app.models.core import Cliente, Produto, Favorito, Endereco, Pedido, ItemPedido, Notificacao
+from app.models.core import Cliente, Produto, Favorito, Endereco, Pedido, ItemPedido, Notificacao, PerfisCarregamento
+from app.services.carrinho_service import carrinho_atual, adicionar_itens
 from . import cliente_bp
 
 # Rotas para recompra rápida
@@ -9,21 +10,23 @@ from . import cliente_bp
 @login_required
 def recompras():
     cliente = Cliente.query.filter_by(usuario_id=current_user.id).first()
-    pedidos = Pedido.query.filter_by(cliente_id=cliente.id).order_by(Pedido.data.desc()).all() if cliente else []
+    pedidos = Pedido.query.options(*PerfisCarregamento.pedidos_com_itens()).filter_by(cliente_id=cliente.id).order_by(Pedido.data.desc()).all() if cliente else []
     return render_template('cliente/recompras.html', pedidos=pedidos)
 
 @cliente_bp.route('/recomprar/<int:pedido_id>', methods=['POST'], endpoint='recomprar')
 @login_required
 def recomprar(pedido_id):
     pedido = Pedido.query.get_or_404(pedido_id)
-    # Simular adicionar itens do pedido ao carrinho (session['carrinho'])
-    carrinho = {}
+    if not pedido.cliente or pedido.cliente.usuario_id != current_user.id:
+        abort(403)
+    # Soma os itens do pedido ao carrinho em um único upsert
+    quantidades = {}
     for item in pedido.itens:
-        carrinho[str(item.produto_id)] = {'quantidade': item.quantidade}
-    # Salvar no session
-    session['carrinho'] = carrinho
+        quantidades[item.produto_id] = quantidades.get(item.produto_id, 0) + item.quantidade
+    adicionar_itens(carrinho_atual(criar=True), quantidades)
+    db.session.commit()
     flash('Itens do pedido adicionados ao carrinho para recompra!', 'success')
-    return redirect(url_for('pedidos_bp.carrinho'))
+    return redirect(url_for('pedidos.carrinho'))
 
 # Rotas para notificações do cliente
 @cliente_bp.route('/notificacoes', endpoint='notificacoes')
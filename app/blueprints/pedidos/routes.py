@@ -1,75 +1,79 @@
-from flask import render_template, redirect, url_for, flash, request, session, abort
+from flask import render_template, redirect, url_for, flash, request, abort, current_app
 from flask_login import login_required, current_user
-from datetime import datetime
+from datetime import datetime, timezone
 from app.extensions import db
-from app.models.core import Produto, Pedido, ItemPedido, Cliente, PontoRetirada, TaxaEntrega
+from app.models.core import Produto, Pedido, ItemPedido, Cliente, PontoRetirada, TaxaEntrega, PerfisCarregamento
+from app.services.carrinho_service import (
+    hidratar_carrinho, carrinho_atual, quantidades_carrinho, adicionar_itens,
+    definir_quantidade, remover_item, esvaziar_carrinho
+)
+from app.services.estoque_service import reservar_estoque, devolver_estoque, EstoqueInsuficiente
+from app.services.idempotencia_service import gerar_token, chave_registrada, reservar_chave, concluir_chave
+from app.services.lote_service import inserir_em_lote
+from app.services import referencia_service as dados_referencia
 from . import pedidos_bp
 import io
 import base64
 import hashlib
 
 @pedidos_bp.route('/carrinho', endpoint='carrinho')
-@login_required
 def carrinho():
-    carrinho_session = session.get('carrinho', {})
-    produtos = []
-    total = 0
-    for produto_id, qtd in carrinho_session.items():
-        produto = db.session.get(Produto, int(produto_id))
-        if produto:
-            subtotal = produto.preco * qtd
-            produtos.append({'produto': produto, 'quantidade': qtd, 'subtotal': subtotal})
-            total += subtotal
-    return render_template('pedidos/carrinho.html', produtos=produtos, total=total)
+    carrinho_precificado = hidratar_carrinho(quantidades_carrinho())
+    return render_template('pedidos/carrinho.html', produtos=carrinho_precificado.linhas,
+                           total=carrinho_precificado.subtotal)
 
 @pedidos_bp.route('/carrinho/adicionar/<int:produto_id>', methods=['POST'], endpoint='carrinho_adicionar')
-@login_required
 def adicionar_ao_carrinho(produto_id):
-    carrinho_session = session.get('carrinho', {})
     qtd = int(request.form.get('quantidade', 1))
-    carrinho_session[str(produto_id)] = carrinho_session.get(str(produto_id), 0) + qtd
-    session['carrinho'] = carrinho_session
+    adicionar_itens(carrinho_atual(criar=True), {produto_id: qtd})
+    db.session.commit()
     flash('Produto adicionado ao carrinho!', 'success')
     return redirect(url_for('pedidos.carrinho'))
 
 # Alias para compatibilidade com testes que esperam /pedidos/adicionar-carrinho/<id>
 @pedidos_bp.route('/adicionar-carrinho/<int:produto_id>', methods=['POST'], endpoint='adicionar_carrinho')
-@login_required
 def adicionar_carrinho_alias(produto_id):
     return adicionar_ao_carrinho(produto_id)
 
 @pedidos_bp.route('/carrinho/atualizar/<int:produto_id>', methods=['POST'], endpoint='carrinho_atualizar')
-@login_required
 def atualizar_carrinho(produto_id):
-    carrinho_session = session.get('carrinho', {})
-    qtd = int(request.form.get('quantidade', 1))
-    if qtd > 0:
-        carrinho_session[str(produto_id)] = qtd
-    else:
-        carrinho_session.pop(str(produto_id), None)
-    session['carrinho'] = carrinho_session
+    carrinho_usuario = carrinho_atual()
+    if carrinho_usuario:
+        definir_quantidade(carrinho_usuario, produto_id, int(request.form.get('quantidade', 1)))
+        db.session.commit()
     flash('Quantidade atualizada.', 'info')
     return redirect(url_for('pedidos.carrinho'))
 
 @pedidos_bp.route('/carrinho/remover/<int:produto_id>', methods=['POST'], endpoint='carrinho_remover')
-@login_required
 def remover_do_carrinho(produto_id):
-    carrinho_session = session.get('carrinho', {})
-    carrinho_session.pop(str(produto_id), None)
-    session['carrinho'] = carrinho_session
+    carrinho_usuario = carrinho_atual()
+    if carrinho_usuario:
+        remover_item(carrinho_usuario, produto_id)
+        db.session.commit()
     flash('Produto removido do carrinho.', 'info')
     return redirect(url_for('pedidos.carrinho'))
 
 @pedidos_bp.route('/finalizar', methods=['GET', 'POST'], endpoint='finalizar_pedido')
 @login_required
 def finalizar_pedido():
-    carrinho_session = session.get('carrinho', {})
-    if not carrinho_session:
+    # Envio repetido (duplo clique, reenvio do proxy): repete a resposta original sem gravar nada
+    token = request.form.get('idempotencia_token') if request.method == 'POST' else None
+    if token:
+        chave = chave_registrada(current_user.id, token)
+        if chave:
+            return _repetir_checkout(chave)
+
+    carrinho_usuario = carrinho_atual()
+    quantidades = quantidades_carrinho(carrinho_usuario)
+    if not quantidades:
         flash('Carrinho vazio.', 'warning')
         return redirect(url_for('pedidos.carrinho'))
         
-    pontos_retirada = PontoRetirada.query.filter_by(ativo=True).all()
-    taxas_entrega = TaxaEntrega.query.filter_by(ativo=True).all()
+    # Pontos, taxas e categorias vêm do cache de dados de referência (sem consulta)
+    pontos_retirada = dados_referencia.pontos_retirada()
+    taxas_entrega = dados_referencia.taxas_entrega()
+    # Produtos do carrinho em uma consulta, usados na validação, nos itens e no resumo
+    carrinho_precificado = hidratar_carrinho(quantidades)
     
     if request.method == 'POST':
         cliente = Cliente.query.filter_by(usuario_id=current_user.id).first()
@@ -81,29 +85,18 @@ def finalizar_pedido():
         data_agendada = datetime.strptime(data_str, '%Y-%m-%d') if data_str else None
         
         # Validação de mínimos por categoria
-        from app.models.core import Categoria
-        agregados = {}
-        for produto_id, qtd in carrinho_session.items():
-            produto = db.session.get(Produto, int(produto_id))
-            if not produto:
-                continue
-            cat_id = produto.categoria_id
-            valor = produto.preco * qtd
-            agregados.setdefault(cat_id, {'valor':0,'quantidade':0})
-            agregados[cat_id]['valor'] += valor
-            agregados[cat_id]['quantidade'] += qtd
-        categorias_invalidas = []
-        for cat_id, dados in agregados.items():
-            categoria = db.session.get(Categoria, cat_id)
-            if categoria:
-                if categoria.valor_minimo and dados['valor'] < categoria.valor_minimo:
-                    categorias_invalidas.append(f"{categoria.nome} valor mínimo R$ {categoria.valor_minimo:.2f}")
-                if categoria.quantidade_minima and dados['quantidade'] < categoria.quantidade_minima:
-                    categorias_invalidas.append(f"{categoria.nome} quantidade mínima {categoria.quantidade_minima}")
+        categorias_invalidas = carrinho_precificado.minimos_nao_atendidos()
         if categorias_invalidas:
             flash('Requisitos mínimos não atendidos: ' + '; '.join(categorias_invalidas), 'warning')
             return redirect(url_for('pedidos.carrinho'))
 
+        chave = None
+        if token:
+            chave = reservar_chave(current_user.id, token)
+            if chave is None:
+                db.session.rollback()
+                return _repetir_checkout(chave_registrada(current_user.id, token))
+
         pedido = Pedido(
             cliente_id=cliente.id,
             status='Aguardando confirmação',
@@ -129,7 +122,7 @@ def finalizar_pedido():
             if not taxa_id:
                 flash('Selecione a região de entrega.', 'warning')
                 return redirect(url_for('pedidos.finalizar_pedido'))
-            taxa = db.session.get(TaxaEntrega, int(taxa_id))
+            taxa = dados_referencia.taxa_entrega(int(taxa_id))
             if not taxa or not taxa.ativo:
                 flash('Taxa de entrega inválida.', 'danger')
                 return redirect(url_for('pedidos.finalizar_pedido'))
@@ -163,22 +156,25 @@ def finalizar_pedido():
                 extra = ' | ' + ' '.join(detalhes)
                 pedido.observacoes = (pedido.observacoes or '') + extra
         
-        total = 0
-        for produto_id, qtd in carrinho_session.items():
-            produto = db.session.get(Produto, int(produto_id))
-            if produto:
-                item = ItemPedido(
-                    pedido=pedido,
-                    produto=produto,
-                    quantidade=qtd,
-                    preco_unitario=produto.preco
-                )
-                db.session.add(item)
-                total += produto.preco * qtd
-                produto.estoque -= qtd
+        # Itens em um INSERT de várias linhas (precisa do id do pedido)
+        db.session.flush()
+        inserir_em_lote(ItemPedido, [{
+            'pedido_id': pedido.id,
+            'produto_id': linha.produto.id,
+            'quantidade': linha.quantidade,
+            'preco_unitario': linha.preco_unitario,
+        } for linha in carrinho_precificado])
+        
+        # Baixa condicional do estoque no banco: falha em vez de deixar o estoque negativo
+        try:
+            reservar_estoque({linha.produto.id: linha.quantidade for linha in carrinho_precificado})
+        except EstoqueInsuficiente as e:
+            db.session.rollback()
+            flash('Estoque insuficiente: ' + '; '.join(str(falta) for falta in e.faltas), 'warning')
+            return redirect(url_for('pedidos.carrinho'))
         
         pedido.valor_frete = frete
-        pedido.total = total + frete
+        pedido.total = carrinho_precificado.subtotal + frete
         
         # Armazenar dados do pagamento
         forma_pgto = request.form['forma_pagamento']
@@ -193,23 +189,32 @@ def finalizar_pedido():
             obs_cartao = f" | Cartão: {mascara_cartao}, Nome: {nome_cartao}, Validade: {validade_cartao}"
             pedido.observacoes = (pedido.observacoes or '') + obs_cartao
         
-        db.session.commit()
-        session['carrinho'] = {}
+        esvaziar_carrinho(carrinho_usuario)
+        db.session.flush()
         
         # Se for PIX, redirecionar para página de pagamento
         if forma_pgto == 'pix':
-            return redirect(url_for('pedidos.pagamento_pix', pedido_id=pedido.id))
+            destino = url_for('pedidos.pagamento_pix', pedido_id=pedido.id)
+        else:
+            destino = url_for('pedidos.historico')
+        if chave:
+            concluir_chave(chave, pedido.id, destino)
+        db.session.commit()
         
-        flash('Pedido realizado com sucesso!', 'success')
-        return redirect(url_for('pedidos.historico'))
+        if forma_pgto != 'pix':
+            flash('Pedido realizado com sucesso!', 'success')
+        return redirect(destino)
         
-    # calcular subtotal para exibição
-    subtotal = 0
-    for produto_id, qtd in carrinho_session.items():
-        produto = db.session.get(Produto, int(produto_id))
-        if produto:
-            subtotal += produto.preco * qtd
-    return render_template('pedidos/finalizar.html', pontos_retirada=pontos_retirada, taxas_entrega=taxas_entrega, subtotal=subtotal)
+    return render_template('pedidos/finalizar.html', pontos_retirada=pontos_retirada, taxas_entrega=taxas_entrega,
+                           subtotal=carrinho_precificado.subtotal, idempotencia_token=gerar_token())
+
+def _repetir_checkout(chave):
+    """Resposta para um token de checkout já utilizado"""
+    if chave and chave.url_resposta:
+        return redirect(chave.url_resposta)
+    # O envio original ainda está em andamento (ou falhou sem gravar o pedido)
+    flash('Seu pedido já está sendo processado.', 'info')
+    return redirect(url_for('pedidos.historico'))
 
 # ===== Gestão de Ponto de Retirada =====
 @pedidos_bp.route('/pontos-retirada', endpoint='listar_pontos')
@@ -324,43 +329,74 @@ def excluir_taxa(id):
 def pagamento_pix(pedido_id):
     """
     Exibe página de pagamento PIX com QR Code
-    Usa PagamentoService para gerar PIX via Mercado Pago ou simulado
+    Reaproveita a cobrança pendente do pedido enquanto não expira; só então usa
+    PagamentoService para gerar outra via Mercado Pago ou simulada
     """
-    pedido = db.session.get(Pedido, pedido_id)
+    pedido = db.session.get(Pedido, pedido_id, options=PerfisCarregamento.pagamento_pedido())
     if not pedido:
         abort(404)
     if pedido.cliente.usuario_id != current_user.id:
         flash('Acesso não autorizado.', 'danger')
         return redirect(url_for('pedidos.historico'))
+    if pedido.status_pagamento == 'aprovado':
+        flash('Este pedido já foi pago.', 'info')
+        return redirect(url_for('pedidos.detalhe_pedido', pedido_id=pedido.id))
     
-    # Gerar pagamento PIX
-    from app.services.pagamento_service import PagamentoService
-    pagamento_service = PagamentoService()
+    from app.services.pagamento_service import PagamentoService, cobranca_pix_vigente
     
     try:
-        dados_pix = pagamento_service.criar_pagamento_pix(pedido)
+        # Recarregar a página não cria nova cobrança nem gera outra imagem
+        dados_pix = cobranca_pix_vigente(pedido) or PagamentoService().criar_pagamento_pix(pedido)
         
         return render_template('pedidos/pagamento_pix.html', 
                              pedido=pedido, 
                              codigo_pix=dados_pix['codigo_pix'],
-                             qr_code_url=dados_pix['qr_code_url'],
+                             qr_code_url=url_for('pedidos.qr_code_pix', pedido_id=pedido.id, formato='svg'),
                              simulado=dados_pix.get('simulado', False))
     except Exception as e:
         current_app.logger.error(f'Erro ao gerar pagamento PIX: {e}')
         flash('Erro ao gerar pagamento PIX. Tente novamente.', 'danger')
         return redirect(url_for('pedidos.historico'))
 
+@pedidos_bp.route('/pagamento/pix/<int:pedido_id>/qr.<any(png, svg):formato>', endpoint='qr_code_pix')
+@login_required
+def qr_code_pix(pedido_id, formato):
+    """
+    Imagem do QR Code da cobrança PIX do pedido (PNG ou SVG), servida em bytes com
+    ETag forte e cache privado até a expiração da cobrança
+    """
+    from app.services.qrcode_pix_service import FORMATOS, etag_qr, imagem_qr
+    from werkzeug.http import is_resource_modified
+    linha = db.session.query(
+        Pedido.pix_codigo, Pedido.pix_qr_code, Pedido.expiracao_pagamento, Cliente.usuario_id
+    ).join(Cliente, Cliente.id == Pedido.cliente_id).filter(Pedido.id == pedido_id).first()
+    if not linha or linha.usuario_id != current_user.id or not linha.pix_codigo:
+        abort(404)
+
+    etag = etag_qr(linha.pix_codigo, formato, png_gateway=linha.pix_qr_code)
+    if not is_resource_modified(request.environ, etag=etag):
+        resposta = current_app.response_class(status=304)
+    else:
+        imagem = imagem_qr(linha.pix_codigo, formato, png_gateway=linha.pix_qr_code)
+        resposta = current_app.response_class(imagem, mimetype=FORMATOS[formato])
+    resposta.set_etag(etag)
+    resposta.cache_control.private = True
+    agora = datetime.now(timezone.utc).replace(tzinfo=None)
+    restante = (linha.expiracao_pagamento - agora).total_seconds() if linha.expiracao_pagamento else 0
+    resposta.cache_control.max_age = max(int(restante), 0)
+    return resposta
+
 @pedidos_bp.route('/historico', endpoint='historico')
 @login_required
 def historico():
     cliente = Cliente.query.filter_by(usuario_id=current_user.id).first()
-    pedidos = Pedido.query.filter_by(cliente_id=cliente.id).order_by(Pedido.data.desc()).all() if cliente else []
+    pedidos = Pedido.query.options(*PerfisCarregamento.pedidos_com_itens()).filter_by(cliente_id=cliente.id).order_by(Pedido.data.desc()).all() if cliente else []
     return render_template('pedidos/historico.html', pedidos=pedidos)
 
 @pedidos_bp.route('/pedido/<int:pedido_id>', endpoint='detalhe_pedido')
 @login_required
 def detalhe_pedido(pedido_id):
-    pedido = db.session.get(Pedido, pedido_id)
+    pedido = db.session.get(Pedido, pedido_id, options=PerfisCarregamento.detalhe_pedido())
     if not pedido:
         abort(404)
     if pedido.cliente.usuario_id != current_user.id:
@@ -386,7 +422,7 @@ def detalhe_pedido(pedido_id):
 @pedidos_bp.route('/pedido/<int:pedido_id>/cancelar', methods=['POST'], endpoint='cancelar_pedido')
 @login_required
 def cancelar_pedido(pedido_id):
-    pedido = db.session.get(Pedido, pedido_id)
+    pedido = db.session.get(Pedido, pedido_id, options=PerfisCarregamento.pedidos_com_itens())
     if not pedido:
         abort(404)
     if pedido.cliente.usuario_id != current_user.id:
@@ -409,8 +445,7 @@ def cancelar_pedido(pedido_id):
     pedido.motivo_cancelamento = motivo
     pedido.cancelado_por = 'cliente'
     # Restaurar estoque
-    for item in pedido.itens:
-        item.produto.estoque += item.quantidade
+    devolver_estoque(pedido.itens)
     db.session.commit()
     flash('Pedido cancelado com sucesso.', 'info')
     return redirect(url_for('pedidos.historico'))
@@ -439,7 +474,7 @@ def excluir_pedido(pedido_id):
 @pedidos_bp.route('/comprovante/<int:pedido_id>/pdf', endpoint='comprovante_pdf')
 @login_required
 def comprovante_pdf(pedido_id):
-    pedido = db.session.get(Pedido, pedido_id)
+    pedido = db.session.get(Pedido, pedido_id, options=PerfisCarregamento.detalhe_pedido())
     if not pedido:
         abort(404)
     if pedido.cliente.usuario_id != current_user.id and current_user.tipo_usuario != 'admin':
@@ -2,8 +2,13 @@ import os
 from flask import render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
+from sqlalchemy import func
 from app.extensions import db
-from app.models.core import Produtor, Produto, Categoria
+from app.models.core import Produtor, Produto
+from app.services.busca_service import BuscaService
+from app.services.tag_service import sincronizar_tags
+from app.services.cache_http_service import condicional
+from app.services import referencia_service as dados_referencia
 from . import produtores_bp
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
@@ -82,6 +87,7 @@ def editar_produtor(id):
             if fotos_paths:
                 produtor.fotos = ','.join(fotos_paths)
         
+        BuscaService().indexar_produtos_do_produtor(produtor)
         db.session.commit()
         flash('Produtor atualizado!', 'success')
         return redirect(url_for('produtores.listar'))
@@ -138,6 +144,7 @@ def editar_perfil():
             filename = secure_filename(foto.filename)
             foto.save(os.path.join(upload_dir, filename))
             produtor.fotos = f'uploads/produtores/{filename}'
+        BuscaService().indexar_produtos_do_produtor(produtor)
         db.session.commit()
         flash('Perfil atualizado com sucesso!', 'success')
         return redirect(url_for('produtores.dashboard_home'))
@@ -184,10 +191,13 @@ def novo_produto_produtor():
             produtor_id=produtor.id
         )
         db.session.add(produto)
+        sincronizar_tags(produto)
+        db.session.flush()
+        BuscaService().indexar_produto(produto)
         db.session.commit()
         flash('Produto criado!', 'success')
         return redirect(url_for('produtores.meus_produtos'))
-    categorias = Categoria.query.all()
+    categorias = dados_referencia.categorias()
     return render_template('produtores/novo_produto.html', categorias=categorias)
 
 @produtores_bp.route('/meus-produtos/<int:id>/editar', methods=['GET','POST'], endpoint='meus_produtos_editar')
@@ -215,6 +225,7 @@ def editar_meu_produto(id):
                     file.save(os.path.join(upload_dir, filename))
                     imgs.append(f'uploads/produtos/{filename}')
             produto.imagens = ','.join(imgs)
+        BuscaService().indexar_produto(produto)
         db.session.commit()
         flash('Produto atualizado!', 'success')
         return redirect(url_for('produtores.meus_produtos'))
@@ -228,13 +239,26 @@ def excluir_meu_produto(id):
     if produto.produtor_id != produtor.id:
         flash('Você não tem permissão para excluir este produto.', 'danger')
         return redirect(url_for('produtores_bp.meus_produtos'))
+    BuscaService().remover_produto(produto.id)
     db.session.delete(produto)
     db.session.commit()
     flash('Produto excluído!', 'danger')
     return redirect(url_for('produtores_bp.meus_produtos'))
 
 # ---------------------- Perfil público do produtor ----------------------
+def _versao_perfil_publico(produtor_id):
+    """Versão do perfil: o produtor, o produto alterado mais recentemente e a quantidade de produtos"""
+    atualizado_em = db.session.query(Produtor.atualizado_em).filter(Produtor.id == produtor_id).first()
+    if not atualizado_em:
+        return None
+    total, ultimo_produto = db.session.query(
+        func.count(Produto.id), func.max(Produto.atualizado_em)
+    ).filter(Produto.produtor_id == produtor_id).one()
+    datas = [d for d in (atualizado_em[0], ultimo_produto) if d]
+    return (atualizado_em[0], total, ultimo_produto), max(datas) if datas else None
+
 @produtores_bp.route('/produtores/<int:produtor_id>', methods=['GET'], endpoint='perfil_publico')
+@condicional(_versao_perfil_publico)
 def perfil_publico(produtor_id):
     produtor = Produtor.query.get_or_404(produtor_id)
     produtos = Produto.query.filter_by(produtor_id=produtor.id).order_by(Produto.created_at.desc()).all() if hasattr(Produto, 'created_at') else Produto.query.filter_by(produtor_id=produtor.id).all()
@@ -1,10 +1,17 @@
 import os
-from flask import render_template, redirect, url_for, flash, request, current_app, abort
-from datetime import datetime, timezone
+from flask import render_template, redirect, url_for, flash, request, current_app, abort, jsonify
+from datetime import datetime
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from app.extensions import db
-from app.models.core import Categoria, Produto, Produtor, Cliente, Review
+from app.models.core import Categoria, Produto, Produtor, Cliente, PerfisCarregamento
+from app.services.busca_service import BuscaService
+from app.services.tag_service import sincronizar_tags, listar_tags
+from app.services.avaliacao_service import registrar_avaliacao, pagina_reviews, NOTAS_VALIDAS
+from app.services.catalogo_service import FiltrosCatalogo, consultar_pagina, calcular_facetas
+from app.services.cache_http_service import condicional
+from app.services.sugestao_service import sugerir
+from app.services import referencia_service as dados_referencia
 from . import produtos_bp
 
 @produtos_bp.route('/produtos', endpoint='listar_produtos')
@@ -16,7 +23,7 @@ def listar_produtos():
 @produtos_bp.route('/produtos/novo', methods=['GET', 'POST'], endpoint='novo_produto')
 @login_required
 def novo_produto():
-    categorias = Categoria.query.order_by(Categoria.nome.asc()).all()
+    categorias = dados_referencia.categorias()
     if request.method == 'POST':
         if not categorias:
             flash('Nenhuma categoria cadastrada. Crie uma categoria antes de cadastrar produtos.', 'warning')
@@ -58,6 +65,9 @@ def novo_produto():
             produtor_id=produtor_id
         )
         db.session.add(produto)
+        sincronizar_tags(produto)
+        db.session.flush()
+        BuscaService().indexar_produto(produto)
         db.session.commit()
         flash('Produto cadastrado com sucesso!', 'success')
         return redirect(url_for('produtos_bp.listar_produtos'))
@@ -69,7 +79,7 @@ def editar_produto(id):
     produto = db.session.get(Produto, id)
     if not produto:
         abort(404)
-    categorias = Categoria.query.all()
+    categorias = dados_referencia.categorias()
     if request.method == 'POST':
         produto.nome = request.form['nome']
         produto.descricao = request.form['descricao']
@@ -88,6 +98,8 @@ def editar_produto(id):
         from datetime import datetime
         produto.sazonal_inicio = datetime.fromisoformat(sazonal_inicio) if sazonal_inicio else None
         produto.sazonal_fim = datetime.fromisoformat(sazonal_fim) if sazonal_fim else None
+        sincronizar_tags(produto)
+        BuscaService().indexar_produto(produto)
         db.session.commit()
         flash('Produto atualizado!', 'info')
         return redirect(url_for('produtos_bp.listar_produtos'))
@@ -99,6 +111,7 @@ def excluir_produto(id):
     produto = db.session.get(Produto, id)
     if not produto:
         abort(404)
+    BuscaService().remover_produto(produto.id)
     db.session.delete(produto)
     db.session.commit()
     flash('Produto excluído!', 'danger')
@@ -106,48 +119,68 @@ def excluir_produto(id):
 
 @produtos_bp.route('/', endpoint='catalogo')
 def catalogo():
-    busca = request.args.get('busca', '').strip()
-    categoria_id = request.args.get('categoria_id', type=int)
-    produtor_nome = request.args.get('produtor', '').strip()
-    preco_min = request.args.get('preco_min', type=float)
-    preco_max = request.args.get('preco_max', type=float)
-    tag = request.args.get('tag', '').strip()
-    so_organico = request.args.get('so_organico')
-    
-    query = Produto.query
-    if busca:
-        query = query.filter((Produto.nome.ilike(f'%{busca}%')) | (Produto.tags.ilike(f'%{busca}%')))
-    if categoria_id:
-        query = query.filter_by(categoria_id=categoria_id)
-    if produtor_nome:
-        query = query.join(Produtor).filter(Produtor.nome.ilike(f'%{produtor_nome}%'))
-    if preco_min is not None:
-        query = query.filter(Produto.preco >= preco_min)
-    if preco_max is not None:
-        query = query.filter(Produto.preco <= preco_max)
-    if tag:
-        query = query.filter(Produto.tags.ilike(f'%{tag}%'))
-    if so_organico:
-        query = query.filter(Produto.tags.ilike('%orgânico%'))
-        
-    produtos = query.all()
-    categorias = Categoria.query.all()
-    return render_template('produtos/catalogo.html', produtos=produtos, categorias=categorias, datetime=datetime, timezone=timezone)
+    filtros = FiltrosCatalogo.do_request(request.args)
+    por_pagina = max(1, min(request.args.get('por_pagina', type=int) or current_app.config['CATALOGO_POR_PAGINA'], 60))
+    pagina = consultar_pagina(filtros, cursor=request.args.get('cursor'), por_pagina=por_pagina)
+    facetas = calcular_facetas(filtros)
+    categorias = dados_referencia.categorias()
+    # Querystring atual sem o cursor, para montar os links de navegação
+    args_navegacao = {k: v for k, v in request.args.items() if k != 'cursor'}
+
+    def url_filtro(**alteracoes):
+        """URL do catálogo com filtros alterados (None remove o filtro), voltando à primeira página"""
+        args = dict(args_navegacao)
+        args.update(alteracoes)
+        return url_for(request.endpoint, **{k: v for k, v in args.items() if v not in (None, '')})
+
+    return render_template('produtos/catalogo.html', produtos=pagina.itens, pagina=pagina, filtros=filtros,
+                           facetas=facetas, url_filtro=url_filtro, args_navegacao=args_navegacao, tags=listar_tags(limite=50),
+                           categorias=categorias)
 
 # Alias para compatibilidade com testes que esperam /produtos/catalogo
 @produtos_bp.route('/catalogo', endpoint='catalogo_alias')
 def catalogo_alias():
-    return render_template('produtos/catalogo.html', produtos=Produto.query.all(), categorias=Categoria.query.all(), datetime=datetime, timezone=timezone)
+    return catalogo()
+
+@produtos_bp.route('/sugestoes', endpoint='sugestoes')
+def sugestoes():
+    """Autocomplete da busca: JSON com produtos, tags e produtores que começam com `q`"""
+    texto = request.args.get('q', '')[:100]
+    limite = max(1, min(request.args.get('limite', 8, type=int) or 8, 20))
+    urls = {
+        'produto': lambda ref: url_for('produtos_bp.detalhe', produto_id=ref),
+        'tag': lambda ref: url_for('produtos_bp.catalogo', tag=ref),
+        'produtor': lambda ref: url_for('produtores.perfil_publico', produtor_id=ref),
+    }
+    itens = [
+        {'tipo': tipo, 'texto': rotulo, 'url': urls[tipo](ref)}
+        for tipo, ref, rotulo in sugerir(texto, limite=limite)
+    ]
+    resposta = jsonify({'q': texto, 'sugestoes': itens})
+    resposta.cache_control.max_age = 60
+    return resposta
+
+def _versao_detalhe(produto_id):
+    """Versão da página do produto: o próprio produto (inclui agregados de avaliações) e o produtor"""
+    linha = db.session.query(
+        Produto.atualizado_em, Produtor.atualizado_em, Categoria.nome
+    ).join(Produtor, Produtor.id == Produto.produtor_id).join(
+        Categoria, Categoria.id == Produto.categoria_id
+    ).filter(Produto.id == produto_id).first()
+    if not linha:
+        return None
+    datas = [d for d in linha[:2] if d]
+    return tuple(linha), max(datas) if datas else None
 
 @produtos_bp.route('/detalhe/<int:produto_id>', endpoint='detalhe')
+@condicional(_versao_detalhe)
 def detalhe(produto_id):
-    produto = db.session.get(Produto, produto_id)
+    produto = db.session.get(Produto, produto_id, options=PerfisCarregamento.detalhe_produto())
     if not produto:
         abort(404)
-    reviews = Review.query.filter_by(produto_id=produto_id).order_by(Review.criado_em.desc()).all()
-    from sqlalchemy import func
-    media_nota = db.session.query(func.avg(Review.nota)).filter_by(produto_id=produto_id).scalar() or 0
-    return render_template('produtos/detalhe_produto.html', produto=produto, reviews=reviews, media_nota=media_nota, datetime=datetime, timezone=timezone)
+    pagina_avaliacoes = pagina_reviews(produto_id, cursor=request.args.get('reviews_cursor'))
+    return render_template('produtos/detalhe_produto.html', produto=produto, reviews=pagina_avaliacoes.itens,
+                           pagina_avaliacoes=pagina_avaliacoes, media_nota=produto.media_nota)
 
 @produtos_bp.route('/categorias', endpoint='listar_categorias')
 @login_required
@@ -214,17 +247,15 @@ def avaliar_produto(produto_id):
     if not cliente:
         flash('Perfil de cliente não encontrado.', 'danger')
         return redirect(url_for('produtos_bp.detalhe', produto_id=produto_id))
-    nota = int(request.form.get('nota', 5))
+    nota = request.form.get('nota', 5, type=int)
     comentario = request.form.get('comentario', '')
-    # Verificar se já avaliou
-    review_existente = Review.query.filter_by(cliente_id=cliente.id, produto_id=produto_id).first()
-    if review_existente:
-        review_existente.nota = nota
-        review_existente.comentario = comentario
-        flash('Avaliação atualizada!', 'success')
-    else:
-        review = Review(cliente_id=cliente.id, produto_id=produto_id, nota=nota, comentario=comentario)
-        db.session.add(review)
+    if nota not in NOTAS_VALIDAS:
+        flash('Nota inválida. Escolha de 1 a 5.', 'warning')
+        return redirect(url_for('produtos_bp.detalhe', produto_id=produto_id))
+    # Cria ou atualiza a avaliação e os agregados do produto na mesma transação
+    if registrar_avaliacao(produto_id, cliente.id, nota, comentario):
         flash('Avaliação enviada com sucesso!', 'success')
+    else:
+        flash('Avaliação atualizada!', 'success')
     db.session.commit()
     return redirect(url_for('produtos_bp.detalhe', produto_id=produto_id))
\ No newline at end of file
@@ -2,11 +2,8 @@
 Comandos CLI personalizados para tarefas administrativas
 """
 import click
-from flask import current_app
 from flask.cli import with_appcontext
-from datetime import datetime
 from app.extensions import db
-from app.models.core import Pedido
 from app.services.email_service import EmailService
 
 
@@ -17,144 +14,261 @@ def cli():
 
 
 @cli.command('expirar-pedidos-pix')
+@click.option('--lote', type=int, default=None, help='Pedidos por lote/commit')
 @with_appcontext
-def expirar_pedidos_pix():
+def expirar_pedidos_pix(lote):
     """
     Cancela pedidos PIX com pagamento expirado (mais de 30 minutos)
     e restaura o estoque dos produtos.
     
+    O filtro roda no banco e cada lote faz um UPDATE dos pedidos, um UPDATE
+    agregado do estoque e um commit; os emails vão para uma fila em segundo plano.
+    
     Execute este comando periodicamente via cron/scheduler:
-    flask expirar-pedidos-pix
+    flask expirar-pedidos-pix [--lote 500]
     """
+    from app.services.expiracao_service import expirar_pedidos_pix as expirar
+    
     click.echo('🔍 Buscando pedidos PIX expirados...')
     
-    # Buscar pedidos PIX pendentes
-    pedidos_pendentes = Pedido.query.filter(
-        Pedido.forma_pagamento == 'pix',
-        Pedido.status_pagamento == 'pendente',
-        Pedido.expiracao_pagamento.isnot(None)
-    ).all()
-    
-    agora = datetime.utcnow()
-    contador_expirados = 0
-    
-    for pedido in pedidos_pendentes:
-        # Verificar se expirou
-        if pedido.expiracao_pagamento and agora > pedido.expiracao_pagamento:
-            click.echo(f'⏰ Expirando pedido #{pedido.id} (expirou em {pedido.expiracao_pagamento})')
-            
-            # Cancelar pedido
-            pedido.status = 'Cancelado'
-            pedido.status_pagamento = 'expirado'
-            pedido.data_cancelamento = agora
-            pedido.motivo_cancelamento = 'Pagamento PIX expirado (30 minutos)'
-            pedido.cancelado_por = 'sistema'
-            
-            # Restaurar estoque
-            for item in pedido.itens:
-                produto = item.produto
-                produto.estoque += item.quantidade
-                click.echo(f'  ↩️ Restaurando {item.quantidade}x {produto.nome} ao estoque')
-            
-            # Enviar email de notificação
-            try:
-                email_service = EmailService()
-                email_service.enviar_pedido_expirado(pedido)
-                click.echo(f'  📧 Email de expiração enviado para {pedido.cliente.usuario.email}')
-            except Exception as e:
-                click.echo(f'  ⚠️ Erro ao enviar email: {e}', err=True)
-            
-            contador_expirados += 1
-    
-    # Salvar alterações
-    if contador_expirados > 0:
-        db.session.commit()
-        click.echo(f'✅ {contador_expirados} pedido(s) PIX expirado(s) cancelado(s)')
-    else:
+    def ao_lote(pedido_ids, quantidades):
+        click.echo(f'  ⏰ {len(pedido_ids)} pedido(s) expirado(s); '
+                   f'estoque restaurado em {len(quantidades)} produto(s)')
+    
+    expirados = expirar(lote=lote, ao_lote=ao_lote)
+    if not expirados:
         click.echo('✅ Nenhum pedido PIX expirado encontrado')
+        return
+    
+    click.echo(f'✅ {len(expirados)} pedido(s) PIX expirado(s) cancelado(s)')
+    envio = EmailService().enfileirar_pedidos_expirados(expirados)
+    if envio:
+        click.echo(f'📧 Enviando {len(expirados)} email(s) de expiração...')
+        envio.join()
 
 
 @cli.command('verificar-pagamentos')
+@click.option('--paralelismo', type=int, default=None, help='Consultas simultâneas ao gateway')
+@click.option('--taxa', type=float, default=None, help='Máximo de consultas por segundo (0 = sem limite)')
+@click.option('--lote', type=int, default=None, help='Resultados gravados por commit')
+@click.option('--todos', is_flag=True, help='Consulta todos os pendentes, ignorando o intervalo por idade')
 @with_appcontext
-def verificar_pagamentos():
+def verificar_pagamentos(paralelismo, taxa, lote, todos):
     """
     Consulta status de pagamentos pendentes no gateway
     e atualiza o banco de dados.
     
-    flask verificar-pagamentos
+    As consultas rodam em paralelo, com limite de taxa; pedidos mais antigos
+    são consultados com menos frequência. Padrões em RECONCILIACAO_*.
+    
+    flask verificar-pagamentos [--paralelismo 8] [--taxa 10] [--lote 50] [--todos]
     """
-    from app.services.pagamento_service import PagamentoService
+    from app.services.conciliacao_service import conciliar_pagamentos
     
     click.echo('🔍 Verificando status de pagamentos pendentes...')
     
-    # Buscar pedidos com pagamento pendente
-    pedidos_pendentes = Pedido.query.filter(
-        Pedido.status_pagamento == 'pendente',
-        Pedido.pagamento_id.isnot(None)
-    ).all()
+    icones = {'aprovado': '✅', 'rejeitado': '❌', 'cancelado': '🚫', 'ignorado': '↪️', 'erro': '⚠️'}
+    
+    def ao_resultado(pedido_id, pagamento_id, desfecho, info):
+        if desfecho in icones:
+            click.echo(f'  {icones[desfecho]} Pedido #{pedido_id} ({pagamento_id}): {desfecho}',
+                       err=desfecho == 'erro')
+    
+    def ao_aprovar(pedido):
+        try:
+            EmailService().enviar_confirmacao_pagamento(pedido)
+        except Exception as e:
+            click.echo(f'  ⚠️ Erro ao enviar email do pedido #{pedido.id}: {e}', err=True)
     
-    if not pedidos_pendentes:
-        click.echo('✅ Nenhum pagamento pendente')
+    resumo = conciliar_pagamentos(paralelismo=paralelismo, por_segundo=taxa, lote=lote, todos=todos,
+                                  ao_resultado=ao_resultado, ao_aprovar=ao_aprovar)
+    
+    if not resumo.consultados:
+        sufixo = f' ({resumo.adiados} aguardando o próximo intervalo)' if resumo.adiados else ''
+        click.echo(f'✅ Nenhum pagamento pendente a consultar{sufixo}')
         return
     
-    pagamento_service = PagamentoService()
-    contador_atualizados = 0
-    
-    for pedido in pedidos_pendentes:
-        click.echo(f'🔎 Consultando pagamento #{pedido.pagamento_id} (Pedido #{pedido.id})')
-        
-        # Consultar status no gateway
-        info = pagamento_service.consultar_pagamento(pedido.pagamento_id)
-        
-        if not info:
-            click.echo(f'  ⚠️ Não foi possível consultar o pagamento', err=True)
-            continue
-        
-        status = info.get('status')
-        
-        if status == 'approved':
-            click.echo(f'  ✅ Pagamento aprovado!')
-            pedido.status_pagamento = 'aprovado'
-            pedido.status = 'Pagamento confirmado'
-            pedido.data_pagamento = datetime.utcnow()
-            
-            # Enviar email
-            try:
-                email_service = EmailService()
-                email_service.enviar_confirmacao_pagamento(pedido)
-            except Exception as e:
-                click.echo(f'  ⚠️ Erro ao enviar email: {e}', err=True)
-            
-            contador_atualizados += 1
-        
-        elif status == 'rejected':
-            click.echo(f'  ❌ Pagamento rejeitado')
-            pedido.status_pagamento = 'rejeitado'
-            pedido.status = 'Pagamento rejeitado'
-            pedido.motivo_rejeicao = info.get('status_detail')
-            contador_atualizados += 1
-        
-        elif status == 'cancelled':
-            click.echo(f'  🚫 Pagamento cancelado')
-            pedido.status_pagamento = 'cancelado'
-            pedido.status = 'Cancelado'
-            pedido.data_cancelamento = datetime.utcnow()
-            
-            # Restaurar estoque
-            for item in pedido.itens:
-                item.produto.estoque += item.quantidade
-            
-            contador_atualizados += 1
-        
-        else:
-            click.echo(f'  ⏳ Status: {status}')
+    desfechos = ', '.join(f'{nome}={total}' for nome, total in sorted(resumo.desfechos.items()))
+    click.echo(f'📊 {resumo.consultados} consulta(s) em {resumo.duracao:.1f}s: {desfechos}')
+    if resumo.latencias:
+        click.echo(f'⏱️ Latência do gateway: p50 {resumo.percentil(50) * 1000:.0f} ms, '
+                   f'p95 {resumo.percentil(95) * 1000:.0f} ms, máx {max(resumo.latencias) * 1000:.0f} ms')
+    if resumo.adiados:
+        click.echo(f'⏭️ {resumo.adiados} pedido(s) aguardando o próximo intervalo de consulta')
+    click.echo(f'✅ {resumo.atualizados} pagamento(s) atualizado(s)')
+
+
+@cli.command('relatorio-divergencias')
+@click.option('--dias', type=int, default=1, show_default=True, help='Janela de pedidos (dias até --ate)')
+@click.option('--ate', type=click.DateTime(), default=None, help='Fim da janela (UTC; padrão: agora)')
+@click.option('--estrito', is_flag=True, help='Sai com código 1 se houver divergências (alertas do cron)')
+@with_appcontext
+def relatorio_divergencias(dias, ate, estrito):
+    """
+    Compara o status de pagamento dos pedidos com o gateway, usando a busca em
+    lote do Mercado Pago (centenas de pedidos por chamada). Só aponta as
+    divergências; a correção fica com verificar-pagamentos/webhooks.
+    
+    Execute toda noite:
+    flask relatorio-divergencias [--dias 1] [--ate 2026-01-31] [--estrito]
+    """
+    from datetime import datetime, timedelta
+    from app.services.conciliacao_service import relatorio_divergencias as gerar_relatorio
     
-    # Salvar alterações
-    if contador_atualizados > 0:
-        db.session.commit()
-        click.echo(f'✅ {contador_atualizados} pagamento(s) atualizado(s)')
+    fim = ate or datetime.utcnow()
+    inicio = fim - timedelta(days=dias)
+    click.echo(f'🔍 Conferindo pedidos de {inicio:%d/%m/%Y %H:%M} a {fim:%d/%m/%Y %H:%M} (UTC)...')
+    relatorio = gerar_relatorio(inicio, fim)
+    if relatorio is None:
+        click.echo('⚠️ Gateway sem credenciais (MERCADOPAGO_ACCESS_TOKEN); nada a comparar', err=True)
+        return
+    
+    for divergencia in relatorio.divergencias:
+        click.echo(f'  ❗ {divergencia}')
+    for referencia in relatorio.sem_pedido:
+        click.echo(f'  ❓ Pagamento com referência {referencia} sem pedido correspondente')
+    click.echo(f'📊 {relatorio.verificados} pedido(s) conferido(s) com {relatorio.chamadas} chamada(s) '
+               f'ao gateway em {relatorio.duracao:.1f}s')
+    if relatorio.divergencias:
+        click.echo(f'⚠️ {len(relatorio.divergencias)} divergência(s) encontrada(s)')
+        if estrito:
+            raise SystemExit(1)
     else:
-        click.echo('✅ Nenhuma atualização necessária')
+        click.echo('✅ Nenhuma divergência')
+
+
+@cli.command('webhooks-worker')
+@click.option('--concorrencia', type=int, default=None, help='Threads processando eventos')
+@click.option('--lote', type=int, default=None, help='Eventos assumidos por rodada')
+@click.option('--intervalo', type=float, default=2.0, help='Segundos de espera com a fila vazia')
+@click.option('--uma-vez', is_flag=True, help='Processa o que estiver na fila e sai')
+@with_appcontext
+def webhooks_worker(concorrencia, lote, intervalo, uma_vez):
+    """
+    Processa a caixa de entrada de webhooks do gateway de pagamento.
+    
+    O endpoint /webhooks/mercadopago só grava a notificação; este worker consulta
+    o pagamento, atualiza o pedido e envia os e-mails. Falhas voltam para a fila
+    com backoff. Padrões em WEBHOOKS_*.
+    
+    flask webhooks-worker [--concorrencia 4] [--lote 100] [--intervalo 2] [--uma-vez]
+    """
+    import time
+    from collections import Counter
+    from app.services.webhook_service import drenar_webhooks
+    
+    click.echo('📬 Processando webhooks recebidos...')
+    total = Counter()
+    try:
+        while True:
+            desfechos = drenar_webhooks(concorrencia=concorrencia, lote=lote)
+            if desfechos:
+                total.update(desfechos)
+                resumo = ', '.join(f'{nome}={qtd}' for nome, qtd in sorted(desfechos.items()))
+                click.echo(f'  📦 {sum(desfechos.values())} evento(s): {resumo}')
+                continue
+            if uma_vez:
+                break
+            time.sleep(intervalo)
+    except KeyboardInterrupt:
+        click.echo('⏹️ Worker interrompido')
+    
+    click.echo(f'✅ {sum(total.values())} webhook(s) processado(s)')
+
+
+@cli.command('webhooks-replay')
+@click.option('--status', 'situacoes', multiple=True, default=('erro',), show_default=True,
+              type=click.Choice(['erro', 'processado', 'pendente']), help='Situação dos eventos a reprocessar')
+@click.option('--desde', type=click.DateTime(), default=None, help='Recebidos a partir de (UTC)')
+@click.option('--ate', type=click.DateTime(), default=None, help='Recebidos até (UTC)')
+@click.option('--pagamento', default=None, help='Só as notificações de um pagamento')
+@click.option('--processar', is_flag=True, help='Processa a fila logo em seguida')
+@with_appcontext
+def webhooks_replay(situacoes, desde, ate, pagamento, processar):
+    """
+    Reprocessa em lote os webhooks armazenados (ex: após uma queda do gateway).
+    
+    Eventos já aplicados são reconhecidos pelo registro de eventos e não
+    consultam o gateway de novo.
+    
+    flask webhooks-replay [--status erro] [--desde 2026-01-01] [--ate ...] [--pagamento ID] [--processar]
+    """
+    from collections import Counter
+    from app.services.webhook_service import reenfileirar_webhooks, drenar_webhooks
+    
+    total = reenfileirar_webhooks(status=situacoes, desde=desde, ate=ate, recurso_id=pagamento)
+    click.echo(f'🔁 {total} webhook(s) devolvido(s) para a fila')
+    if not processar or not total:
+        return
+    
+    desfechos = Counter()
+    while True:
+        rodada = drenar_webhooks()
+        if not rodada:
+            break
+        desfechos.update(rodada)
+    resumo = ', '.join(f'{nome}={qtd}' for nome, qtd in sorted(desfechos.items()))
+    click.echo(f'✅ {sum(desfechos.values())} webhook(s) processado(s): {resumo}')
+
+
+@cli.command('reindexar-busca')
+@with_appcontext
+def reindexar_busca():
+    """
+    Reconstrói o índice full-text do catálogo de produtos
+    (FTS5 no SQLite, tsvector/GIN no PostgreSQL).
+    
+    flask reindexar-busca
+    """
+    from app.services.busca_service import BuscaService
+    
+    busca_service = BuscaService()
+    if not busca_service.disponivel:
+        click.echo('⚠️ Índice full-text indisponível neste banco; a busca usa ILIKE', err=True)
+        return
+    
+    total = busca_service.reconstruir_indice()
+    db.session.commit()
+    click.echo(f'✅ {total} produto(s) indexado(s)')
+
+
+@cli.command('recalcular-avaliacoes')
+@with_appcontext
+def recalcular_avaliacoes():
+    """
+    Reconstrói média, total e histograma de avaliações de todos os produtos
+    a partir da tabela de reviews.
+    
+    flask recalcular-avaliacoes
+    """
+    from app.services.avaliacao_service import recalcular_agregados
+    
+    total = recalcular_agregados()
+    db.session.commit()
+    click.echo(f'✅ Agregados recalculados ({total} produto(s) com avaliações)')
+
+
+@cli.command('atualizar-precos')
+@with_appcontext
+def atualizar_precos():
+    """
+    Recalcula o preço efetivo (promoções e janelas sazonais) dos produtos.
+    
+    OBRIGATÓRIO agendar (cron ou flask scheduler run, que já o inclui): catálogo,
+    carrinho e checkout leem produtos.preco_efetivo, que só muda nas viradas de janela
+    quando este comando roda.
+    Execute nas viradas de janela (o comando informa a próxima) ou periodicamente:
+    flask atualizar-precos
+    """
+    from app.services.preco_service import atualizar_precos_efetivos, proxima_virada
+    
+    total = atualizar_precos_efetivos()
+    db.session.commit()
+    click.echo(f'✅ {total} preço(s) efetivo(s) atualizado(s)')
+    
+    virada = proxima_virada()
+    if virada:
+        click.echo(f'⏭️ Próxima virada de preço: {virada:%d/%m/%Y %H:%M} (UTC)')
 
 
 @cli.command('gerar-chave-criptografia')
@@ -177,3 +291,75 @@ def gerar_chave_criptografia():
     click.echo('1. Adicione esta chave ao seu arquivo .env')
     click.echo('2. NUNCA compartilhe ou versione esta chave')
     click.echo('3. Use a mesma chave em produção para descriptografar dados')
+
+
+@click.group()
+def scheduler():
+    """Agendador embutido das tarefas periódicas (substitui o cron)"""
+    pass
+
+
+@scheduler.command('run')
+@click.option('--tarefa', 'nomes', multiple=True, help='Só as tarefas informadas (padrão: todas)')
+@click.option('--tick', type=float, default=None, help='Segundos entre verificações')
+@click.option('--uma-vez', is_flag=True, help='Uma rodada: executa as tarefas no horário e sai')
+@with_appcontext
+def scheduler_run(nomes, tick, uma_vez):
+    """
+    Executa as tarefas periódicas (expirar-pedidos-pix, verificar-pagamentos,
+    relatorio-divergencias, atualizar-precos).
+    
+    Pode rodar em todos os nós: uma trava no banco, com validade e renovação,
+    garante que cada tarefa rode em um nó por vez. Intervalos em AGENDADOR_*;
+    atualizar-precos também é antecipada para a próxima virada de preço.
+    
+    flask scheduler run [--tarefa expirar-pedidos-pix] [--tick 5] [--uma-vez]
+    """
+    import signal
+    import threading
+    from app.services.agendador_service import tarefas_registradas, executar_agendador
+    
+    tarefas = tarefas_registradas()
+    if nomes:
+        desconhecidas = set(nomes) - {tarefa.nome for tarefa in tarefas}
+        if desconhecidas:
+            raise click.BadParameter(', '.join(sorted(desconhecidas)), param_hint='--tarefa')
+        tarefas = [tarefa for tarefa in tarefas if tarefa.nome in nomes]
+    
+    parar = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *args: parar.set())
+    
+    def ao_executar(execucao):
+        if execucao.status == 'sucesso':
+            click.echo(f'  ✅ {execucao.tarefa}: {execucao.linhas or 0} registro(s) em {execucao.duracao:.1f}s')
+        else:
+            click.echo(f'  ⚠️ {execucao.tarefa} falhou após {execucao.duracao:.1f}s: {execucao.erro}', err=True)
+    
+    click.echo(f'⏰ Agendador: {", ".join(tarefa.nome for tarefa in tarefas)}')
+    try:
+        executar_agendador(tarefas, parar, tick=tick, uma_vez=uma_vez, ao_executar=ao_executar)
+    except KeyboardInterrupt:
+        pass
+    click.echo('⏹️ Agendador encerrado')
+
+
+@scheduler.command('status')
+@with_appcontext
+def scheduler_status():
+    """
+    Mostra as travas das tarefas e as últimas execuções
+    
+    flask scheduler status
+    """
+    from app.models.core import TravaTarefa, ExecucaoTarefa
+    
+    for trava in TravaTarefa.query.order_by(TravaTarefa.nome):
+        dono = f'com {trava.dono} até {trava.expira_em:%H:%M:%S}' if trava.dono else 'livre'
+        proxima = f'{trava.proxima_em:%d/%m/%Y %H:%M:%S}' if trava.proxima_em else '-'
+        click.echo(f'🔒 {trava.nome}: {dono}; próxima execução {proxima} (UTC)')
+    
+    for execucao in ExecucaoTarefa.query.order_by(ExecucaoTarefa.id.desc()).limit(10):
+        duracao = f'{execucao.duracao:.1f}s' if execucao.duracao is not None else '-'
+        click.echo(f'  {execucao.iniciada_em:%d/%m %H:%M:%S} {execucao.tarefa} [{execucao.status}] '
+                   f'{duracao}, {execucao.linhas or 0} registro(s) em {execucao.no}')
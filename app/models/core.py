@@ -1,6 +1,7 @@
 from app.extensions import db
 from datetime import datetime, timezone
 from flask_login import UserMixin
+from sqlalchemy.orm import joinedload, selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
 
 class Usuario(db.Model, UserMixin):
@@ -35,6 +36,7 @@ class Produtor(db.Model):
     certificacoes = db.Column(db.Text)
     descricao = db.Column(db.Text)
     fotos = db.Column(db.Text)
+    atualizado_em = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     produtos = db.relationship('Produto', backref='produtor', lazy=True)
 
     def __repr__(self):
@@ -99,13 +101,53 @@ class Produto(db.Model):
     preco_promocional = db.Column(db.Float)
     sazonal_inicio = db.Column(db.DateTime)
     sazonal_fim = db.Column(db.DateTime)
+    # Preço vigente materializado por preco_service (promoção dentro da janela sazonal)
+    preco_efetivo = db.Column(db.Float, index=True)
     produtor_id = db.Column(db.Integer, db.ForeignKey('produtores.id'), nullable=False)
     categoria_id = db.Column(db.Integer, db.ForeignKey('categorias.id'), nullable=False)
+    # Agregados das avaliações (mantidos por avaliacao_service, sem consultar reviews)
+    media_nota = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    total_reviews = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    soma_notas = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    notas_1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    notas_2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    notas_3 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    notas_4 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    notas_5 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Versão da página do produto (ETag/Last-Modified); avança em qualquer UPDATE
+    atualizado_em = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     reviews = db.relationship('Review', backref='produto', lazy=True)
+    # Tags normalizadas (filtros usam esta relação; `tags` guarda o texto digitado)
+    tags_normalizadas = db.relationship('Tag', secondary='produto_tags', backref='produtos', lazy=True)
+
+    @property
+    def promocao_ativa(self):
+        """Indica se o preço vigente é o promocional"""
+        return self.preco_efetivo is not None and self.preco_efetivo < self.preco
+
+    @property
+    def histograma_notas(self):
+        """Quantidade de avaliações por nota: {5: n, 4: n, ..., 1: n}"""
+        return {nota: getattr(self, f'notas_{nota}') or 0 for nota in range(5, 0, -1)}
 
     def __repr__(self):
         return f'<Produto {self.nome}>'
 
+class Tag(db.Model):
+    __tablename__ = 'tags'
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(50), nullable=False)
+    slug = db.Column(db.String(60), nullable=False, unique=True)  # sem acentos, minúsculo (ex: 'organico')
+
+    def __repr__(self):
+        return f'<Tag {self.slug}>'
+
+class ProdutoTag(db.Model):
+    __tablename__ = 'produto_tags'
+    produto_id = db.Column(db.Integer, db.ForeignKey('produtos.id', ondelete='CASCADE'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True)
+    __table_args__ = (db.Index('ix_produto_tags_tag_id', 'tag_id', 'produto_id'),)
+
 class PontoRetirada(db.Model):
     __tablename__ = 'pontos_retirada'
     id = db.Column(db.Integer, primary_key=True)
@@ -153,6 +195,9 @@ class Pedido(db.Model):
     status_pagamento = db.Column(db.String(50), default='pendente')  # pendente, aprovado, rejeitado, expirado, reembolsado
     data_pagamento = db.Column(db.DateTime)  # Quando o pagamento foi confirmado
     expiracao_pagamento = db.Column(db.DateTime)  # Quando o pagamento PIX expira
+    pix_codigo = db.Column(db.Text)  # Código copia e cola da cobrança PIX pendente
+    pix_qr_code = db.Column(db.Text)  # QR Code (PNG em base64) enviado pelo gateway, se houver
+    pagamento_consultado_em = db.Column(db.DateTime)  # Última consulta do status no gateway (conciliação)
     motivo_rejeicao = db.Column(db.Text)  # Motivo se pagamento foi rejeitado
     token_cartao = db.Column(db.Text)  # Token criptografado do cartão (se aplicável)
     ultimos_4_cartao = db.Column(db.String(4))  # Últimos 4 dígitos do cartão
@@ -160,6 +205,10 @@ class Pedido(db.Model):
     itens = db.relationship('ItemPedido', backref='pedido', lazy=True)
     ponto_retirada = db.relationship('PontoRetirada', backref='pedidos', lazy=True)
     taxa_entrega = db.relationship('TaxaEntrega', backref='pedidos', lazy=True)
+    # Expiração de PIX (flask expirar-pedidos-pix): busca por faixa de expiracao_pagamento
+    __table_args__ = (
+        db.Index('ix_pedidos_expiracao_pix', 'forma_pagamento', 'status_pagamento', 'expiracao_pagamento'),
+    )
 
     def __repr__(self):
         return f'<Pedido {self.id} - {self.status}>'
@@ -173,6 +222,100 @@ class ItemPedido(db.Model):
     preco_unitario = db.Column(db.Float, nullable=False)
     produto = db.relationship('Produto')
 
+class Carrinho(db.Model):
+    """Carrinho persistente: do usuário logado ou, antes do login, do token guardado na sessão"""
+    __tablename__ = 'carrinhos'
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='CASCADE'), unique=True)
+    token = db.Column(db.String(64), unique=True)
+    criado_em = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    atualizado_em = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    itens = db.relationship('ItemCarrinho', backref='carrinho', lazy=True, cascade='all, delete-orphan')
+
+class ItemCarrinho(db.Model):
+    __tablename__ = 'itens_carrinho'
+    carrinho_id = db.Column(db.Integer, db.ForeignKey('carrinhos.id', ondelete='CASCADE'), primary_key=True)
+    produto_id = db.Column(db.Integer, db.ForeignKey('produtos.id', ondelete='CASCADE'), primary_key=True)
+    quantidade = db.Column(db.Float, nullable=False)
+
+class ChaveIdempotencia(db.Model):
+    """Token de envio do checkout: repetições do mesmo POST reaproveitam a resposta original"""
+    __tablename__ = 'chaves_idempotencia'
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='CASCADE'), nullable=False)
+    token = db.Column(db.String(64), nullable=False)
+    pedido_id = db.Column(db.Integer, db.ForeignKey('pedidos.id', ondelete='SET NULL'))
+    url_resposta = db.Column(db.String(300))
+    criado_em = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    __table_args__ = (db.UniqueConstraint('usuario_id', 'token', name='uq_chaves_idempotencia_usuario_token'),)
+
+class WebhookRecebido(db.Model):
+    """
+    Caixa de entrada de webhooks: o endpoint só grava a notificação bruta e responde;
+    o processamento (consulta ao gateway, pedido, e-mail) fica com `flask webhooks-worker`
+    """
+    __tablename__ = 'webhooks_recebidos'
+    id = db.Column(db.Integer, primary_key=True)
+    origem = db.Column(db.String(30), nullable=False, default='mercadopago')
+    tipo = db.Column(db.String(50))  # payment, merchant_order...
+    acao = db.Column(db.String(50))  # payment.created, payment.updated
+    recurso_id = db.Column(db.String(100), index=True)  # ID do pagamento no gateway
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pendente')  # pendente, processando, processado, erro
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    ultimo_erro = db.Column(db.Text)
+    recebido_em = db.Column(db.DateTime, nullable=False)
+    disponivel_em = db.Column(db.DateTime, nullable=False)  # Próxima tentativa (backoff)
+    travado_em = db.Column(db.DateTime)  # Quando um worker assumiu o evento
+    trava = db.Column(db.String(32))  # Lote do worker que assumiu o evento
+    processado_em = db.Column(db.DateTime)
+    __table_args__ = (db.Index('ix_webhooks_recebidos_fila', 'status', 'disponivel_em'),)
+
+class WebhookEvento(db.Model):
+    """
+    Registro (só inserção) de cada status de pagamento aplicado a partir de um webhook.
+    Reenvios do gateway caem na chave única e não consultam nem gravam de novo.
+    """
+    __tablename__ = 'webhook_eventos'
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.String(100), nullable=False)
+    action = db.Column(db.String(50), nullable=False, default='')
+    status = db.Column(db.String(30), nullable=False)  # Status no gateway (approved, cancelled...)
+    pedido_id = db.Column(db.Integer, db.ForeignKey('pedidos.id', ondelete='SET NULL'))
+    webhook_id = db.Column(db.Integer, db.ForeignKey('webhooks_recebidos.id', ondelete='SET NULL'))
+    desfecho = db.Column(db.String(20))  # O que foi aplicado ao pedido
+    resposta = db.Column(db.Text)  # JSON devolvido pelo gateway
+    consultado_em = db.Column(db.DateTime, nullable=False)  # Antes da consulta ao gateway
+    __table_args__ = (
+        db.UniqueConstraint('payment_id', 'action', 'status', name='uq_webhook_eventos_chave'),
+    )
+
+class TravaTarefa(db.Model):
+    """
+    Concessão (lease) de uma tarefa periódica: só o nó dono executa, enquanto renovar
+    a trava antes de `expira_em`; `proxima_em` é o agendamento compartilhado pelos nós
+    """
+    __tablename__ = 'travas_tarefas'
+    nome = db.Column(db.String(100), primary_key=True)
+    dono = db.Column(db.String(100))  # host:pid do nó que detém a trava
+    expira_em = db.Column(db.DateTime)
+    proxima_em = db.Column(db.DateTime)
+    renovada_em = db.Column(db.DateTime)
+
+class ExecucaoTarefa(db.Model):
+    """Histórico das execuções do agendador (duração, linhas afetadas, falhas)"""
+    __tablename__ = 'execucoes_tarefas'
+    id = db.Column(db.Integer, primary_key=True)
+    tarefa = db.Column(db.String(100), nullable=False)
+    no = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='executando')  # executando, sucesso, erro
+    iniciada_em = db.Column(db.DateTime, nullable=False)
+    concluida_em = db.Column(db.DateTime)
+    duracao = db.Column(db.Float)  # Segundos
+    linhas = db.Column(db.Integer)  # Registros afetados informados pela tarefa
+    erro = db.Column(db.Text)
+    __table_args__ = (db.Index('ix_execucoes_tarefas_tarefa_inicio', 'tarefa', 'iniciada_em'),)
+
 class Notificacao(db.Model):
     __tablename__ = 'notificacoes'
     id = db.Column(db.Integer, primary_key=True)
@@ -196,7 +339,10 @@ class Review(db.Model):
     nota = db.Column(db.Integer, nullable=False)  # 1-5
     comentario = db.Column(db.Text)
     criado_em = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    __table_args__ = (db.UniqueConstraint('cliente_id', 'produto_id', name='uix_cliente_produto_review'),)
+    __table_args__ = (
+        db.UniqueConstraint('cliente_id', 'produto_id', name='uix_cliente_produto_review'),
+        db.Index('ix_reviews_produto_criado', 'produto_id', 'criado_em', 'id'),
+    )
 
 class PostBlog(db.Model):
     __tablename__ = 'posts_blog'
@@ -236,4 +382,52 @@ class Contato(db.Model):
     email = db.Column(db.String(150), nullable=False)
     mensagem = db.Column(db.Text, nullable=False)
     criado_em = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    respondido = db.Column(db.Boolean, default=False)
\ No newline at end of file
+    respondido = db.Column(db.Boolean, default=False)
+
+# --- Perfis de carregamento (eager loading) ---
+# Cada view usa o perfil correspondente ao que o template percorre, de modo que a
+# página seja montada com um número fixo de consultas, independente da quantidade
+# de linhas (evita N+1 nos relacionamentos lazy).
+# Uso: Pedido.query.options(*PerfisCarregamento.detalhe_pedido())
+
+class PerfisCarregamento:
+
+    @staticmethod
+    def catalogo():
+        """Cards do catálogo: produtor e categoria de cada produto"""
+        return [joinedload(Produto.produtor), joinedload(Produto.categoria)]
+
+    @staticmethod
+    def detalhe_produto():
+        """Página do produto: produtor e categoria"""
+        return [joinedload(Produto.produtor), joinedload(Produto.categoria)]
+
+    @staticmethod
+    def reviews_produto():
+        """Lista de avaliações com o nome do cliente"""
+        return [joinedload(Review.cliente)]
+
+    @staticmethod
+    def pedidos_com_itens():
+        """Listagens de pedidos que exibem os itens (histórico, recompra)"""
+        return [selectinload(Pedido.itens).joinedload(ItemPedido.produto)]
+
+    @staticmethod
+    def detalhe_pedido():
+        """Detalhe/comprovante: cliente, logística e itens com produto e produtor"""
+        return [
+            joinedload(Pedido.cliente).joinedload(Cliente.usuario),
+            joinedload(Pedido.ponto_retirada),
+            joinedload(Pedido.taxa_entrega),
+            selectinload(Pedido.itens).joinedload(ItemPedido.produto).joinedload(Produto.produtor),
+        ]
+
+    @staticmethod
+    def pagamento_pedido():
+        """Página de pagamento: cliente e usuário (dono do pedido e e-mail do pagador)"""
+        return [joinedload(Pedido.cliente).joinedload(Cliente.usuario)]
+
+    @staticmethod
+    def admin_pedidos():
+        """Lista de pedidos do administrador: nome do cliente"""
+        return [joinedload(Pedido.cliente)]
@@ -0,0 +1,279 @@
+"""
+Serviço de agendamento de tarefas periódicas (flask scheduler run)
+Cada tarefa tem uma trava (lease) no banco com validade e renovação periódica:
+com vários nós rodando o agendador, só quem detém a trava executa, e o horário da
+próxima execução fica gravado na própria trava, compartilhado por todos
+"""
+import os
+import random
+import secrets
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models.core import TravaTarefa, ExecucaoTarefa
+
+
+def _agora():
+    """Instante atual em UTC sem fuso, como as datas são gravadas no banco"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def identificador_no():
+    """Dono das travas: host, processo e um sufixo aleatório (PIDs se repetem entre contêineres)"""
+    return f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}'
+
+
+class Tarefa:
+    """
+    Tarefa periódica: `funcao(parar)` roda com contexto de app e retorna as linhas afetadas.
+    `parar` é um threading.Event ligado quando a trava é perdida (outro nó pode já ter
+    assumido a tarefa): a função deve conferi-lo entre lotes e encerrar. O lote em
+    andamento ainda termina, então cada lote precisa ser seguro com outro nó rodando
+    (UPDATEs condicionais, como nas tarefas registradas).
+    `limite()`, se informado, devolve o instante mais tardio para a próxima execução
+    (ou None), antecipando-a quando o intervalo passaria desse ponto.
+    """
+
+    def __init__(self, nome, funcao, intervalo, jitter=0.1, limite=None):
+        self.nome = nome
+        self.funcao = funcao
+        self.intervalo = intervalo
+        self.jitter = jitter
+        self.limite = limite
+
+    def proximo_intervalo(self):
+        """Intervalo com acréscimo aleatório, para os nós não baterem no banco no mesmo segundo"""
+        return timedelta(seconds=self.intervalo * (1 + random.uniform(0, self.jitter)))
+
+    def proxima_execucao(self, concluida_em):
+        """Horário da próxima execução: fim desta mais o intervalo, limitado por `limite()`"""
+        proxima = concluida_em + self.proximo_intervalo()
+        limite = self.limite() if self.limite else None
+        return min(proxima, max(limite, concluida_em)) if limite else proxima
+
+
+# ---------------------- Tarefas registradas ----------------------
+
+def _expirar_pedidos_pix(parar):
+    from app.services.email_service import EmailService
+    from app.services.expiracao_service import expirar_pedidos_pix
+    expirados = expirar_pedidos_pix(parar=parar)
+    EmailService().enfileirar_pedidos_expirados(expirados)
+    return len(expirados)
+
+
+def _verificar_pagamentos(parar):
+    from app.services.email_service import EmailService
+    from app.services.conciliacao_service import conciliar_pagamentos
+
+    def ao_aprovar(pedido):
+        try:
+            EmailService().enviar_confirmacao_pagamento(pedido)
+        except Exception as e:
+            current_app.logger.error(f'Erro ao enviar email do pedido #{pedido.id}: {e}')
+
+    return conciliar_pagamentos(ao_aprovar=ao_aprovar, parar=parar).atualizados
+
+
+def _relatorio_divergencias(parar):
+    # Só leitura (busca no gateway e log): rodar em paralelo com outro nó é inofensivo
+    from app.services.conciliacao_service import relatorio_divergencias
+    fim = _agora()
+    relatorio = relatorio_divergencias(fim - timedelta(days=1), fim)
+    if relatorio is None:
+        return 0
+    for divergencia in relatorio.divergencias:
+        current_app.logger.warning(f'Divergência de pagamento: {divergencia}')
+    return len(relatorio.divergencias)
+
+
+def _atualizar_precos(parar):
+    # Um único UPDATE idempotente: não há lotes entre os quais parar
+    from app.services.preco_service import atualizar_precos_efetivos
+    total = atualizar_precos_efetivos()
+    db.session.commit()
+    return total
+
+
+def _proxima_virada_de_preco():
+    from app.services.preco_service import proxima_virada
+    return proxima_virada(_agora())
+
+
+def tarefas_registradas():
+    """Tarefas dos comandos CLI existentes, com os intervalos de AGENDADOR_*"""
+    config = current_app.config
+    jitter = config.get('AGENDADOR_JITTER', 0.1)
+    return [
+        Tarefa('expirar-pedidos-pix', _expirar_pedidos_pix,
+               config.get('AGENDADOR_INTERVALO_EXPIRAR_PIX', 60), jitter),
+        Tarefa('verificar-pagamentos', _verificar_pagamentos,
+               config.get('AGENDADOR_INTERVALO_VERIFICAR_PAGAMENTOS', 300), jitter),
+        Tarefa('relatorio-divergencias', _relatorio_divergencias,
+               config.get('AGENDADOR_INTERVALO_DIVERGENCIAS', 86400), jitter),
+        # Roda na próxima virada de janela promocional ou, sem viradas próximas, no intervalo
+        Tarefa('atualizar-precos', _atualizar_precos,
+               config.get('AGENDADOR_INTERVALO_ATUALIZAR_PRECOS', 3600), jitter,
+               limite=_proxima_virada_de_preco),
+    ]
+
+
+# ---------------------- Travas ----------------------
+
+def adquirir_trava(nome, dono, ttl, agora=None):
+    """
+    Assume a trava da tarefa se estiver livre (ou vencida) e a execução estiver no
+    horário. Um UPDATE condicional (ou o INSERT da primeira vez) decide entre nós
+    concorrentes: só um recebe rowcount 1.
+
+    Returns:
+        bool: True se este nó deve executar a tarefa agora
+    """
+    agora = agora or _agora()
+    expira_em = agora + timedelta(seconds=ttl)
+    resultado = db.session.execute(
+        db.update(TravaTarefa).where(
+            TravaTarefa.nome == nome,
+            or_(TravaTarefa.expira_em.is_(None), TravaTarefa.expira_em < agora),
+            or_(TravaTarefa.proxima_em.is_(None), TravaTarefa.proxima_em <= agora),
+        ).values(dono=dono, expira_em=expira_em, renovada_em=agora).execution_options(synchronize_session=False)
+    )
+    if resultado.rowcount == 1:
+        db.session.commit()
+        return True
+    existe = db.session.execute(db.select(TravaTarefa.nome).where(TravaTarefa.nome == nome)).first()
+    if existe:
+        db.session.rollback()
+        return False
+    db.session.add(TravaTarefa(nome=nome, dono=dono, expira_em=expira_em, renovada_em=agora))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Outro nó criou a trava ao mesmo tempo
+        db.session.rollback()
+        return False
+    return True
+
+
+def renovar_trava(nome, dono, ttl):
+    """Estende a validade da trava; False se ela venceu e outro nó a assumiu"""
+    agora = _agora()
+    resultado = db.session.execute(
+        db.update(TravaTarefa).where(TravaTarefa.nome == nome, TravaTarefa.dono == dono).values(
+            expira_em=agora + timedelta(seconds=ttl), renovada_em=agora
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return resultado.rowcount == 1
+
+
+def liberar_trava(nome, dono, proxima_em):
+    """Solta a trava e agenda a próxima execução (quem chama faz o commit)"""
+    db.session.execute(
+        db.update(TravaTarefa).where(TravaTarefa.nome == nome, TravaTarefa.dono == dono).values(
+            dono=None, expira_em=None, proxima_em=proxima_em
+        ).execution_options(synchronize_session=False)
+    )
+
+
+class Batimento(threading.Thread):
+    """
+    Renova a trava a cada ttl/3 enquanto a tarefa roda (sessão própria, na thread).
+    Se a trava foi assumida por outro nó, liga `perdida`, que a tarefa recebe como `parar`.
+    """
+
+    def __init__(self, app, nome, dono, ttl):
+        super().__init__(daemon=True)
+        self.app = app
+        self.nome = nome
+        self.dono = dono
+        self.ttl = ttl
+        self.parar = threading.Event()
+        self.perdida = threading.Event()
+
+    def run(self):
+        while not self.parar.wait(self.ttl / 3):
+            with self.app.app_context():
+                try:
+                    if not renovar_trava(self.nome, self.dono, self.ttl):
+                        self.perdida.set()
+                        self.app.logger.warning(f'Trava da tarefa {self.nome} perdida durante a execução')
+                        return
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f'Erro ao renovar trava da tarefa {self.nome}: {e}')
+
+
+# ---------------------- Execução ----------------------
+
+def executar_tarefa(tarefa, dono, ttl=None):
+    """
+    Executa a tarefa se este nó conseguir a trava, registrando a execução
+
+    Returns:
+        ExecucaoTarefa ou None (tarefa fora do horário ou com outro nó)
+    """
+    ttl = ttl or current_app.config.get('AGENDADOR_TRAVA_TTL', 120)
+    if not adquirir_trava(tarefa.nome, dono, ttl):
+        return None
+
+    execucao = ExecucaoTarefa(tarefa=tarefa.nome, no=dono, status='executando', iniciada_em=_agora())
+    db.session.add(execucao)
+    db.session.commit()
+    execucao_id = execucao.id
+
+    batimento = Batimento(current_app._get_current_object(), tarefa.nome, dono, ttl)
+    batimento.start()
+    inicio = time.perf_counter()
+    linhas, erro = None, None
+    try:
+        linhas = tarefa.funcao(batimento.perdida)
+    except Exception as e:
+        db.session.rollback()
+        erro = str(e)
+        current_app.logger.exception(f'Tarefa {tarefa.nome} falhou')
+    finally:
+        batimento.parar.set()
+        batimento.join()
+
+    execucao = db.session.get(ExecucaoTarefa, execucao_id)
+    execucao.concluida_em = _agora()
+    execucao.duracao = time.perf_counter() - inicio
+    execucao.linhas = linhas if isinstance(linhas, int) else None
+    execucao.status = 'erro' if erro else 'sucesso'
+    execucao.erro = erro
+    if batimento.perdida.is_set():
+        execucao.erro = (erro + '; ' if erro else '') + 'trava perdida durante a execução'
+    liberar_trava(tarefa.nome, dono, tarefa.proxima_execucao(execucao.concluida_em))
+    db.session.commit()
+    return execucao
+
+
+def executar_agendador(tarefas, parar, tick=None, uma_vez=False, ao_executar=None):
+    """
+    Laço do agendador: a cada `tick` segundos tenta cada tarefa (um UPDATE por tarefa)
+
+    Args:
+        tarefas: Lista de Tarefa
+        parar: threading.Event que encerra o laço
+        tick: Segundos entre verificações (AGENDADOR_TICK)
+        uma_vez: Faz uma única rodada
+        ao_executar: callback(execucao) após cada execução deste nó
+    """
+    tick = tick or current_app.config.get('AGENDADOR_TICK', 5)
+    dono = identificador_no()
+    current_app.logger.info(f'Agendador iniciado como {dono}')
+    while True:
+        for tarefa in tarefas:
+            if parar.is_set():
+                return
+            execucao = executar_tarefa(tarefa, dono)
+            if execucao and ao_executar:
+                ao_executar(execucao)
+        if uma_vez or parar.wait(tick):
+            return
@@ -0,0 +1,126 @@
+"""
+Serviço de avaliações de produtos
+Mantém os agregados (média, total e histograma) em Produto de forma incremental
+"""
+from datetime import datetime, timezone
+from sqlalchemy import and_, or_, case, cast, func
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models.core import Produto, Review, PerfisCarregamento
+from app.services.catalogo_service import Pagina, codificar_cursor, decodificar_cursor
+
+NOTAS_VALIDAS = range(1, 6)
+
+
+def _atualizar_agregados(produto_id, nota_nova, nota_antiga=None):
+    """
+    UPDATE atômico dos agregados do produto: o banco soma sobre os valores atuais,
+    então avaliações simultâneas não se sobrescrevem.
+    """
+    coluna_nova = getattr(Produto, f'notas_{nota_nova}')
+    if nota_antiga is None:
+        valores = {
+            Produto.total_reviews: Produto.total_reviews + 1,
+            Produto.soma_notas: Produto.soma_notas + nota_nova,
+            coluna_nova: coluna_nova + 1,
+            Produto.media_nota: cast(Produto.soma_notas + nota_nova, db.Float) / (Produto.total_reviews + 1),
+        }
+    else:
+        delta = nota_nova - nota_antiga
+        coluna_antiga = getattr(Produto, f'notas_{nota_antiga}')
+        valores = {
+            Produto.soma_notas: Produto.soma_notas + delta,
+            coluna_nova: coluna_nova + 1,
+            coluna_antiga: coluna_antiga - 1,
+            Produto.media_nota: cast(Produto.soma_notas + delta, db.Float) / func.nullif(Produto.total_reviews, 0),
+        }
+    db.session.query(Produto).filter(Produto.id == produto_id).update(valores, synchronize_session=False)
+
+
+def registrar_avaliacao(produto_id, cliente_id, nota, comentario):
+    """
+    Cria ou atualiza a avaliação do cliente e ajusta os agregados do produto
+    na mesma transação (o commit fica a cargo de quem chama)
+
+    Returns:
+        bool: True se for uma avaliação nova, False se atualizou uma existente
+    """
+    if nota not in NOTAS_VALIDAS:
+        raise ValueError('Nota deve estar entre 1 e 5')
+
+    existente = Review.query.filter_by(cliente_id=cliente_id, produto_id=produto_id).with_for_update().first()
+    if existente:
+        nota_antiga = existente.nota
+        existente.nota = nota
+        existente.comentario = comentario
+        if nota_antiga != nota:
+            _atualizar_agregados(produto_id, nota, nota_antiga)
+        else:
+            # Só o comentário mudou: avança a versão da página do produto
+            db.session.query(Produto).filter(Produto.id == produto_id).update(
+                {Produto.atualizado_em: datetime.now(timezone.utc)}, synchronize_session=False
+            )
+        return False
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(Review(cliente_id=cliente_id, produto_id=produto_id, nota=nota, comentario=comentario))
+    except IntegrityError:
+        # Outra requisição do mesmo cliente inseriu primeiro: vira atualização
+        return registrar_avaliacao(produto_id, cliente_id, nota, comentario)
+    _atualizar_agregados(produto_id, nota)
+    return True
+
+
+def recalcular_agregados():
+    """
+    Reconstrói média, total e histograma de todos os produtos a partir de `reviews`
+
+    Returns:
+        int: Quantidade de produtos com avaliações
+    """
+    colunas = [func.sum(case((Review.nota == nota, 1), else_=0)) for nota in NOTAS_VALIDAS]
+    linhas = db.session.query(
+        Review.produto_id, func.count(Review.id), func.sum(Review.nota), *colunas
+    ).group_by(Review.produto_id).all()
+
+    zerar = {Produto.media_nota: 0.0, Produto.total_reviews: 0, Produto.soma_notas: 0}
+    zerar.update({getattr(Produto, f'notas_{nota}'): 0 for nota in NOTAS_VALIDAS})
+    db.session.query(Produto).update(zerar, synchronize_session=False)
+
+    registros = []
+    for produto_id, total, soma, *histograma in linhas:
+        registro = {'id': produto_id, 'total_reviews': total, 'soma_notas': soma, 'media_nota': soma / total}
+        registro.update({f'notas_{nota}': histograma[nota - 1] for nota in NOTAS_VALIDAS})
+        registros.append(registro)
+    if registros:
+        db.session.execute(db.update(Produto), registros)
+    return len(registros)
+
+
+def pagina_reviews(produto_id, cursor=None, por_pagina=10):
+    """
+    Avaliações do produto, mais recentes primeiro, paginadas por cursor (criado_em, id)
+
+    Returns:
+        Pagina (só navega para frente: `proximo` aponta para avaliações mais antigas)
+    """
+    query = Review.query.options(*PerfisCarregamento.reviews_produto()).filter(Review.produto_id == produto_id)
+    posicao = decodificar_cursor(cursor)
+    if posicao:
+        try:
+            criado_em = datetime.fromisoformat(posicao[0])
+        except (TypeError, ValueError):
+            criado_em = None
+        if criado_em:
+            query = query.filter(or_(
+                Review.criado_em < criado_em,
+                and_(Review.criado_em == criado_em, Review.id < posicao[1])
+            ))
+    reviews = query.order_by(Review.criado_em.desc(), Review.id.desc()).limit(por_pagina + 1).all()
+    proximo = None
+    if len(reviews) > por_pagina:
+        reviews = reviews[:por_pagina]
+        ultimo = reviews[-1]
+        proximo = codificar_cursor(ultimo.criado_em.isoformat(), ultimo.id, 'prox')
+    return Pagina(reviews, proximo=proximo)
@@ -0,0 +1,246 @@
+"""
+Serviço de busca textual do catálogo
+Mantém um índice full-text de produtos: FTS5 no SQLite e tsvector/GIN no PostgreSQL
+"""
+import re
+import unicodedata
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+from app.extensions import db
+from app.models.core import Produto, Produtor
+
+
+# Estrutura do índice por banco; a migração c1f3a9d2e4b7 cria a mesma estrutura
+DDL_INDICE = {
+    'sqlite': (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5("
+        "nome, descricao, tags, subcategoria, origem, produtor, "
+        "tokenize = 'unicode61 remove_diacritics 2')",
+    ),
+    'postgresql': (
+        "CREATE TABLE IF NOT EXISTS produtos_busca ("
+        "produto_id INTEGER PRIMARY KEY REFERENCES produtos(id) ON DELETE CASCADE, "
+        "documento TSVECTOR NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS ix_produtos_busca_documento ON produtos_busca USING GIN (documento)",
+    ),
+}
+
+
+@event.listens_for(Produto.__table__, 'after_create')
+def _criar_indice(tabela, conexao, **kwargs):
+    """db.create_all() (banco novo sem migrações, testes) cria o índice vazio junto com a tabela"""
+    comandos = DDL_INDICE.get(conexao.dialect.name)
+    if not comandos:
+        return
+    for comando in comandos:
+        conexao.execute(text(comando))
+    if has_app_context():
+        current_app.extensions['busca_produtos'] = True
+
+
+@event.listens_for(Produto.__table__, 'after_drop')
+def _remover_indice(tabela, conexao, **kwargs):
+    if conexao.dialect.name == 'sqlite':
+        conexao.execute(text('DROP TABLE IF EXISTS produtos_fts'))
+    elif conexao.dialect.name == 'postgresql':
+        conexao.execute(text('DROP TABLE IF EXISTS produtos_busca'))
+    if has_app_context():
+        current_app.extensions['busca_produtos'] = False
+
+
+def normalizar_texto(texto):
+    """Remove acentos e converte para minúsculas (ex: 'Orgânico' -> 'organico')"""
+    if not texto:
+        return ''
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii')
+    return texto.lower()
+
+
+def extrair_termos(texto):
+    """Quebra o texto normalizado em termos de busca"""
+    return re.findall(r'\w+', normalizar_texto(texto))
+
+
+class BuscaService:
+    """
+    Índice full-text sobre nome, descrição, tags, subcategoria, origem e nome do produtor.
+
+    SQLite: tabela virtual FTS5 `produtos_fts` (rowid = produtos.id), ranqueada por bm25.
+    PostgreSQL: tabela `produtos_busca` com coluna tsvector e índice GIN, ranqueada por ts_rank.
+    Em outros bancos (ou SQLite sem FTS5) a busca cai para ILIKE.
+    """
+
+    # Pesos por coluna: nome, descricao, tags, subcategoria, origem, produtor
+    PESOS_BM25 = (10.0, 1.0, 5.0, 2.0, 2.0, 3.0)
+
+    def __init__(self):
+        self.dialeto = db.engine.dialect.name
+        self.disponivel = current_app.extensions.get('busca_produtos', False)
+
+    @staticmethod
+    def verificar_indice(app):
+        """
+        Confere, na inicialização, se o índice existe. Só leitura: a estrutura e a carga
+        inicial vêm da migração c1f3a9d2e4b7 e a reconstrução de `flask cli reindexar-busca`.
+        Sem o índice a busca cai para ILIKE.
+        """
+        dialeto = db.engine.dialect.name
+        if dialeto not in DDL_INDICE:
+            app.extensions['busca_produtos'] = False
+            return
+        try:
+            with db.engine.connect() as conn:
+                if dialeto == 'sqlite':
+                    existe = conn.execute(text(
+                        "SELECT 1 FROM sqlite_master WHERE name = 'produtos_fts'"
+                    )).first() is not None
+                else:
+                    existe = conn.execute(text("SELECT to_regclass('produtos_busca')")).scalar() is not None
+        except Exception as e:
+            app.logger.warning(f'Índice full-text indisponível, usando ILIKE: {e}')
+            existe = False
+        else:
+            if not existe:
+                app.logger.warning('Índice full-text ausente (rode `flask db upgrade`); a busca usa ILIKE')
+        app.extensions['busca_produtos'] = existe
+
+    def _documento(self, produto, nome_produtor=None):
+        if nome_produtor is None and produto.produtor_id:
+            produtor = db.session.get(Produtor, produto.produtor_id)
+            nome_produtor = produtor.nome if produtor else ''
+        return {
+            'id': produto.id,
+            'nome': normalizar_texto(produto.nome),
+            'descricao': normalizar_texto(produto.descricao),
+            'tags': normalizar_texto(produto.tags),
+            'subcategoria': normalizar_texto(produto.subcategoria),
+            'origem': normalizar_texto(produto.origem),
+            'produtor': normalizar_texto(nome_produtor),
+        }
+
+    def _gravar(self, documentos):
+        if not documentos:
+            return
+        if self.dialeto == 'sqlite':
+            db.session.execute(
+                text('DELETE FROM produtos_fts WHERE rowid = :id'),
+                [{'id': d['id']} for d in documentos]
+            )
+            db.session.execute(text(
+                'INSERT INTO produtos_fts (rowid, nome, descricao, tags, subcategoria, origem, produtor) '
+                'VALUES (:id, :nome, :descricao, :tags, :subcategoria, :origem, :produtor)'
+            ), documentos)
+        else:
+            db.session.execute(text(
+                "INSERT INTO produtos_busca (produto_id, documento) VALUES (:id, "
+                "setweight(to_tsvector('portuguese', :nome), 'A') || "
+                "setweight(to_tsvector('portuguese', :tags), 'B') || "
+                "setweight(to_tsvector('portuguese', :produtor), 'B') || "
+                "setweight(to_tsvector('portuguese', :subcategoria), 'C') || "
+                "setweight(to_tsvector('portuguese', :origem), 'C') || "
+                "setweight(to_tsvector('portuguese', :descricao), 'D')) "
+                "ON CONFLICT (produto_id) DO UPDATE SET documento = EXCLUDED.documento"
+            ), documentos)
+
+    def indexar_produto(self, produto):
+        """
+        Atualiza o documento de um produto no índice (chamar após flush, antes do commit)
+
+        Args:
+            produto: Objeto Produto já com id
+        """
+        if not self.disponivel:
+            return
+        self._gravar([self._documento(produto)])
+
+    def indexar_produtos_do_produtor(self, produtor):
+        """Reindexa os produtos de um produtor (ex: após troca de nome)"""
+        if not self.disponivel:
+            return
+        produtos = Produto.query.filter_by(produtor_id=produtor.id).all()
+        self._gravar([self._documento(p, produtor.nome) for p in produtos])
+
+    def remover_produto(self, produto_id):
+        """Remove um produto do índice"""
+        if not self.disponivel:
+            return
+        if self.dialeto == 'sqlite':
+            db.session.execute(text('DELETE FROM produtos_fts WHERE rowid = :id'), {'id': produto_id})
+        else:
+            db.session.execute(text('DELETE FROM produtos_busca WHERE produto_id = :id'), {'id': produto_id})
+
+    def reconstruir_indice(self):
+        """
+        Reconstrói o índice inteiro a partir da tabela de produtos
+
+        Returns:
+            int: Quantidade de produtos indexados
+        """
+        if not self.disponivel:
+            return 0
+        if self.dialeto == 'sqlite':
+            db.session.execute(text('DELETE FROM produtos_fts'))
+        else:
+            db.session.execute(text('DELETE FROM produtos_busca'))
+        linhas = db.session.query(Produto, Produtor.nome).outerjoin(
+            Produtor, Produtor.id == Produto.produtor_id
+        ).all()
+        self._gravar([self._documento(p, nome or '') for p, nome in linhas])
+        return len(linhas)
+
+    def ranking(self, termo):
+        """
+        Monta a subquery (produto_id, rank) para o termo buscado.
+        Menor rank = mais relevante. Cada termo é tratado como prefixo.
+
+        Returns:
+            Subquery ou None se o índice não estiver disponível / termo vazio
+        """
+        termos = extrair_termos(termo)
+        if not self.disponivel or not termos:
+            return None
+        if self.dialeto == 'sqlite':
+            consulta = ' '.join(f'"{t}"*' for t in termos)
+            pesos = ', '.join(str(p) for p in self.PESOS_BM25)
+            sql = text(
+                f'SELECT rowid AS produto_id, bm25(produtos_fts, {pesos}) AS rank '
+                'FROM produtos_fts WHERE produtos_fts MATCH :consulta'
+            )
+        else:
+            consulta = ' & '.join(f'{t}:*' for t in termos)
+            sql = text(
+                "SELECT produto_id, -ts_rank(documento, to_tsquery('portuguese', :consulta)) AS rank "
+                "FROM produtos_busca WHERE documento @@ to_tsquery('portuguese', :consulta)"
+            )
+        return sql.bindparams(consulta=consulta).columns(
+            produto_id=db.Integer, rank=db.Float
+        ).subquery('busca')
+
+    def criterio(self, termo):
+        """
+        Expressão de filtro para o termo: `id IN (índice)` ou ILIKE quando
+        o índice não está disponível. Usado pelo filtro do catálogo.
+        """
+        ranking = self.ranking(termo)
+        if ranking is None:
+            return (
+                Produto.nome.ilike(f'%{termo}%') |
+                Produto.tags.ilike(f'%{termo}%') |
+                Produto.produtor.has(Produtor.nome.ilike(f'%{termo}%'))
+            )
+        return Produto.id.in_(db.select(ranking.c.produto_id))
+
+    def aplicar_busca(self, query, termo):
+        """
+        Filtra a query de produtos pelo termo, ordenando por relevância
+
+        Args:
+            query: Query de Produto
+            termo: Texto digitado pelo usuário (parâmetro `busca`)
+        """
+        ranking = self.ranking(termo)
+        if ranking is None:
+            return query.filter(self.criterio(termo))
+        return query.join(ranking, ranking.c.produto_id == Produto.id).order_by(
+            ranking.c.rank.asc(), Produto.id.asc()
+        )
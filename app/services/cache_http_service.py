@@ -0,0 +1,86 @@
+"""
+Serviço de GET condicional (ETag / Last-Modified)
+Responde 304 a partir de uma consulta leve de versão, antes de carregar e renderizar a página
+"""
+import hashlib
+import time
+from datetime import timezone
+from functools import wraps
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+
+def _em_utc(momento):
+    """Datas gravadas sem fuso (SQLite) são UTC"""
+    if momento is None:
+        return None
+    if momento.tzinfo is None:
+        return momento.replace(tzinfo=timezone.utc)
+    return momento.astimezone(timezone.utc)
+
+
+def _contexto_sessao():
+    """
+    Partes da página que dependem de quem acessa: usuário logado (menus, formulários)
+    e o token CSRF embutido nos formulários, renovado a cada metade de WTF_CSRF_TIME_LIMIT
+    para que uma cópia revalidada nunca traga um token prestes a expirar.
+    """
+    if current_user.is_authenticated:
+        usuario = (current_user.id, current_user.tipo_usuario)
+    else:
+        usuario = None
+    limite = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600) or 0
+    janela = int(time.time() // max(limite // 2, 1)) if limite else 0
+    return usuario, session.get('csrf_token'), janela
+
+
+def calcular_etag(*partes):
+    """ETag forte a partir da versão do conteúdo e do contexto da sessão"""
+    bruto = repr((partes, _contexto_sessao())).encode()
+    return hashlib.sha1(bruto).hexdigest()
+
+
+def condicional(versao):
+    """
+    Decorator de GET condicional para páginas públicas.
+
+    Args:
+        versao: Função que recebe os mesmos argumentos da view e retorna
+            (partes, ultima_modificacao) com consultas só de colunas de versão,
+            ou None quando o registro não existe (a view trata o 404).
+
+    Se o cliente já tem a versão atual (If-None-Match / If-Modified-Since),
+    responde 304 sem executar a view. Páginas com mensagens flash pendentes
+    não recebem validadores, pois o conteúdo é de exibição única.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+            resultado = versao(*args, **kwargs)
+            if resultado is None:
+                return view(*args, **kwargs)
+            partes, ultima_modificacao = resultado
+            etag = calcular_etag(request.full_path, *partes)
+            ultima_modificacao = _em_utc(ultima_modificacao)
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=ultima_modificacao):
+                resposta = current_app.response_class(status=304)
+            else:
+                resposta = make_response(view(*args, **kwargs))
+                if resposta.status_code != 200:
+                    return resposta
+                # A renderização pode ter criado o token CSRF da sessão
+                etag = calcular_etag(request.full_path, *partes)
+            resposta.set_etag(etag)
+            if ultima_modificacao:
+                resposta.last_modified = ultima_modificacao
+            # Conteúdo varia por sessão: só o navegador guarda, sempre revalidando
+            resposta.cache_control.private = True
+            resposta.cache_control.no_cache = True
+            resposta.vary.add('Cookie')
+            return resposta
+        return wrapper
+    return decorator
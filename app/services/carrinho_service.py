@@ -0,0 +1,273 @@
+"""
+Serviço de carrinho
+Guarda o carrinho no banco (por usuário ou, antes do login, por token na sessão),
+hidrata as linhas em uma única consulta e calcula preços, subtotais e mínimos
+por categoria para carrinho e checkout
+"""
+import secrets
+from datetime import datetime, timezone
+from flask import g, session
+from flask_login import current_user
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models.core import Produto, Carrinho, ItemCarrinho
+from app.services import referencia_service as dados_referencia
+
+# Chave da sessão com o token do carrinho de visitantes não logados
+CHAVE_TOKEN = 'carrinho_token'
+
+
+class LinhaCarrinho:
+    """Produto do carrinho com a quantidade e o preço vigente"""
+
+    def __init__(self, produto, quantidade):
+        self.produto = produto
+        self.quantidade = quantidade
+        # Mesmo valor materializado que o catálogo exibe, filtra e ordena
+        self.preco_unitario = produto.preco_efetivo if produto.preco_efetivo is not None else produto.preco
+        self.subtotal = self.preco_unitario * quantidade
+
+
+class CarrinhoPrecificado:
+    """
+    Carrinho já carregado e precificado, compartilhado pela página do carrinho,
+    pela validação de mínimos e pela criação dos itens do pedido
+    """
+
+    def __init__(self, linhas):
+        self.linhas = linhas
+        self.subtotal = sum(linha.subtotal for linha in linhas)
+
+    def __iter__(self):
+        return iter(self.linhas)
+
+    def __len__(self):
+        return len(self.linhas)
+
+    def por_categoria(self):
+        """
+        Returns:
+            dict: {categoria_id: {'categoria': CategoriaRef, 'valor': float, 'quantidade': float}}
+            (categorias vêm do cache de dados de referência, sem consulta)
+        """
+        agregados = {}
+        for linha in self.linhas:
+            dados = agregados.setdefault(linha.produto.categoria_id, {
+                'categoria': dados_referencia.categoria(linha.produto.categoria_id), 'valor': 0, 'quantidade': 0
+            })
+            dados['valor'] += linha.subtotal
+            dados['quantidade'] += linha.quantidade
+        return agregados
+
+    def minimos_nao_atendidos(self):
+        """Mensagens dos mínimos de valor/quantidade por categoria que o carrinho não atinge"""
+        mensagens = []
+        for dados in self.por_categoria().values():
+            categoria = dados['categoria']
+            if not categoria:
+                continue
+            if categoria.valor_minimo and dados['valor'] < categoria.valor_minimo:
+                mensagens.append(f"{categoria.nome} valor mínimo R$ {categoria.valor_minimo:.2f}")
+            if categoria.quantidade_minima and dados['quantidade'] < categoria.quantidade_minima:
+                mensagens.append(f"{categoria.nome} quantidade mínima {categoria.quantidade_minima}")
+        return mensagens
+
+
+def hidratar_carrinho(quantidades):
+    """
+    Carrega todos os produtos do carrinho em uma consulta IN
+
+    Args:
+        quantidades: {produto_id: quantidade}, chaves int ou str (formato da sessão)
+
+    Returns:
+        CarrinhoPrecificado (produtos inexistentes são ignorados)
+    """
+    ids = {}
+    for produto_id, quantidade in quantidades.items():
+        try:
+            ids[int(produto_id)] = quantidade
+        except (TypeError, ValueError):
+            continue
+    if not ids:
+        return CarrinhoPrecificado([])
+    produtos = Produto.query.filter(Produto.id.in_(ids)).all()
+    por_id = {produto.id: produto for produto in produtos}
+    linhas = [LinhaCarrinho(por_id[pid], qtd) for pid, qtd in ids.items() if pid in por_id]
+    return CarrinhoPrecificado(linhas)
+
+
+# ---------------------- Carrinho persistente ----------------------
+
+def _quantidade_legada(valor):
+    """Quantidade do antigo carrinho em cookie: número ou {'quantidade': n}"""
+    if isinstance(valor, dict):
+        valor = valor.get('quantidade')
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _criar_carrinho(**chave):
+    # Savepoint: outra requisição do mesmo usuário pode criar o carrinho ao mesmo tempo
+    try:
+        with db.session.begin_nested():
+            carrinho = Carrinho(**chave)
+            db.session.add(carrinho)
+        return carrinho
+    except IntegrityError:
+        return Carrinho.query.filter_by(**chave).one()
+
+
+def carrinho_atual(criar=False):
+    """
+    Carrinho de quem faz a requisição (cacheado em `g` durante a requisição)
+
+    Args:
+        criar: Cria o carrinho (e o token do visitante) se ainda não existir
+
+    Returns:
+        Carrinho ou None
+    """
+    carrinho = g.get('_carrinho')
+    if carrinho is None:
+        if current_user.is_authenticated:
+            chave = {'usuario_id': current_user.id}
+        elif session.get(CHAVE_TOKEN):
+            chave = {'token': session[CHAVE_TOKEN]}
+        else:
+            chave = None
+        if chave:
+            carrinho = Carrinho.query.filter_by(**chave).first()
+        if carrinho is None and (criar or session.get('carrinho')):
+            if chave is None:
+                session[CHAVE_TOKEN] = secrets.token_urlsafe(32)
+                chave = {'token': session[CHAVE_TOKEN]}
+            carrinho = _criar_carrinho(**chave)
+        g._carrinho = carrinho
+        # Migra o carrinho antigo guardado no cookie da sessão. A migração pode
+        # acontecer em um GET (que não faz commit), então é confirmada aqui mesmo e
+        # o cookie só perde o carrinho depois que as linhas estão gravadas
+        legado = session.get('carrinho')
+        if carrinho is not None and legado:
+            adicionar_itens(carrinho, {pid: _quantidade_legada(qtd) for pid, qtd in legado.items()})
+            db.session.commit()
+        session.pop('carrinho', None)
+    return carrinho
+
+
+def quantidades_carrinho(carrinho=None):
+    """
+    Returns:
+        dict: {produto_id: quantidade} do carrinho atual (uma consulta por requisição)
+    """
+    quantidades = g.get('_carrinho_quantidades')
+    if quantidades is None:
+        carrinho = carrinho or carrinho_atual()
+        quantidades = {}
+        if carrinho is not None and carrinho.id is not None:
+            quantidades = dict(db.session.query(ItemCarrinho.produto_id, ItemCarrinho.quantidade).filter(
+                ItemCarrinho.carrinho_id == carrinho.id
+            ).order_by(ItemCarrinho.produto_id).all())
+        g._carrinho_quantidades = quantidades
+    return quantidades
+
+
+def _alterado(carrinho):
+    carrinho.atualizado_em = datetime.now(timezone.utc)
+    g.pop('_carrinho_quantidades', None)
+
+
+def adicionar_itens(carrinho, quantidades, somar=True):
+    """
+    Upsert em lote das linhas do carrinho (um único INSERT ... ON CONFLICT no
+    SQLite/PostgreSQL). Quantidades menores ou iguais a zero são ignoradas.
+
+    Args:
+        quantidades: {produto_id: quantidade}
+        somar: Soma à quantidade existente (True) ou substitui (False)
+    """
+    pedidas = {}
+    for produto_id, quantidade in quantidades.items():
+        try:
+            produto_id = int(produto_id)
+        except (TypeError, ValueError):
+            continue
+        if quantidade and quantidade > 0:
+            pedidas[produto_id] = quantidade
+    if not pedidas:
+        return
+    # Só produtos existentes (o id vem do formulário ou de um pedido antigo)
+    ids = {pid for (pid,) in db.session.query(Produto.id).filter(Produto.id.in_(pedidas))}
+    linhas = [
+        {'carrinho_id': carrinho.id, 'produto_id': pid, 'quantidade': qtd}
+        for pid, qtd in pedidas.items() if pid in ids
+    ]
+    if not linhas:
+        return
+
+    tabela = ItemCarrinho.__table__
+    dialeto = db.engine.dialect.name
+    if dialeto in ('sqlite', 'postgresql'):
+        insert = sqlite_insert if dialeto == 'sqlite' else pg_insert
+        stmt = insert(tabela).values(linhas)
+        nova = tabela.c.quantidade + stmt.excluded.quantidade if somar else stmt.excluded.quantidade
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[tabela.c.carrinho_id, tabela.c.produto_id], set_={'quantidade': nova}
+        ))
+    else:
+        atuais = {item.produto_id: item for item in ItemCarrinho.query.filter(
+            ItemCarrinho.carrinho_id == carrinho.id,
+            ItemCarrinho.produto_id.in_([linha['produto_id'] for linha in linhas])
+        )}
+        for linha in linhas:
+            item = atuais.get(linha['produto_id'])
+            if item is None:
+                db.session.add(ItemCarrinho(**linha))
+            else:
+                item.quantidade = item.quantidade + linha['quantidade'] if somar else linha['quantidade']
+    _alterado(carrinho)
+
+
+def definir_quantidade(carrinho, produto_id, quantidade):
+    """Altera a quantidade de uma linha (zero ou menos remove)"""
+    if quantidade > 0:
+        adicionar_itens(carrinho, {produto_id: quantidade}, somar=False)
+    else:
+        remover_item(carrinho, produto_id)
+
+
+def remover_item(carrinho, produto_id):
+    ItemCarrinho.query.filter_by(carrinho_id=carrinho.id, produto_id=produto_id).delete()
+    _alterado(carrinho)
+
+
+def esvaziar_carrinho(carrinho):
+    ItemCarrinho.query.filter_by(carrinho_id=carrinho.id).delete()
+    _alterado(carrinho)
+
+
+def mesclar_carrinho_anonimo(usuario):
+    """
+    Após o login, soma as linhas do carrinho do visitante ao carrinho do usuário
+    e descarta o carrinho anônimo (o commit fica a cargo de quem chama)
+    """
+    token = session.pop(CHAVE_TOKEN, None)
+    legado = session.pop('carrinho', None)
+    anonimo = Carrinho.query.filter_by(token=token).first() if token else None
+    quantidades = {pid: _quantidade_legada(qtd) for pid, qtd in (legado or {}).items()}
+    if anonimo is not None:
+        for produto_id, quantidade in db.session.query(ItemCarrinho.produto_id, ItemCarrinho.quantidade).filter(
+            ItemCarrinho.carrinho_id == anonimo.id
+        ):
+            quantidades[produto_id] = quantidades.get(produto_id, 0) + quantidade
+        db.session.delete(anonimo)
+    g.pop('_carrinho', None)
+    g.pop('_carrinho_quantidades', None)
+    if not quantidades:
+        return
+    carrinho = Carrinho.query.filter_by(usuario_id=usuario.id).first() or _criar_carrinho(usuario_id=usuario.id)
+    adicionar_itens(carrinho, quantidades)
@@ -0,0 +1,332 @@
+"""
+Serviço de consulta do catálogo de produtos
+Centraliza os filtros do catálogo, a paginação por cursor (keyset) e as facetas
+"""
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from sqlalchemy import and_, or_, case, event, func, literal_column
+from app.extensions import db
+from app.models.core import Produto, Produtor, Tag, ProdutoTag, PerfisCarregamento
+from app.services.busca_service import BuscaService, normalizar_texto
+from app.services.tag_service import slug_tag, criterio_tag, SLUG_ORGANICO
+
+
+class FiltrosCatalogo:
+    """
+    Filtros aceitos pelo catálogo (mesmos parâmetros da querystring)
+    """
+
+    ORDENS = ('relevancia', 'nome', 'preco', 'preco_desc')
+
+    def __init__(self, busca='', categoria_id=None, produtor='', preco_min=None,
+                 preco_max=None, tag='', so_organico=False, ordem=None):
+        self.busca = (busca or '').strip()
+        self.categoria_id = categoria_id
+        self.produtor = (produtor or '').strip()
+        self.preco_min = preco_min
+        self.preco_max = preco_max
+        self.tag = (tag or '').strip()
+        self.so_organico = bool(so_organico)
+        if ordem not in self.ORDENS or (ordem == 'relevancia' and not self.busca):
+            ordem = 'relevancia' if self.busca else 'nome'
+        self.ordem = ordem
+
+    @classmethod
+    def do_request(cls, args):
+        """Monta os filtros a partir de request.args"""
+        return cls(
+            busca=args.get('busca', ''),
+            categoria_id=args.get('categoria_id', type=int),
+            produtor=args.get('produtor', ''),
+            preco_min=args.get('preco_min', type=float),
+            preco_max=args.get('preco_max', type=float),
+            tag=args.get('tag', ''),
+            so_organico=args.get('so_organico'),
+            ordem=args.get('ordem'),
+        )
+
+    def chave(self, ignorar=()):
+        """Chave normalizada dos filtros (sem ordenação), usada como chave de cache"""
+        valores = (
+            ('busca', normalizar_texto(self.busca)),
+            ('categoria_id', self.categoria_id),
+            ('produtor', self.produtor.lower()),
+            ('preco', (self.preco_min, self.preco_max)),
+            ('tag', slug_tag(self.tag)),
+            ('so_organico', self.so_organico),
+        )
+        return tuple(v for nome, v in valores if nome not in ignorar)
+
+    def criterios(self, ignorar=()):
+        """
+        Lista de expressões WHERE para os filtros ativos
+
+        Args:
+            ignorar: Nomes de filtros a não aplicar (ex: {'busca'})
+        """
+        criterios = []
+        if self.busca and 'busca' not in ignorar:
+            criterios.append(BuscaService().criterio(self.busca))
+        if self.categoria_id and 'categoria_id' not in ignorar:
+            criterios.append(Produto.categoria_id == self.categoria_id)
+        if self.produtor and 'produtor' not in ignorar:
+            criterios.append(Produto.produtor.has(Produtor.nome.ilike(f'%{self.produtor}%')))
+        if self.preco_min is not None and 'preco' not in ignorar:
+            criterios.append(Produto.preco_efetivo >= self.preco_min)
+        if self.preco_max is not None and 'preco' not in ignorar:
+            criterios.append(Produto.preco_efetivo <= self.preco_max)
+        if self.tag and 'tag' not in ignorar:
+            criterios.append(criterio_tag(slug_tag(self.tag)))
+        if self.so_organico and 'so_organico' not in ignorar:
+            criterios.append(criterio_tag(SLUG_ORGANICO))
+        return criterios
+
+
+class Pagina:
+    """Janela de resultados com cursores para a próxima página e a anterior"""
+
+    def __init__(self, itens, proximo=None, anterior=None):
+        self.itens = itens
+        self.proximo = proximo
+        self.anterior = anterior
+
+
+def codificar_cursor(valor, produto_id, direcao):
+    bruto = json.dumps({'v': valor, 'id': produto_id, 'd': direcao}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, tipos=(str, int, float)):
+    """
+    Retorna (valor, id, direcao) ou None se o cursor for inválido (inclusive
+    quando o valor não é de um dos `tipos` da coluna de ordenação)
+    """
+    if not cursor:
+        return None
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        dados = json.loads(bruto)
+        valor = dados['v']
+        if not isinstance(valor, tipos) or isinstance(valor, bool):
+            return None
+        direcao = dados['d'] if dados['d'] in ('prox', 'ant') else 'prox'
+        return valor, int(dados['id']), direcao
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def consultar_pagina(filtros, cursor=None, por_pagina=None):
+    """
+    Busca uma página do catálogo usando keyset pagination sobre (ordem, id).
+    O custo de qualquer página é o mesmo da primeira: não há OFFSET.
+
+    Args:
+        filtros: FiltrosCatalogo
+        cursor: Cursor opaco devolvido em uma página anterior
+        por_pagina: Tamanho da janela (padrão CATALOGO_POR_PAGINA)
+
+    Returns:
+        Pagina
+    """
+    por_pagina = por_pagina or current_app.config.get('CATALOGO_POR_PAGINA', 24)
+    query = Produto.query.options(*PerfisCarregamento.catalogo())
+
+    if filtros.ordem == 'relevancia':
+        ranking = BuscaService().ranking(filtros.busca)
+        if ranking is not None:
+            query = query.join(ranking, ranking.c.produto_id == Produto.id)
+            coluna, tipos = ranking.c.rank, (int, float)
+            query = query.filter(*filtros.criterios(ignorar={'busca'}))
+        else:
+            coluna, tipos = Produto.nome, (str,)
+            query = query.filter(*filtros.criterios())
+    elif filtros.ordem in ('preco', 'preco_desc'):
+        coluna, tipos = Produto.preco_efetivo, (int, float)
+        query = query.filter(*filtros.criterios())
+    else:
+        coluna, tipos = Produto.nome, (str,)
+        query = query.filter(*filtros.criterios())
+    descendente = filtros.ordem == 'preco_desc'
+
+    posicao = decodificar_cursor(cursor, tipos)
+    direcao = posicao[2] if posicao else 'prox'
+    # Voltando uma página, percorre-se a ordem invertida e reverte-se o resultado
+    crescente = (direcao == 'prox') != descendente
+    if posicao:
+        valor, ultimo_id = posicao[0], posicao[1]
+        if crescente:
+            query = query.filter(or_(coluna > valor, and_(coluna == valor, Produto.id > ultimo_id)))
+        else:
+            query = query.filter(or_(coluna < valor, and_(coluna == valor, Produto.id < ultimo_id)))
+    if crescente:
+        query = query.order_by(coluna.asc(), Produto.id.asc())
+    else:
+        query = query.order_by(coluna.desc(), Produto.id.desc())
+
+    linhas = query.add_columns(coluna).limit(por_pagina + 1).all()
+    tem_mais = len(linhas) > por_pagina
+    linhas = linhas[:por_pagina]
+    if direcao == 'ant':
+        linhas.reverse()
+
+    itens = [produto for produto, _ in linhas]
+    proximo = anterior = None
+    if linhas:
+        primeiro, ultimo = linhas[0], linhas[-1]
+        if tem_mais or direcao == 'ant':
+            proximo = codificar_cursor(ultimo[1], ultimo[0].id, 'prox')
+        if posicao and (tem_mais or direcao == 'prox'):
+            anterior = codificar_cursor(primeiro[1], primeiro[0].id, 'ant')
+    return Pagina(itens, proximo=proximo, anterior=anterior)
+
+
+# ---------------------- Facetas ----------------------
+
+# Limites inferiores das faixas de preço (R$); a última faixa é aberta
+FAIXAS_PRECO = (0, 5, 10, 20, 50)
+
+
+def _cache_facetas():
+    """Cache por aplicação: (lock, OrderedDict chave -> (instante, linhas))"""
+    return current_app.extensions.setdefault('facetas_catalogo', (threading.Lock(), OrderedDict()))
+
+
+def _contagens_agrupadas(filtros):
+    """
+    Uma única consulta agrupada por (categoria, produtor, faixa de preço, orgânico)
+    sobre os produtos que atendem aos filtros, exceto o de categoria.
+    """
+    faixa = case(
+        *[(Produto.preco_efetivo < literal_column(str(limite)), i) for i, limite in enumerate(FAIXAS_PRECO[1:])],
+        else_=len(FAIXAS_PRECO) - 1
+    )
+    organicos = db.session.query(ProdutoTag.produto_id).join(
+        Tag, Tag.id == ProdutoTag.tag_id
+    ).filter(Tag.slug == SLUG_ORGANICO).subquery()
+    organico = case((organicos.c.produto_id.isnot(None), 1), else_=0)
+    linhas = db.session.query(
+        Produto.categoria_id, Produtor.id, Produtor.nome, faixa, organico, func.count(Produto.id)
+    ).join(Produtor, Produtor.id == Produto.produtor_id).outerjoin(
+        organicos, organicos.c.produto_id == Produto.id
+    ).filter(
+        *filtros.criterios(ignorar={'categoria_id'})
+    ).group_by(
+        Produto.categoria_id, Produtor.id, Produtor.nome, faixa, organico
+    ).all()
+    return [tuple(linha) for linha in linhas]
+
+
+def calcular_facetas(filtros):
+    """
+    Contagens para a barra lateral do catálogo, respeitando os filtros atuais.
+    A faceta de categoria ignora a própria seleção (para mostrar as alternativas);
+    as demais consideram a categoria escolhida.
+
+    Linhas agrupadas ficam em cache por chave normalizada de filtros
+    (CATALOGO_FACETAS_TTL segundos, por processo).
+
+    Returns:
+        dict com total, categorias {id: n}, faixas_preco, produtores, organicos, nao_organicos
+    """
+    chave = filtros.chave(ignorar={'categoria_id'})
+    ttl = current_app.config.get('CATALOGO_FACETAS_TTL', 60)
+    agora = time.monotonic()
+    lock, cache = _cache_facetas()
+    with lock:
+        entrada = cache.get(chave)
+        if entrada and agora - entrada[0] < ttl:
+            cache.move_to_end(chave)
+            linhas = entrada[1]
+        else:
+            linhas = None
+    if linhas is None:
+        linhas = _contagens_agrupadas(filtros)
+        with lock:
+            cache[chave] = (agora, linhas)
+            cache.move_to_end(chave)
+            while len(cache) > current_app.config.get('CATALOGO_FACETAS_MAX', 256):
+                cache.popitem(last=False)
+
+    categorias = {}
+    faixas = [0] * len(FAIXAS_PRECO)
+    produtores = {}
+    organicos = nao_organicos = total = 0
+    for categoria_id, produtor_id, produtor_nome, faixa, organico, quantidade in linhas:
+        categorias[categoria_id] = categorias.get(categoria_id, 0) + quantidade
+        if filtros.categoria_id and categoria_id != filtros.categoria_id:
+            continue
+        total += quantidade
+        faixas[faixa] += quantidade
+        if produtor_id not in produtores:
+            produtores[produtor_id] = {'id': produtor_id, 'nome': produtor_nome, 'total': 0}
+        produtores[produtor_id]['total'] += quantidade
+        if organico:
+            organicos += quantidade
+        else:
+            nao_organicos += quantidade
+
+    limites = list(FAIXAS_PRECO[1:]) + [None]
+    return {
+        'total': total,
+        'categorias': categorias,
+        'faixas_preco': [
+            {'min': FAIXAS_PRECO[i], 'max': limites[i], 'total': faixas[i]}
+            for i in range(len(FAIXAS_PRECO)) if faixas[i]
+        ],
+        'produtores': sorted(produtores.values(), key=lambda p: (-p['total'], p['nome'])),
+        'organicos': organicos,
+        'nao_organicos': nao_organicos,
+    }
+
+
+def limpar_cache_facetas():
+    """Descarta as contagens em cache (ex: após cadastrar produtos)"""
+    lock, cache = _cache_facetas()
+    with lock:
+        cache.clear()
+
+
+# ---------------------- Invalidação das facetas ----------------------
+# Gravações de produtos, produtores e tags são anotadas a cada flush e o cache é
+# descartado só depois do commit (um rollback não invalida nada)
+
+_FACETAS_ALTERADAS = 'facetas_alteradas'
+_MODELOS_FACETAS = (Produto, Produtor, Tag, ProdutoTag)
+
+
+def registrar_alteracao_catalogo(modelo=None, session=None):
+    """Anota gravação feita fora do unit of work (UPDATE/INSERT direto em produtos ou tags)"""
+    if modelo is not None and modelo not in _MODELOS_FACETAS:
+        return
+    session = session or db.session()
+    session.info[_FACETAS_ALTERADAS] = True
+
+
+@event.listens_for(db.session, 'after_flush')
+def _anotar_alteracoes_facetas(session, contexto):
+    if session.info.get(_FACETAS_ALTERADAS):
+        return
+    for objeto in list(session.new) + list(session.deleted):
+        if isinstance(objeto, _MODELOS_FACETAS):
+            session.info[_FACETAS_ALTERADAS] = True
+            return
+    for objeto in session.dirty:
+        if isinstance(objeto, _MODELOS_FACETAS) and session.is_modified(objeto, include_collections=False):
+            session.info[_FACETAS_ALTERADAS] = True
+            return
+
+
+@event.listens_for(db.session, 'after_commit')
+def _limpar_facetas(session):
+    if session.info.pop(_FACETAS_ALTERADAS, None) and has_app_context():
+        limpar_cache_facetas()
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _descartar_alteracoes_facetas(session, transacao_anterior):
+    if not session.in_transaction():
+        session.info.pop(_FACETAS_ALTERADAS, None)
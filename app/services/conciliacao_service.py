@@ -0,0 +1,319 @@
+"""
+Serviço de conciliação de pagamentos
+Consulta no gateway, em paralelo e com limite de taxa, os pagamentos pendentes e
+aplica os resultados no banco em lotes. Pedidos antigos são consultados com menos
+frequência (intervalo cresce com a idade do pedido).
+"""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from flask import current_app
+from app.extensions import db
+from app.models.core import Pedido, ItemPedido
+from app.services.estoque_service import devolver_estoque
+
+# (idade máxima do pedido, intervalo mínimo entre consultas); a última faixa vale para o resto
+INTERVALOS_POR_IDADE = (
+    (timedelta(minutes=15), timedelta(0)),
+    (timedelta(hours=2), timedelta(minutes=5)),
+    (timedelta(days=1), timedelta(minutes=30)),
+    (None, timedelta(hours=6)),
+)
+
+# Status do gateway -> alterações no pedido (aplicadas só se ainda estiver pendente)
+RESULTADOS = {
+    'approved': 'aprovado',
+    'rejected': 'rejeitado',
+    'cancelled': 'cancelado',
+}
+
+
+def intervalo_consulta(idade):
+    """Intervalo mínimo entre duas consultas de um pedido com a idade informada"""
+    for limite, intervalo in INTERVALOS_POR_IDADE:
+        if limite is None or idade <= limite:
+            return intervalo
+    return INTERVALOS_POR_IDADE[-1][1]
+
+
+def pedidos_a_consultar(agora=None, todos=False):
+    """
+    Pedidos com pagamento pendente no gateway cuja próxima consulta já venceu
+
+    Returns:
+        list: [(pedido_id, pagamento_id)] dos mais novos para os mais antigos
+    """
+    agora = agora or datetime.utcnow()
+    linhas = db.session.query(
+        Pedido.id, Pedido.pagamento_id, Pedido.data, Pedido.pagamento_consultado_em
+    ).filter(
+        Pedido.status_pagamento == 'pendente',
+        Pedido.pagamento_id.isnot(None),
+    ).order_by(Pedido.id.desc()).all()
+    devidos = []
+    for pedido_id, pagamento_id, criado_em, consultado_em in linhas:
+        criado_em = (criado_em or agora).replace(tzinfo=None)
+        if todos or consultado_em is None or agora - consultado_em >= intervalo_consulta(agora - criado_em):
+            devidos.append((pedido_id, pagamento_id))
+    return devidos
+
+
+class LimiteTaxa:
+    """Espaça as chamadas de todas as threads para no máximo `por_segundo` por segundo"""
+
+    def __init__(self, por_segundo):
+        self.intervalo = 1.0 / por_segundo if por_segundo and por_segundo > 0 else 0.0
+        self._lock = threading.Lock()
+        self._proximo = time.monotonic()
+
+    def aguardar(self):
+        if not self.intervalo:
+            return
+        with self._lock:
+            agora = time.monotonic()
+            espera = self._proximo - agora
+            self._proximo = max(self._proximo, agora) + self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+
+class ResumoConciliacao:
+    """Resultados por desfecho e latências das consultas ao gateway"""
+
+    def __init__(self):
+        self.desfechos = Counter()
+        self.latencias = []
+        self.adiados = 0
+        self.duracao = 0.0
+
+    def percentil(self, p):
+        if not self.latencias:
+            return 0.0
+        valores = sorted(self.latencias)
+        return valores[min(len(valores) - 1, int(p / 100 * len(valores)))]
+
+    @property
+    def consultados(self):
+        return sum(self.desfechos.values())
+
+    @property
+    def atualizados(self):
+        return sum(self.desfechos[d] for d in RESULTADOS.values())
+
+
+def _consultar(app, servico, limite, pagamento_id):
+    """Executada nas threads: só a chamada HTTP, sem acesso ao banco"""
+    limite.aguardar()
+    with app.app_context():
+        inicio = time.perf_counter()
+        info = servico.consultar_pagamento(pagamento_id)
+        return info, time.perf_counter() - inicio
+
+
+def _aplicar(pedido_id, info, agora):
+    """
+    Grava o resultado de uma consulta com UPDATE condicional: se um webhook já
+    mudou o pedido nesse meio tempo, nada é sobrescrito
+
+    Returns:
+        str: desfecho ('aprovado', 'rejeitado', 'cancelado', 'pendente', 'ignorado')
+    """
+    desfecho = RESULTADOS.get(info.get('status'))
+    if desfecho is None:
+        return 'pendente'
+    valores = {'status_pagamento': desfecho, 'pagamento_consultado_em': agora}
+    if desfecho == 'aprovado':
+        valores.update(status='Pagamento confirmado', data_pagamento=agora)
+    elif desfecho == 'rejeitado':
+        valores.update(status='Pagamento rejeitado', motivo_rejeicao=info.get('status_detail'))
+    else:
+        valores.update(status='Cancelado', data_cancelamento=agora)
+    resultado = db.session.execute(
+        db.update(Pedido).where(
+            Pedido.id == pedido_id, Pedido.status_pagamento == 'pendente'
+        ).values(**valores).execution_options(synchronize_session=False)
+    )
+    if resultado.rowcount != 1:
+        return 'ignorado'
+    if desfecho == 'cancelado':
+        devolver_estoque(ItemPedido.query.filter_by(pedido_id=pedido_id).all())
+    return desfecho
+
+
+def _concluir_lote(pendentes, aprovados, agora, ao_aprovar):
+    if pendentes:
+        db.session.execute(
+            db.update(Pedido).where(
+                Pedido.id.in_(pendentes), Pedido.status_pagamento == 'pendente'
+            ).values(pagamento_consultado_em=agora).execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    if ao_aprovar:
+        for pedido_id in aprovados:
+            ao_aprovar(db.session.get(Pedido, pedido_id))
+
+
+def conciliar_pagamentos(paralelismo=None, por_segundo=None, lote=None, todos=False,
+                         ao_resultado=None, ao_aprovar=None, parar=None):
+    """
+    Consulta os pagamentos pendentes em um pool de threads e aplica os resultados.
+
+    Args:
+        paralelismo: Consultas simultâneas (RECONCILIACAO_PARALELISMO)
+        por_segundo: Limite de consultas por segundo (RECONCILIACAO_TAXA; 0 = sem limite)
+        lote: Resultados por commit (RECONCILIACAO_LOTE)
+        todos: Ignora o intervalo por idade e consulta todos os pendentes
+        ao_resultado: callback(pedido_id, pagamento_id, desfecho, info) para relatório
+        ao_aprovar: callback(pedido) após o commit de cada pagamento aprovado (ex: e-mail)
+        parar: threading.Event conferido a cada resultado aplicado; ligado, as consultas
+            ainda não iniciadas são canceladas e o lote atual é gravado (ex: trava perdida)
+
+    Returns:
+        ResumoConciliacao
+    """
+    config = current_app.config
+    paralelismo = paralelismo or config.get('RECONCILIACAO_PARALELISMO', 8)
+    por_segundo = config.get('RECONCILIACAO_TAXA', 10) if por_segundo is None else por_segundo
+    lote = lote or config.get('RECONCILIACAO_LOTE', 50)
+
+    from app.services.pagamento_service import PagamentoService
+    resumo = ResumoConciliacao()
+    inicio = time.perf_counter()
+    agora = datetime.utcnow()
+    devidos = pedidos_a_consultar(agora, todos=todos)
+    resumo.adiados = db.session.query(Pedido.id).filter(
+        Pedido.status_pagamento == 'pendente', Pedido.pagamento_id.isnot(None)
+    ).count() - len(devidos)
+    if not devidos:
+        return resumo
+
+    app = current_app._get_current_object()
+    servico = PagamentoService()
+    limite = LimiteTaxa(por_segundo)
+    pendentes, aprovados, no_lote = [], [], 0
+    with ThreadPoolExecutor(max_workers=paralelismo) as executor:
+        futuros = {
+            executor.submit(_consultar, app, servico, limite, pagamento_id): (pedido_id, pagamento_id)
+            for pedido_id, pagamento_id in devidos
+        }
+        for futuro in as_completed(futuros):
+            pedido_id, pagamento_id = futuros[futuro]
+            try:
+                info, latencia = futuro.result()
+            except Exception as e:
+                current_app.logger.error(f'Erro ao consultar pagamento {pagamento_id}: {e}')
+                info, latencia = None, None
+            if latencia is not None:
+                resumo.latencias.append(latencia)
+
+            if not info:
+                desfecho = 'erro'
+            else:
+                desfecho = _aplicar(pedido_id, info, agora)
+                if desfecho == 'pendente':
+                    pendentes.append(pedido_id)
+                elif desfecho == 'aprovado':
+                    aprovados.append(pedido_id)
+                no_lote += 1
+            resumo.desfechos[desfecho] += 1
+            if ao_resultado:
+                ao_resultado(pedido_id, pagamento_id, desfecho, info)
+
+            if no_lote >= lote:
+                _concluir_lote(pendentes, aprovados, agora, ao_aprovar)
+                pendentes, aprovados, no_lote = [], [], 0
+            if parar is not None and parar.is_set():
+                for pendente in futuros:
+                    pendente.cancel()
+                break
+    _concluir_lote(pendentes, aprovados, agora, ao_aprovar)
+    resumo.duracao = time.perf_counter() - inicio
+    return resumo
+
+
+# ---------------------- Relatório de divergências ----------------------
+
+# Status do gateway -> status_pagamento locais compatíveis
+EQUIVALENCIAS = {
+    'approved': {'aprovado'},
+    'authorized': {'pendente'},
+    'in_process': {'pendente'},
+    'pending': {'pendente', 'expirado'},  # PIX vencido localmente antes do gateway cancelar
+    'in_mediation': {'aprovado'},
+    'rejected': {'rejeitado'},
+    'cancelled': {'cancelado', 'expirado'},
+    'refunded': {'reembolsado'},
+    'charged_back': {'reembolsado'},
+}
+
+
+class Divergencia:
+    """Pedido cujo status local não bate com o do gateway"""
+
+    def __init__(self, pedido_id, pagamento_id, status_local, status_gateway):
+        self.pedido_id = pedido_id
+        self.pagamento_id = pagamento_id
+        self.status_local = status_local
+        self.status_gateway = status_gateway  # None: pagamento não encontrado na busca
+
+    def __str__(self):
+        gateway = self.status_gateway or 'não encontrado'
+        return f'Pedido #{self.pedido_id} ({self.pagamento_id}): local {self.status_local}, gateway {gateway}'
+
+
+class RelatorioDivergencias:
+    def __init__(self, inicio, fim):
+        self.inicio = inicio
+        self.fim = fim
+        self.verificados = 0
+        self.chamadas = 0
+        self.divergencias = []
+        self.sem_pedido = []  # Referências de pagamentos sem pedido correspondente
+        self.duracao = 0.0
+
+
+def relatorio_divergencias(inicio, fim, margem=timedelta(hours=1)):
+    """
+    Compara os pedidos da janela com uma busca em lote no gateway (paginada,
+    centenas de pagamentos por chamada) e aponta onde Pedido.status_pagamento diverge
+
+    Args:
+        inicio / fim: Janela de criação dos pedidos (UTC sem fuso)
+        margem: Folga na busca do gateway (o pagamento é criado depois do pedido)
+
+    Returns:
+        RelatorioDivergencias, ou None sem credenciais do gateway
+    """
+    from app.services.pagamento_service import PagamentoService
+    relatorio = RelatorioDivergencias(inicio, fim)
+    marco = time.perf_counter()
+    pagamentos, relatorio.chamadas = PagamentoService().status_em_lote(inicio - margem, fim + margem)
+    if pagamentos is None:
+        return None
+
+    pedidos = db.session.query(Pedido.id, Pedido.pagamento_id, Pedido.status_pagamento).filter(
+        Pedido.data >= inicio, Pedido.data <= fim,
+        Pedido.pagamento_id.isnot(None), ~Pedido.pagamento_id.startswith('SIM-'),
+    ).order_by(Pedido.id).all()
+    referencias = set()
+    for pedido_id, pagamento_id, status_local in pedidos:
+        referencias.add(str(pedido_id))
+        pagamento = pagamentos.get(str(pedido_id))
+        status_gateway = pagamento.get('status') if pagamento else None
+        if status_local not in EQUIVALENCIAS.get(status_gateway, set()):
+            relatorio.divergencias.append(Divergencia(pedido_id, pagamento_id, status_local, status_gateway))
+    relatorio.verificados = len(pedidos)
+    orfas = set(pagamentos) - referencias
+    relatorio.sem_pedido = sorted(orfas - _pedidos_existentes(orfas))
+    relatorio.duracao = time.perf_counter() - marco
+    return relatorio
+
+
+def _pedidos_existentes(referencias):
+    """Referências que são pedidos fora da janela (não contam como órfãs)"""
+    ids = [int(r) for r in referencias if r.isdigit()]
+    if not ids:
+        return set()
+    return {str(i) for (i,) in db.session.query(Pedido.id).filter(Pedido.id.in_(ids))}
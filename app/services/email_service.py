@@ -19,6 +19,38 @@ def enviar_email_async(app, msg):
             app.logger.error(f'Erro ao enviar email: {e}')
 
 
+def enviar_expirados_async(app, pedido_ids, remetente, lote=200):
+    """
+    Fila de e-mails de expiração: uma thread, pedidos carregados em lotes (com
+    cliente e usuário) e uma única conexão SMTP para todas as mensagens
+    """
+    from sqlalchemy.orm import joinedload
+    from app.models.core import Pedido, Cliente
+
+    with app.app_context():
+        try:
+            with mail.connect() as conexao:
+                for inicio in range(0, len(pedido_ids), lote):
+                    pedidos = Pedido.query.options(
+                        joinedload(Pedido.cliente).joinedload(Cliente.usuario)
+                    ).filter(Pedido.id.in_(pedido_ids[inicio:inicio + lote])).all()
+                    for pedido in pedidos:
+                        msg = Message(
+                            subject=f'Pagamento Expirado - Pedido #{pedido.id}',
+                            sender=remetente,
+                            recipients=[pedido.cliente.usuario.email]
+                        )
+                        msg.body = render_template('emails/pagamento_expirado.txt', pedido=pedido)
+                        msg.html = render_template('emails/pagamento_expirado.html', pedido=pedido)
+                        try:
+                            conexao.send(msg)
+                        except Exception as e:
+                            app.logger.error(f'Erro ao enviar email do pedido #{pedido.id}: {e}')
+            app.logger.info(f'{len(pedido_ids)} email(s) de expiração enviados')
+        except Exception as e:
+            app.logger.error(f'Erro ao enviar emails de expiração: {e}')
+
+
 class EmailService:
     """
     Serviço para envio de emails transacionais
@@ -103,6 +135,26 @@ class EmailService:
         
         self._enviar(destinatario, assunto, html, texto)
     
+    def enfileirar_pedidos_expirados(self, pedido_ids):
+        """
+        Envia em segundo plano os emails de expiração de vários pedidos
+        
+        Args:
+            pedido_ids: IDs dos pedidos já expirados (e gravados)
+            
+        Returns:
+            Thread: envio em andamento (None se o email estiver desabilitado)
+        """
+        if not self.habilitado or not pedido_ids:
+            return None
+        
+        envio = Thread(
+            target=enviar_expirados_async,
+            args=(current_app._get_current_object(), list(pedido_ids), self.remetente)
+        )
+        envio.start()
+        return envio
+    
     def _enviar(self, destinatario, assunto, html, texto):
         """
         Método interno para envio de email
@@ -0,0 +1,114 @@
+"""
+Serviço de estoque
+Reserva e devolve estoque com UPDATEs condicionais/atômicos no banco, para que
+checkouts simultâneos não vendam mais do que existe
+"""
+from sqlalchemy import case, func
+from app.extensions import db
+from app.models.core import Produto, ItemPedido
+
+
+class FaltaEstoque:
+    """Linha do carrinho que não pôde ser reservada"""
+
+    def __init__(self, produto_id, nome, solicitado, disponivel):
+        self.produto_id = produto_id
+        self.nome = nome
+        self.solicitado = solicitado
+        self.disponivel = disponivel
+
+    def __str__(self):
+        return f'{self.nome}: solicitado {self.solicitado:g}, disponível {self.disponivel:g}'
+
+
+class EstoqueInsuficiente(Exception):
+    """Uma ou mais linhas sem estoque; a transação deve ser desfeita (rollback)"""
+
+    def __init__(self, faltas):
+        self.faltas = faltas
+        super().__init__('; '.join(str(falta) for falta in faltas))
+
+
+def reservar_estoque(quantidades):
+    """
+    Baixa o estoque de cada produto com
+    `UPDATE produtos SET estoque = estoque - :q WHERE id = :id AND estoque >= :q`,
+    dentro da transação corrente. Nenhum leitor concorrente consegue baixar a mesma
+    unidade duas vezes: o banco avalia a condição e a subtração na mesma instrução.
+
+    As linhas são processadas em ordem de id (evita deadlock entre checkouts no
+    PostgreSQL) e todas são tentadas, para que o relatório traga todas as faltas.
+
+    Args:
+        quantidades: {produto_id: quantidade}
+
+    Raises:
+        EstoqueInsuficiente: com as faltas; quem chama deve fazer rollback
+    """
+    sem_estoque = []
+    for produto_id in sorted(quantidades):
+        quantidade = quantidades[produto_id]
+        resultado = db.session.execute(
+            db.update(Produto).where(
+                Produto.id == produto_id, Produto.estoque >= quantidade
+            ).values(estoque=Produto.estoque - quantidade).execution_options(synchronize_session=False)
+        )
+        if resultado.rowcount != 1:
+            sem_estoque.append(produto_id)
+
+    if sem_estoque:
+        linhas = {pid: (nome, estoque) for pid, nome, estoque in db.session.query(
+            Produto.id, Produto.nome, Produto.estoque
+        ).filter(Produto.id.in_(sem_estoque))}
+        faltas = []
+        for produto_id in sem_estoque:
+            nome, estoque = linhas.get(produto_id, (f'Produto #{produto_id}', 0))
+            faltas.append(FaltaEstoque(produto_id, nome, quantidades[produto_id], max(estoque or 0, 0)))
+        raise EstoqueInsuficiente(faltas)
+
+
+def devolver_estoque(itens):
+    """
+    Devolve ao estoque as quantidades dos itens (cancelamento, expiração, estorno)
+    com `estoque = estoque + :q`, sem ler e regravar o valor em Python
+
+    Args:
+        itens: Itens de pedido (produto_id, quantidade)
+    """
+    quantidades = {}
+    for item in itens:
+        quantidades[item.produto_id] = quantidades.get(item.produto_id, 0) + item.quantidade
+    for produto_id in sorted(quantidades):
+        db.session.execute(
+            db.update(Produto).where(Produto.id == produto_id).values(
+                estoque=Produto.estoque + quantidades[produto_id]
+            ).execution_options(synchronize_session=False)
+        )
+
+
+def devolver_estoque_de_pedidos(pedido_ids):
+    """
+    Devolve ao estoque os itens de vários pedidos de uma vez: as quantidades são
+    somadas por produto no banco e aplicadas em um único
+    `UPDATE produtos SET estoque = estoque + CASE id WHEN ... END WHERE id IN (...)`
+
+    Args:
+        pedido_ids: IDs dos pedidos cancelados/expirados
+
+    Returns:
+        dict: {produto_id: quantidade devolvida}
+    """
+    if not pedido_ids:
+        return {}
+    quantidades = dict(db.session.execute(
+        db.select(ItemPedido.produto_id, func.sum(ItemPedido.quantidade)).where(
+            ItemPedido.pedido_id.in_(pedido_ids), ItemPedido.produto_id.isnot(None)
+        ).group_by(ItemPedido.produto_id)
+    ).all())
+    if quantidades:
+        db.session.execute(
+            db.update(Produto).where(Produto.id.in_(quantidades)).values(
+                estoque=Produto.estoque + case(quantidades, value=Produto.id, else_=0)
+            ).execution_options(synchronize_session=False)
+        )
+    return quantidades
@@ -0,0 +1,80 @@
+"""
+Serviço de expiração de cobranças PIX
+O filtro de expiração roda no banco (índice em forma_pagamento, status_pagamento,
+expiracao_pagamento) e o trabalho é feito em lotes de tamanho fixo: um UPDATE dos
+pedidos, um UPDATE agregado do estoque e um commit por lote
+"""
+from datetime import datetime
+from flask import current_app
+from app.extensions import db
+from app.models.core import Pedido
+from app.services.estoque_service import devolver_estoque_de_pedidos
+
+MOTIVO_EXPIRACAO = 'Pagamento PIX expirado (30 minutos)'
+
+
+def _expirados(agora, limite):
+    """IDs do próximo lote; os já expirados saem do filtro, então não há OFFSET"""
+    return db.session.execute(
+        db.select(Pedido.id).where(
+            Pedido.forma_pagamento == 'pix',
+            Pedido.status_pagamento == 'pendente',
+            Pedido.expiracao_pagamento < agora,
+        ).order_by(Pedido.expiracao_pagamento).limit(limite)
+    ).scalars().all()
+
+
+def _expirar(ids, agora):
+    """
+    Marca os pedidos como expirados se ainda estiverem pendentes (um webhook pode
+    ter aprovado algum nesse meio tempo)
+
+    Returns:
+        list: IDs efetivamente expirados
+    """
+    instrucao = db.update(Pedido).where(
+        Pedido.id.in_(ids), Pedido.status_pagamento == 'pendente'
+    ).values(
+        status='Cancelado',
+        status_pagamento='expirado',
+        data_cancelamento=agora,
+        motivo_cancelamento=MOTIVO_EXPIRACAO,
+        cancelado_por='sistema',
+    ).execution_options(synchronize_session=False)
+    if db.session.get_bind().dialect.update_returning:
+        return db.session.execute(instrucao.returning(Pedido.id)).scalars().all()
+    db.session.execute(instrucao)
+    return db.session.execute(
+        db.select(Pedido.id).where(
+            Pedido.id.in_(ids), Pedido.status_pagamento == 'expirado', Pedido.data_cancelamento == agora
+        )
+    ).scalars().all()
+
+
+def expirar_pedidos_pix(agora=None, lote=None, ao_lote=None, parar=None):
+    """
+    Cancela os pedidos PIX com cobrança vencida e devolve o estoque, em lotes
+
+    Args:
+        agora: Instante de corte (UTC sem fuso)
+        lote: Pedidos por lote/commit (PIX_EXPIRACAO_LOTE)
+        ao_lote: callback(pedido_ids, quantidades) após o commit de cada lote
+        parar: threading.Event conferido antes de cada lote (ex: trava do agendador perdida)
+
+    Returns:
+        list: IDs dos pedidos expirados
+    """
+    agora = agora or datetime.utcnow()
+    lote = lote or current_app.config.get('PIX_EXPIRACAO_LOTE', 500)
+    expirados = []
+    while not (parar and parar.is_set()):
+        ids = _expirados(agora, lote)
+        if not ids:
+            break
+        efetivos = _expirar(ids, agora)
+        quantidades = devolver_estoque_de_pedidos(efetivos)
+        db.session.commit()
+        expirados.extend(efetivos)
+        if ao_lote:
+            ao_lote(efetivos, quantidades)
+    return expirados
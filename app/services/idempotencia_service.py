@@ -0,0 +1,42 @@
+"""
+Serviço de idempotência do checkout
+Cada formulário de finalização leva um token; o par (usuário, token) é único no banco,
+de modo que duplo clique ou reenvio por proxy não cria um segundo pedido
+"""
+import secrets
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models.core import ChaveIdempotencia
+
+
+def gerar_token():
+    """Token para o campo oculto do formulário de checkout"""
+    return secrets.token_urlsafe(24)
+
+
+def chave_registrada(usuario_id, token):
+    """Registro já gravado para o token (envio repetido) ou None"""
+    return ChaveIdempotencia.query.filter_by(usuario_id=usuario_id, token=token).first()
+
+
+def reservar_chave(usuario_id, token):
+    """
+    Grava o token na transação do pedido. Se outro envio com o mesmo token chegou
+    antes, o índice único rejeita a inserção (no PostgreSQL, aguardando o commit do outro).
+
+    Returns:
+        ChaveIdempotencia ou None se o token já foi usado
+    """
+    try:
+        with db.session.begin_nested():
+            chave = ChaveIdempotencia(usuario_id=usuario_id, token=token[:64])
+            db.session.add(chave)
+        return chave
+    except IntegrityError:
+        return None
+
+
+def concluir_chave(chave, pedido_id, url_resposta):
+    """Associa ao token o pedido criado e o redirecionamento a repetir (antes do commit)"""
+    chave.pedido_id = pedido_id
+    chave.url_resposta = url_resposta
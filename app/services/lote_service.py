@@ -0,0 +1,110 @@
+"""
+Serviço de gravação em lote
+INSERTs de várias linhas por instrução (`INSERT ... VALUES (...), (...)`) com retorno
+das chaves geradas onde o banco suporta, para que checkout, seeds e importações façam
+um número constante de idas ao banco independente da quantidade de linhas
+"""
+from sqlalchemy import tuple_
+from app.extensions import db
+from app.services.catalogo_service import registrar_alteracao_catalogo
+from app.services.referencia_service import registrar_gravacao
+
+# Linhas por instrução; o SQLAlchemy ainda divide cada lote conforme o limite de
+# parâmetros do driver (insertmanyvalues)
+TAMANHO_LOTE = 1000
+
+
+def _fatias(registros, tamanho):
+    for inicio in range(0, len(registros), tamanho):
+        yield registros[inicio:inicio + tamanho]
+
+
+def _chave(registro, colunas):
+    return tuple(registro.get(coluna) for coluna in colunas)
+
+
+def _retorna_chaves_em_lote():
+    """SQLite >= 3.35 e PostgreSQL devolvem as chaves de um INSERT de várias linhas na ordem dos parâmetros"""
+    dialeto = db.session.get_bind().dialect
+    return bool(
+        dialeto.insert_executemany_returning
+        and dialeto.insert_executemany_returning_sort_by_parameter_order
+    )
+
+
+def existentes(modelo, chaves, colunas):
+    """
+    Quais das chaves já existem na tabela, em uma consulta por lote
+
+    Args:
+        modelo: Classe do modelo
+        chaves: Iterável de tuplas com os valores de `colunas`
+        colunas: Nomes das colunas que identificam o registro (ex: ('nome',))
+
+    Returns:
+        set: Tuplas já gravadas
+    """
+    tabela = modelo.__table__
+    campos = [tabela.c[coluna] for coluna in colunas]
+    chaves = list(dict.fromkeys(chaves))
+    encontradas = set()
+    for fatia in _fatias(chaves, TAMANHO_LOTE):
+        if len(campos) == 1:
+            filtro = campos[0].in_([chave[0] for chave in fatia])
+        else:
+            filtro = tuple_(*campos).in_(fatia)
+        encontradas.update(tuple(linha) for linha in db.session.execute(db.select(*campos).where(filtro)))
+    return encontradas
+
+
+def inserir_em_lote(modelo, registros, retornar_chaves=False, unicos=None):
+    """
+    Insere os registros com INSERTs de várias linhas, dentro da transação corrente.
+
+    Grava direto na tabela: defaults de coluna são aplicados, mas eventos do mapper
+    (before_insert) e relacionamentos não; quem chama preenche as colunas derivadas.
+
+    Args:
+        modelo: Classe do modelo (ex: ItemPedido)
+        registros: Lista de dicts {coluna: valor}
+        retornar_chaves: Preenche a chave primária gerada em cada registro inserido
+            (um INSERT ... RETURNING por lote; linha a linha em bancos sem suporte)
+        unicos: Colunas que identificam o registro; os que já existem no banco ou
+            se repetem na lista são ignorados (substitui o "consulta, se não existe
+            insere" linha a linha dos seeds)
+
+    Returns:
+        list: Os registros efetivamente inseridos (com a chave, se retornar_chaves)
+    """
+    registros = list(registros)
+    if unicos:
+        ja_gravados = existentes(modelo, (_chave(r, unicos) for r in registros), unicos)
+        novos = []
+        for registro in registros:
+            chave = _chave(registro, unicos)
+            if chave not in ja_gravados:
+                ja_gravados.add(chave)
+                novos.append(registro)
+        registros = novos
+    if not registros:
+        return []
+
+    tabela = modelo.__table__
+    primaria = list(tabela.primary_key.columns)
+    registrar_gravacao(modelo)
+    registrar_alteracao_catalogo(modelo)
+    if not retornar_chaves:
+        for fatia in _fatias(registros, TAMANHO_LOTE):
+            db.session.execute(db.insert(tabela), fatia)
+        return registros
+
+    if _retorna_chaves_em_lote():
+        instrucao = db.insert(tabela).returning(*primaria, sort_by_parameter_order=True)
+        for fatia in _fatias(registros, TAMANHO_LOTE):
+            for registro, chaves in zip(fatia, db.session.execute(instrucao, fatia)):
+                registro.update(zip((coluna.key for coluna in primaria), chaves))
+    else:
+        for registro in registros:
+            chaves = db.session.execute(db.insert(tabela), registro).inserted_primary_key
+            registro.update(zip((coluna.key for coluna in primaria), chaves))
+    return registros
@@ -2,26 +2,120 @@
 Serviço de integração com gateway de pagamento (Mercado Pago)
 Gerencia criação de pagamentos PIX, processamento de cartões e webhooks
 """
+import os
+import threading
 import requests
 import hashlib
 import hmac
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from app.extensions import db
 from app.models.core import Pedido
 
 
+# ---------------------- Cliente HTTP ----------------------
+# Uma requests.Session por processo (worker): conexões keep-alive com o gateway são
+# reaproveitadas entre requisições e webhooks, sem repetir DNS, TCP e TLS a cada chamada.
+
+_sessao = None
+_sessao_lock = threading.Lock()
+
+
+def _criar_sessao(config):
+    retentativas = Retry(
+        total=config.get('MERCADOPAGO_RETENTATIVAS', 3),
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        # Falhas de conexão (requisição não enviada) são repetidas para qualquer método;
+        # falhas de leitura e status 5xx/429 só para consultas
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    tamanho = config.get('MERCADOPAGO_POOL_CONEXOES', 10)
+    adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=tamanho, max_retries=retentativas)
+    sessao = requests.Session()
+    sessao.mount('https://', adaptador)
+    sessao.mount('http://', adaptador)
+    sessao.headers.update({'Accept': 'application/json'})
+    return sessao
+
+
+def sessao_http():
+    """Sessão HTTP do processo, criada no primeiro uso"""
+    global _sessao
+    if _sessao is None:
+        with _sessao_lock:
+            if _sessao is None:
+                _sessao = _criar_sessao(current_app.config)
+    return _sessao
+
+
+def _descartar_sessao():
+    """Processo filho (fork do servidor) não herda as conexões do pai"""
+    global _sessao, _sessao_lock
+    _sessao = None
+    _sessao_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_descartar_sessao)
+
+
+def _dados_pix(pedido):
+    """
+    Dados da cobrança PIX gravada no pedido, no formato de criar_pagamento_pix
+    (a imagem do QR Code é servida por pedidos.qr_code_pix a partir do código)
+    """
+    return {
+        'codigo_pix': pedido.pix_codigo,
+        'pagamento_id': pedido.pagamento_id,
+        'expiracao': pedido.expiracao_pagamento.isoformat(),
+        'simulado': (pedido.pagamento_id or '').startswith('SIM-'),
+    }
+
+
+def cobranca_pix_vigente(pedido, agora=None):
+    """
+    Cobrança PIX pendente e ainda dentro do prazo, gravada no pedido
+
+    Returns:
+        dict no formato de criar_pagamento_pix, ou None se for preciso gerar outra
+    """
+    agora = agora or datetime.utcnow()
+    if (
+        pedido.status_pagamento == 'pendente'
+        and pedido.pagamento_id
+        and pedido.pix_codigo
+        and pedido.expiracao_pagamento
+        and pedido.expiracao_pagamento > agora
+    ):
+        return _dados_pix(pedido)
+    return None
+
+
 class PagamentoService:
     """
     Serviço para integração com Mercado Pago
     Documentação: https://www.mercadopago.com.br/developers/pt/docs
     """
     
+    # Limite de paginação da API de busca (offset + limit)
+    BUSCA_MAX_OFFSET = 10000
+    
     def __init__(self):
         self.access_token = current_app.config.get('MERCADOPAGO_ACCESS_TOKEN')
         self.public_key = current_app.config.get('MERCADOPAGO_PUBLIC_KEY')
         self.webhook_secret = current_app.config.get('MERCADOPAGO_WEBHOOK_SECRET')
         self.base_url = 'https://api.mercadopago.com'
+        self.http = sessao_http()
+        # (conexão, leitura): falha rápido se o gateway não aceita a conexão
+        self.timeout = (
+            current_app.config.get('MERCADOPAGO_TIMEOUT_CONEXAO', 3.05),
+            current_app.config.get('MERCADOPAGO_TIMEOUT_LEITURA', 10),
+        )
         
     def criar_pagamento_pix(self, pedido):
         """
@@ -59,24 +153,22 @@ class PagamentoService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
+            response = self.http.post(url, json=payload, headers=headers, timeout=self.timeout)
             response.raise_for_status()
             
             data = response.json()
             
-            # Atualizar pedido com dados do pagamento
+            # Atualizar pedido com dados do pagamento (reaproveitados até a expiração)
+            transacao = data['point_of_interaction']['transaction_data']
+            expiracao = datetime.fromisoformat(data['date_of_expiration'].replace('Z', '+00:00'))
             pedido.pagamento_id = str(data.get('id'))
             pedido.status_pagamento = 'pendente'
-            pedido.expiracao_pagamento = datetime.fromisoformat(data['date_of_expiration'].replace('Z', '+00:00'))
+            pedido.expiracao_pagamento = expiracao.astimezone(timezone.utc).replace(tzinfo=None)
+            pedido.pix_codigo = transacao['qr_code']
+            pedido.pix_qr_code = transacao['qr_code_base64']
             db.session.commit()
             
-            return {
-                'qr_code': data['point_of_interaction']['transaction_data']['qr_code_base64'],
-                'qr_code_url': f"data:image/png;base64,{data['point_of_interaction']['transaction_data']['qr_code_base64']}",
-                'codigo_pix': data['point_of_interaction']['transaction_data']['qr_code'],
-                'pagamento_id': data['id'],
-                'expiracao': data['date_of_expiration']
-            }
+            return _dados_pix(pedido)
             
         except requests.exceptions.RequestException as e:
             current_app.logger.error(f'Erro ao criar pagamento PIX: {e}')
@@ -84,11 +176,7 @@ class PagamentoService:
             return self._gerar_pix_simulado(pedido)
     
     def _gerar_pix_simulado(self, pedido):
-        """Gera PIX simulado para desenvolvimento/teste"""
-        import qrcode
-        import io
-        import base64
-        
+        """Gera PIX simulado para desenvolvimento/teste (a imagem é renderizada sob demanda)"""
         chave_pix = "contato@agrofeira.com"
         beneficiario = "AgroFeira - Rede Orgânicos"
         cidade = "João Pessoa"
@@ -100,31 +188,15 @@ class PagamentoService:
         crc = hashlib.md5(codigo_pix.encode()).hexdigest()[:4].upper()
         codigo_pix += crc
         
-        # Gerar QR Code
-        qr = qrcode.QRCode(version=1, box_size=10, border=4)
-        qr.add_data(codigo_pix)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-        img_base64 = base64.b64encode(buffer.getvalue()).decode()
-        
-        # Atualizar pedido com dados simulados
+        # Atualizar pedido com dados simulados (reaproveitados até a expiração)
         pedido.pagamento_id = f"SIM-{pedido.id}-{int(datetime.utcnow().timestamp())}"
         pedido.status_pagamento = 'pendente'
         pedido.expiracao_pagamento = datetime.utcnow() + timedelta(minutes=30)
+        pedido.pix_codigo = codigo_pix
+        pedido.pix_qr_code = None
         db.session.commit()
         
-        return {
-            'qr_code': img_base64,
-            'qr_code_url': f"data:image/png;base64,{img_base64}",
-            'codigo_pix': codigo_pix,
-            'pagamento_id': pedido.pagamento_id,
-            'expiracao': pedido.expiracao_pagamento.isoformat(),
-            'simulado': True
-        }
+        return _dados_pix(pedido)
     
     def processar_pagamento_cartao(self, pedido, dados_cartao):
         """
@@ -162,7 +234,7 @@ class PagamentoService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
+            response = self.http.post(url, json=payload, headers=headers, timeout=self.timeout)
             response.raise_for_status()
             
             data = response.json()
@@ -248,9 +320,103 @@ class PagamentoService:
         }
         
         try:
-            response = requests.get(url, headers=headers, timeout=10)
+            response = self.http.get(url, headers=headers, timeout=self.timeout)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             current_app.logger.error(f'Erro ao consultar pagamento: {e}')
             return None
+    
+    def paginas_de_pagamentos(self, inicio, fim, external_reference=None, por_pagina=None):
+        """
+        Busca pagamentos na API de busca do Mercado Pago (/v1/payments/search), por
+        faixa de data de criação e, opcionalmente, referência externa (ID do pedido)
+        
+        O gateway não pagina além de BUSCA_MAX_OFFSET resultados; janelas maiores
+        são divididas ao meio até caberem.
+        
+        Args:
+            inicio: Início da janela (UTC sem fuso)
+            fim: Fim da janela (UTC sem fuso)
+            external_reference: Só os pagamentos deste pedido
+            por_pagina: Resultados por chamada (MERCADOPAGO_BUSCA_LIMITE)
+            
+        Yields:
+            list: Pagamentos de cada página (uma chamada HTTP por página)
+            
+        Raises:
+            requests.exceptions.RequestException: falha na busca
+        """
+        por_pagina = por_pagina or current_app.config.get('MERCADOPAGO_BUSCA_LIMITE', 1000)
+        janelas = [(inicio, fim)]
+        while janelas:
+            janela_inicio, janela_fim = janelas.pop(0)
+            offset = 0
+            while True:
+                pagina = self._buscar_pagina(janela_inicio, janela_fim, external_reference, por_pagina, offset)
+                total = pagina.get('paging', {}).get('total', 0)
+                if offset == 0 and total > self.BUSCA_MAX_OFFSET and janela_fim - janela_inicio > timedelta(minutes=1):
+                    meio = janela_inicio + (janela_fim - janela_inicio) / 2
+                    janelas[:0] = [(janela_inicio, meio), (meio + timedelta(milliseconds=1), janela_fim)]
+                    break
+                if offset == 0 and total > self.BUSCA_MAX_OFFSET:
+                    current_app.logger.warning(
+                        f'Busca de pagamentos truncada em {self.BUSCA_MAX_OFFSET} de {total} '
+                        f'({janela_inicio} a {janela_fim})'
+                    )
+                resultados = pagina.get('results', [])
+                yield resultados
+                offset += len(resultados)
+                if not resultados or offset >= min(total, self.BUSCA_MAX_OFFSET):
+                    break
+    
+    def _buscar_pagina(self, inicio, fim, external_reference, limite, offset):
+        params = {
+            'sort': 'date_created',
+            'criteria': 'asc',
+            'range': 'date_created',
+            'begin_date': f'{inicio:%Y-%m-%dT%H:%M:%S}.{inicio.microsecond // 1000:03d}Z',
+            'end_date': f'{fim:%Y-%m-%dT%H:%M:%S}.{fim.microsecond // 1000:03d}Z',
+            'limit': limite,
+            'offset': offset,
+        }
+        if external_reference is not None:
+            params['external_reference'] = str(external_reference)
+        response = self.http.get(
+            f'{self.base_url}/v1/payments/search',
+            params=params,
+            headers={'Authorization': f'Bearer {self.access_token}'},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    def status_em_lote(self, inicio, fim):
+        """
+        Status de todos os pagamentos criados na janela, agrupados por pedido
+        (centenas de pagamentos por chamada, em vez de uma consulta por pedido)
+        
+        Quando um pedido tem mais de um pagamento (nova tentativa), vale o aprovado
+        ou, não havendo, o mais recente.
+        
+        Returns:
+            tuple: ({external_reference: pagamento}, chamadas HTTP) ou (None, 0) sem
+                credenciais do gateway
+        """
+        if not self.access_token:
+            return None, 0
+        
+        por_pedido = {}
+        chamadas = 0
+        for pagina in self.paginas_de_pagamentos(inicio, fim):
+            chamadas += 1
+            for pagamento in pagina:
+                referencia = pagamento.get('external_reference')
+                if not referencia:
+                    continue
+                atual = por_pedido.get(referencia)
+                if (atual is None or (atual.get('status') != 'approved' and (
+                        pagamento.get('status') == 'approved'
+                        or (pagamento.get('date_created') or '') >= (atual.get('date_created') or '')))):
+                    por_pedido[referencia] = pagamento
+        return por_pedido, chamadas
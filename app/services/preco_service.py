@@ -0,0 +1,98 @@
+"""
+Serviço de preço efetivo dos produtos
+Materializa em `produtos.preco_efetivo` o preço vigente (promocional dentro da janela
+sazonal, ou o preço normal), para que catálogo, carrinho e checkout leiam um valor pronto.
+"""
+from datetime import datetime, timezone
+from sqlalchemy import and_, case, event, func, or_
+from app.extensions import db
+from app.models.core import Produto
+
+
+def _agora():
+    """Instante atual em UTC sem fuso, como as datas são gravadas no banco"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _sem_fuso(momento):
+    if momento is not None and momento.tzinfo is not None:
+        return momento.astimezone(timezone.utc).replace(tzinfo=None)
+    return momento
+
+
+def calcular_preco_efetivo(produto, agora=None):
+    """
+    Preço vigente do produto: o promocional vale quando positivo e, se houver
+    janela sazonal, apenas entre sazonal_inicio e sazonal_fim (limites opcionais).
+    Deve seguir exatamente a regra de expressao_preco_efetivo.
+    """
+    agora = _sem_fuso(agora) or _agora()
+    inicio = _sem_fuso(produto.sazonal_inicio)
+    fim = _sem_fuso(produto.sazonal_fim)
+    promocional = produto.preco_promocional
+    if (promocional is not None and promocional > 0
+            and (inicio is None or inicio <= agora) and (fim is None or fim >= agora)):
+        return promocional
+    return produto.preco
+
+
+def expressao_preco_efetivo(agora):
+    """Mesma regra de calcular_preco_efetivo em SQL (CASE), para atualização em massa"""
+    return case(
+        (and_(
+            Produto.preco_promocional.isnot(None),
+            Produto.preco_promocional > 0,
+            or_(Produto.sazonal_inicio.is_(None), Produto.sazonal_inicio <= agora),
+            or_(Produto.sazonal_fim.is_(None), Produto.sazonal_fim >= agora),
+        ), Produto.preco_promocional),
+        else_=Produto.preco
+    )
+
+
+def atualizar_precos_efetivos(agora=None):
+    """
+    Recalcula preco_efetivo em um único UPDATE, tocando só as linhas cujo valor mudou
+    (produtos que entraram ou saíram da janela promocional desde a última execução).
+
+    Returns:
+        int: Quantidade de produtos atualizados
+    """
+    agora = _sem_fuso(agora) or _agora()
+    novo = expressao_preco_efetivo(agora)
+    resultado = db.session.execute(
+        db.update(Produto).where(
+            or_(Produto.preco_efetivo.is_(None), Produto.preco_efetivo != novo)
+        ).values(preco_efetivo=novo).execution_options(synchronize_session=False)
+    )
+    if resultado.rowcount:
+        # Faixas de preço das facetas do catálogo mudam junto
+        from app.services.catalogo_service import registrar_alteracao_catalogo
+        registrar_alteracao_catalogo()
+    return resultado.rowcount
+
+
+def proxima_virada(agora=None):
+    """
+    Próximo instante em que algum preço efetivo muda (início ou fim de janela
+    de um produto com preço promocional). Usado para agendar a próxima atualização.
+
+    Returns:
+        datetime ou None se não houver janelas futuras
+    """
+    agora = _sem_fuso(agora) or _agora()
+    com_promocao = Produto.preco_promocional.isnot(None)
+    inicio = db.session.query(func.min(Produto.sazonal_inicio)).filter(
+        com_promocao, Produto.sazonal_inicio > agora
+    ).scalar()
+    fim = db.session.query(func.min(Produto.sazonal_fim)).filter(
+        com_promocao, Produto.sazonal_fim >= agora
+    ).scalar()
+    datas = [d for d in (inicio, fim) if d]
+    return min(datas) if datas else None
+
+
+@event.listens_for(Produto, 'before_insert')
+@event.listens_for(Produto, 'before_update')
+def _materializar_preco(mapper, connection, produto):
+    """Mantém preco_efetivo em dia sempre que o produto é gravado pelo ORM"""
+    produto.preco_efetivo = calcular_preco_efetivo(produto)
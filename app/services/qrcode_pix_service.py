@@ -0,0 +1,109 @@
+"""
+Serviço de imagens do QR Code PIX
+Renderiza o código copia e cola em PNG ou SVG, com cache LRU em memória por hash do
+conteúdo: a mesma cobrança é desenhada uma vez por processo
+"""
+import base64
+import binascii
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+FORMATOS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+
+class CacheImagensQr:
+    """LRU de imagens prontas: (hash do código, formato) -> bytes"""
+
+    def __init__(self, maximo=256):
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._imagens = OrderedDict()
+
+    def obter(self, chave):
+        with self._lock:
+            imagem = self._imagens.get(chave)
+            if imagem is not None:
+                self._imagens.move_to_end(chave)
+            return imagem
+
+    def guardar(self, chave, imagem):
+        with self._lock:
+            self._imagens[chave] = imagem
+            self._imagens.move_to_end(chave)
+            while len(self._imagens) > self.maximo:
+                self._imagens.popitem(last=False)
+
+
+def _cache():
+    app = current_app._get_current_object()
+    cache = app.extensions.get('qr_pix')
+    if cache is None:
+        cache = app.extensions.setdefault('qr_pix', CacheImagensQr(app.config.get('PIX_QR_CACHE_MAX', 256)))
+    return cache
+
+
+def etag_qr(codigo_pix, formato, png_gateway=None):
+    """
+    ETag forte da imagem: código PIX, formato e origem. A renderização local é
+    determinística; o PNG enviado pelo gateway entra no hash, então as duas origens
+    nunca compartilham a mesma ETag (nem a mesma entrada do cache)
+    """
+    resumo = hashlib.sha256(codigo_pix.encode())
+    origem = 'local'
+    if formato == 'png' and png_gateway:
+        resumo.update(b'\0' + png_gateway.encode())
+        origem = 'gateway'
+    return f"{resumo.hexdigest()[:40]}-{formato}-{origem}"
+
+
+def _renderizar_svg(codigo_pix):
+    # Gera o SVG em XML puro, sem Pillow
+    import qrcode
+    from qrcode.image.svg import SvgPathImage
+    qr = qrcode.QRCode(border=4, image_factory=SvgPathImage)
+    qr.add_data(codigo_pix)
+    qr.make(fit=True)
+    buffer = io.BytesIO()
+    qr.make_image().save(buffer)
+    return buffer.getvalue()
+
+
+def _renderizar_png(codigo_pix):
+    import qrcode
+    qr = qrcode.QRCode(version=1, box_size=10, border=4)
+    qr.add_data(codigo_pix)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def imagem_qr(codigo_pix, formato, png_gateway=None):
+    """
+    Bytes da imagem do QR Code
+
+    Args:
+        codigo_pix: Código copia e cola (conteúdo do QR)
+        formato: 'png' ou 'svg'
+        png_gateway: PNG em base64 enviado pelo gateway, usado no lugar da renderização
+
+    Returns:
+        bytes
+    """
+    cache = _cache()
+    chave = etag_qr(codigo_pix, formato, png_gateway)
+    imagem = cache.obter(chave)
+    if imagem is None:
+        if formato == 'png' and png_gateway:
+            try:
+                imagem = base64.b64decode(png_gateway, validate=True)
+            except (binascii.Error, ValueError):
+                imagem = None
+        if imagem is None:
+            imagem = _renderizar_svg(codigo_pix) if formato == 'svg' else _renderizar_png(codigo_pix)
+        cache.guardar(chave, imagem)
+    return imagem
@@ -0,0 +1,163 @@
+"""
+Serviço de dados de referência
+Cache em memória, por processo, de Categoria, PontoRetirada e TaxaEntrega: tabelas
+pequenas, lidas em quase toda página e alteradas poucas vezes por mês
+"""
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from app.extensions import db
+from app.models.core import Categoria, PontoRetirada, TaxaEntrega
+
+
+def _tipo_registro(modelo):
+    """Tupla imutável com as colunas do modelo (ex: CategoriaRef(id, nome, ...))"""
+    return namedtuple(f'{modelo.__name__}Ref', [coluna.key for coluna in modelo.__table__.columns])
+
+
+# nome -> (modelo, tipo da tupla, ordenação)
+TABELAS = {
+    'categorias': (Categoria, _tipo_registro(Categoria), Categoria.nome),
+    'pontos_retirada': (PontoRetirada, _tipo_registro(PontoRetirada), PontoRetirada.nome),
+    'taxas_entrega': (TaxaEntrega, _tipo_registro(TaxaEntrega), TaxaEntrega.regiao),
+}
+_NOMES_POR_MODELO = {modelo: nome for nome, (modelo, _, _) in TABELAS.items()}
+
+
+class Retrato:
+    """Conteúdo imutável de uma tabela em uma versão: tupla ordenada e índice por id"""
+
+    def __init__(self, versao, registros):
+        self.versao = versao
+        self.registros = tuple(registros)
+        self.por_id = MappingProxyType({registro.id: registro for registro in self.registros})
+        self.carregado_em = time.monotonic()
+
+
+class CacheReferencia:
+    """
+    Guarda um Retrato por tabela. Gravações confirmadas avançam a versão da tabela
+    e descartam o retrato; o próximo leitor recarrega. Leitores seguram a referência
+    ao retrato que receberam, que nunca é alterado.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versoes = {nome: 0 for nome in TABELAS}
+        self._retratos = {}
+
+    def retrato(self, nome, ttl=0):
+        atual = self._retratos.get(nome)
+        if self._valido(atual, ttl):
+            return atual
+        with self._lock:
+            # Outra thread pode ter recarregado enquanto esta aguardava o lock
+            atual = self._retratos.get(nome)
+            if self._valido(atual, ttl):
+                return atual
+            versao = self._versoes[nome]
+            modelo, tipo, ordem = TABELAS[nome]
+            colunas = [getattr(modelo, campo) for campo in tipo._fields]
+            linhas = db.session.query(*colunas).order_by(ordem, modelo.id).all()
+            novo = Retrato(versao, (tipo(*linha) for linha in linhas))
+            # Descarta o resultado se uma gravação invalidou a tabela durante a carga
+            if self._versoes[nome] == versao:
+                self._retratos[nome] = novo
+            return novo
+
+    @staticmethod
+    def _valido(retrato, ttl):
+        return retrato is not None and not (ttl and time.monotonic() - retrato.carregado_em > ttl)
+
+    def invalidar(self, *nomes):
+        with self._lock:
+            for nome in nomes or TABELAS:
+                self._versoes[nome] += 1
+                self._retratos.pop(nome, None)
+
+
+def _cache(app=None):
+    app = app or current_app._get_current_object()
+    return app.extensions.setdefault('dados_referencia', CacheReferencia())
+
+
+def _retrato(nome):
+    return _cache().retrato(nome, ttl=current_app.config.get('REFERENCIA_CACHE_TTL', 300))
+
+
+def categorias():
+    """Todas as categorias, por nome"""
+    return _retrato('categorias').registros
+
+
+def categoria(categoria_id):
+    return _retrato('categorias').por_id.get(categoria_id)
+
+
+def pontos_retirada(apenas_ativos=True):
+    """Pontos de retirada por nome (somente os ativos, por padrão)"""
+    registros = _retrato('pontos_retirada').registros
+    return tuple(p for p in registros if p.ativo) if apenas_ativos else registros
+
+
+def taxas_entrega(apenas_ativas=True):
+    """Taxas de entrega por região (somente as ativas, por padrão)"""
+    registros = _retrato('taxas_entrega').registros
+    return tuple(t for t in registros if t.ativo) if apenas_ativas else registros
+
+
+def taxa_entrega(taxa_id):
+    return _retrato('taxas_entrega').por_id.get(taxa_id)
+
+
+def invalidar_cache_referencia(*nomes):
+    """Descarta os retratos (todas as tabelas, se nenhum nome for informado)"""
+    _cache().invalidar(*nomes)
+
+
+# ---------------------- Invalidação ----------------------
+# Qualquer gravação confirmada nessas tabelas (CRUD do admin e de pedidos, seeds)
+# invalida o retrato correspondente depois do commit.
+
+_ALTERADAS = 'referencia_alteradas'
+
+
+@event.listens_for(db.session, 'after_flush')
+def _anotar_tabelas(session, contexto):
+    alteradas = session.info.setdefault(_ALTERADAS, set())
+    for objeto in list(session.new) + list(session.deleted):
+        nome = _NOMES_POR_MODELO.get(type(objeto))
+        if nome:
+            alteradas.add(nome)
+    for objeto in session.dirty:
+        # Ignora objetos "sujos" só por backrefs (ex: categoria.produtos)
+        nome = _NOMES_POR_MODELO.get(type(objeto))
+        if nome and session.is_modified(objeto, include_collections=False):
+            alteradas.add(nome)
+
+
+def registrar_gravacao(modelo, session=None):
+    """
+    Anota gravação feita fora do unit of work (INSERT/UPDATE direto na tabela),
+    para que a tabela também seja invalidada no commit
+    """
+    nome = _NOMES_POR_MODELO.get(modelo)
+    if nome:
+        session = session or db.session()
+        session.info.setdefault(_ALTERADAS, set()).add(nome)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidar_tabelas(session):
+    alteradas = session.info.pop(_ALTERADAS, None)
+    if alteradas and has_app_context():
+        invalidar_cache_referencia(*alteradas)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _descartar_tabelas(session, transacao_anterior):
+    if not session.in_transaction():
+        session.info.pop(_ALTERADAS, None)
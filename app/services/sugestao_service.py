@@ -0,0 +1,279 @@
+"""
+Serviço de sugestões de busca (autocomplete)
+Índice de prefixos em memória, por processo, sobre nomes de produtos, tags e produtores
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from app.extensions import db
+from app.models.core import Produto, Produtor
+from app.services.busca_service import extrair_termos
+from app.services.tag_service import dividir_tags
+
+# Ordem de exibição entre tipos com a mesma relevância
+ORDEM_TIPOS = {'produto': 0, 'tag': 1, 'produtor': 2}
+
+
+class IndiceSugestoes:
+    """
+    Array ordenado de chaves (texto sem acento a partir de cada palavra do rótulo),
+    consultado com bisect: o custo da consulta não depende do tamanho do catálogo
+    além do log n da busca binária.
+
+    Documentos são identificados por (tipo, id): ('produto', 12), ('produtor', 3),
+    ('tag', 'organico'). Tags são contadas por produto e somem quando nenhum produto as usa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chaves = []          # [(chave, tipo, id)] ordenado
+        self._documentos = {}      # (tipo, id) -> (rótulo, palavras, chaves)
+        self._tags_produto = {}    # id do produto -> [slugs]
+        self._uso_tags = {}        # slug -> quantidade de produtos
+        self.construido_em = 0.0
+        self.recarga = threading.Lock()  # Só um chamador recarrega do banco por vez
+        self._em_carga = False     # durante a carga completa as chaves são ordenadas uma vez no fim
+        self._durante_recarga = None  # alterações confirmadas enquanto a recarga lê o banco
+
+    @staticmethod
+    def _chaves_do_rotulo(rotulo):
+        palavras = extrair_termos(rotulo)
+        return palavras, [' '.join(palavras[i:]) for i in range(len(palavras))]
+
+    def _adicionar(self, tipo, ref, rotulo):
+        self._remover(tipo, ref)
+        palavras, chaves = self._chaves_do_rotulo(rotulo)
+        if not chaves:
+            return
+        self._documentos[(tipo, ref)] = (rotulo, palavras, chaves)
+        for chave in chaves:
+            if self._em_carga:
+                self._chaves.append((chave, tipo, ref))
+            else:
+                insort(self._chaves, (chave, tipo, ref))
+
+    def _remover(self, tipo, ref):
+        documento = self._documentos.pop((tipo, ref), None)
+        if not documento:
+            return
+        for chave in documento[2]:
+            posicao = bisect_left(self._chaves, (chave, tipo, ref))
+            if posicao < len(self._chaves) and self._chaves[posicao] == (chave, tipo, ref):
+                del self._chaves[posicao]
+
+    def _definir_tags(self, produto_id, pares):
+        for slug in self._tags_produto.pop(produto_id, []):
+            self._uso_tags[slug] -= 1
+            if not self._uso_tags[slug]:
+                del self._uso_tags[slug]
+                self._remover('tag', slug)
+        if not pares:
+            return
+        self._tags_produto[produto_id] = [slug for slug, _ in pares]
+        for slug, nome in pares:
+            if slug not in self._uso_tags:
+                self._uso_tags[slug] = 0
+                self._adicionar('tag', slug, nome)
+            self._uso_tags[slug] += 1
+
+    def _anotar(self, metodo, *args):
+        """Guarda a alteração para reaplicá-la sobre a foto que a recarga em curso vai instalar"""
+        if self._durante_recarga is not None:
+            self._durante_recarga.append((metodo, args))
+
+    def atualizar_produto(self, produto_id, nome, tags):
+        with self._lock:
+            self._anotar('atualizar_produto', produto_id, nome, tags)
+            self._adicionar('produto', produto_id, nome)
+            self._definir_tags(produto_id, dividir_tags(tags))
+
+    def remover_produto(self, produto_id):
+        with self._lock:
+            self._anotar('remover_produto', produto_id)
+            self._remover('produto', produto_id)
+            self._definir_tags(produto_id, [])
+
+    def atualizar_produtor(self, produtor_id, nome):
+        with self._lock:
+            self._anotar('atualizar_produtor', produtor_id, nome)
+            self._adicionar('produtor', produtor_id, nome)
+
+    def remover_produtor(self, produtor_id):
+        with self._lock:
+            self._anotar('remover_produtor', produtor_id)
+            self._remover('produtor', produtor_id)
+
+    @property
+    def recarregando(self):
+        return self._durante_recarga is not None
+
+    def iniciar_recarga(self):
+        """Chamar antes de ler o banco: a partir daqui as alterações são anotadas"""
+        with self._lock:
+            self._durante_recarga = []
+
+    def cancelar_recarga(self):
+        with self._lock:
+            self._durante_recarga = None
+
+    def carregar(self, produtos, produtores):
+        """
+        Substitui todo o conteúdo do índice. As alterações confirmadas desde
+        iniciar_recarga() podem não estar na foto lida do banco e são reaplicadas
+        sobre ela (na ordem dos commits) antes da troca.
+        """
+        novo = IndiceSugestoes()
+        novo._em_carga = True
+        for produto_id, nome, tags in produtos:
+            novo.atualizar_produto(produto_id, nome, tags)
+        for produtor_id, nome in produtores:
+            novo.atualizar_produtor(produtor_id, nome)
+        novo._chaves.sort()
+        novo._em_carga = False
+        with self._lock:
+            for metodo, args in self._durante_recarga or ():
+                getattr(novo, metodo)(*args)
+            self._durante_recarga = None
+            self._chaves = novo._chaves
+            self._documentos = novo._documentos
+            self._tags_produto = novo._tags_produto
+            self._uso_tags = novo._uso_tags
+            self.construido_em = time.monotonic()
+
+    def sugerir(self, texto, limite=8, varredura=200):
+        """
+        Sugestões para o texto digitado; o último termo é tratado como prefixo
+        e os demais precisam iniciar alguma palavra do rótulo.
+
+        Returns:
+            list: [(tipo, id, rótulo)] mais relevantes primeiro
+        """
+        termos = extrair_termos(texto)
+        if not termos:
+            return []
+        prefixo = ' '.join(termos)
+        encontrados = {}
+        with self._lock:
+            # Busca pela frase inteira e, se houver mais de um termo, pelo mais longo
+            for busca in dict.fromkeys([prefixo, max(termos, key=len)]):
+                posicao = bisect_left(self._chaves, (busca,))
+                for chave, tipo, ref in self._chaves[posicao:posicao + varredura]:
+                    if not chave.startswith(busca):
+                        break
+                    rotulo, palavras, chaves = self._documentos[(tipo, ref)]
+                    if not all(any(p.startswith(t) for p in palavras) for t in termos):
+                        continue
+                    inicio = chaves[0].startswith(prefixo)
+                    atual = encontrados.get((tipo, ref))
+                    if atual is None or inicio:
+                        encontrados[(tipo, ref)] = (not inicio, ORDEM_TIPOS.get(tipo, 9), len(rotulo), rotulo)
+        ordenados = sorted(encontrados.items(), key=lambda item: item[1])
+        return [(tipo, ref, dados[3]) for (tipo, ref), dados in ordenados[:limite]]
+
+
+def indice_sugestoes(app=None):
+    """Índice do processo atual, guardado em app.extensions"""
+    app = app or current_app._get_current_object()
+    return app.extensions.setdefault('sugestoes_busca', IndiceSugestoes())
+
+
+def reconstruir_indice_sugestoes(app=None):
+    """
+    Carrega o índice a partir do banco (na primeira consulta do processo e quando
+    fica mais velho que SUGESTOES_TTL, para convergir com gravações de outros processos)
+    """
+    indice = indice_sugestoes(app)
+    indice.iniciar_recarga()
+    try:
+        produtos = db.session.query(Produto.id, Produto.nome, Produto.tags).all()
+        produtores = db.session.query(Produtor.id, Produtor.nome).all()
+    except Exception:
+        indice.cancelar_recarga()
+        raise
+    indice.carregar(produtos, produtores)
+    return indice
+
+
+def _recarregar_em_segundo_plano(app, indice):
+    """Executada em thread própria, que já detém indice.recarga"""
+    try:
+        with app.app_context():
+            reconstruir_indice_sugestoes(app)
+    except Exception as e:
+        app.logger.error(f'Erro ao recarregar sugestões de busca: {e}')
+    finally:
+        indice.recarga.release()
+
+
+def sugerir(texto, limite=8):
+    """
+    Sugestões de busca do processo atual (não consulta o banco fora das recargas).
+
+    A primeira carga é feita por um único chamador, enquanto os demais aguardam;
+    depois do TTL, um único chamador dispara a recarga em segundo plano e todos
+    seguem respondendo com o índice atual até a troca.
+    """
+    indice = indice_sugestoes()
+    if not indice.construido_em:
+        with indice.recarga:
+            if not indice.construido_em:
+                reconstruir_indice_sugestoes()
+    else:
+        ttl = current_app.config.get('SUGESTOES_TTL', 300)
+        if ttl and time.monotonic() - indice.construido_em > ttl and indice.recarga.acquire(blocking=False):
+            app = current_app._get_current_object()
+            threading.Thread(target=_recarregar_em_segundo_plano, args=(app, indice), daemon=True).start()
+    return indice.sugerir(texto, limite=limite)
+
+
+# ---------------------- Atualização incremental ----------------------
+# As gravações de Produto/Produtor são anotadas a cada flush e aplicadas ao índice
+# só depois do commit, para que um rollback não deixe sugestões fantasmas.
+
+_PENDENTES = 'sugestoes_pendentes'
+
+
+def _alterou(objeto, *atributos):
+    estado = inspect(objeto)
+    return any(estado.attrs[nome].history.has_changes() for nome in atributos)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _anotar_alteracoes(session, contexto):
+    pendentes = session.info.setdefault(_PENDENTES, [])
+    for objeto in list(session.new) + list(session.dirty):
+        if isinstance(objeto, Produto) and (objeto in session.new or _alterou(objeto, 'nome', 'tags')):
+            pendentes.append(('produto', objeto.id, (objeto.nome, objeto.tags)))
+        elif isinstance(objeto, Produtor) and (objeto in session.new or _alterou(objeto, 'nome')):
+            pendentes.append(('produtor', objeto.id, (objeto.nome,)))
+    for objeto in session.deleted:
+        if isinstance(objeto, (Produto, Produtor)):
+            pendentes.append((objeto.__class__.__name__.lower(), objeto.id, None))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _aplicar_alteracoes(session):
+    pendentes = session.info.pop(_PENDENTES, None)
+    if not pendentes or not has_app_context():
+        return
+    indice = current_app.extensions.get('sugestoes_busca')
+    if indice is None or not (indice.construido_em or indice.recarregando):
+        return
+    for tipo, ref, valores in pendentes:
+        if tipo == 'produto':
+            if valores is None:
+                indice.remover_produto(ref)
+            else:
+                indice.atualizar_produto(ref, *valores)
+        elif valores is None:
+            indice.remover_produtor(ref)
+        else:
+            indice.atualizar_produtor(ref, *valores)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _descartar_alteracoes(session, transacao_anterior):
+    if not session.in_transaction():
+        session.info.pop(_PENDENTES, None)
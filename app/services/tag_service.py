@@ -0,0 +1,94 @@
+"""
+Serviço de tags de produtos
+Converte o texto livre de tags (ex: 'orgânico, artesanal') em registros normalizados
+"""
+import re
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models.core import Produto, Tag, ProdutoTag
+from app.services.busca_service import normalizar_texto
+
+# Slug da tag usada pelo filtro "Apenas Orgânicos"
+SLUG_ORGANICO = 'organico'
+
+
+def slug_tag(nome):
+    """Slug da tag: sem acentos, minúsculo, espaços viram hífen (ex: 'Orgânico' -> 'organico')"""
+    return re.sub(r'[^a-z0-9]+', '-', normalizar_texto(nome)).strip('-')[:60]
+
+
+def dividir_tags(texto):
+    """
+    Quebra o texto de tags separado por vírgula/ponto e vírgula
+
+    Returns:
+        list: [(slug, nome)] sem repetições, na ordem digitada
+    """
+    tags = []
+    vistos = set()
+    for parte in re.split(r'[,;]', texto or ''):
+        nome = parte.strip()[:50]
+        slug = slug_tag(nome)
+        if slug and slug not in vistos:
+            vistos.add(slug)
+            tags.append((slug, nome))
+    return tags
+
+
+def obter_tags(pares):
+    """
+    Busca (ou cria) as tags informadas
+
+    Args:
+        pares: [(slug, nome)]
+
+    Returns:
+        list: Objetos Tag na mesma ordem
+    """
+    if not pares:
+        return []
+    slugs = [slug for slug, _ in pares]
+    existentes = {t.slug: t for t in Tag.query.filter(Tag.slug.in_(slugs)).all()}
+    for slug, nome in pares:
+        if slug in existentes:
+            continue
+        # Savepoint: outro processo pode ter criado a mesma tag ao mesmo tempo
+        try:
+            with db.session.begin_nested():
+                tag = Tag(nome=nome, slug=slug)
+                db.session.add(tag)
+            existentes[slug] = tag
+        except IntegrityError:
+            existentes[slug] = Tag.query.filter_by(slug=slug).one()
+    return [existentes[slug] for slug in slugs]
+
+
+def sincronizar_tags(produto):
+    """Atualiza as tags normalizadas do produto a partir de `produto.tags`"""
+    produto.tags_normalizadas = obter_tags(dividir_tags(produto.tags))
+
+
+def criterio_tag(slug):
+    """Expressão EXISTS (usa o índice de produto_tags) para produtos com a tag"""
+    return db.session.query(ProdutoTag.produto_id).join(
+        Tag, Tag.id == ProdutoTag.tag_id
+    ).filter(
+        ProdutoTag.produto_id == Produto.id, Tag.slug == slug
+    ).exists()
+
+
+def listar_tags(limite=None):
+    """
+    Tags em uso com a quantidade de produtos, da mais usada para a menos usada
+
+    Returns:
+        list: [(nome, slug, total)]
+    """
+    total = func.count(ProdutoTag.produto_id)
+    query = db.session.query(Tag.nome, Tag.slug, total).join(
+        ProdutoTag, ProdutoTag.tag_id == Tag.id
+    ).group_by(Tag.id, Tag.nome, Tag.slug).order_by(total.desc(), Tag.nome.asc())
+    if limite:
+        query = query.limit(limite)
+    return [tuple(linha) for linha in query.all()]
@@ -0,0 +1,368 @@
+"""
+Serviço de webhooks do gateway de pagamento
+Caixa de entrada: o endpoint só grava a notificação e responde em milissegundos;
+o worker (flask webhooks-worker) consulta o gateway, atualiza o pedido e envia e-mails
+"""
+import json
+import secrets
+from contextlib import nullcontext
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models.core import Pedido, WebhookRecebido, WebhookEvento
+from app.services.email_service import EmailService
+from app.services.estoque_service import devolver_estoque
+
+
+def _agora():
+    """Instante atual em UTC sem fuso, como as datas são gravadas no banco"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Status do gateway após os quais o pagamento não muda mais: novas notificações
+# desse pagamento nem chegam a consultar o gateway
+STATUS_FINAIS = ('rejected', 'cancelled', 'refunded')
+
+
+class ErroTemporario(Exception):
+    """Falha que vale nova tentativa mais tarde (gateway fora do ar, pagamento ainda não visível)"""
+
+
+# ---------------------- Recebimento ----------------------
+
+def registrar_webhook(payload, dados, origem='mercadopago'):
+    """
+    Grava a notificação bruta na caixa de entrada (quem chama faz o commit)
+
+    Args:
+        payload: Corpo da requisição, como recebido
+        dados: JSON já decodificado (tipo, ação e ID do recurso)
+    """
+    agora = _agora()
+    recurso = (dados.get('data') or {}).get('id')
+    evento = WebhookRecebido(
+        origem=origem,
+        tipo=dados.get('type'),
+        acao=dados.get('action'),
+        recurso_id=str(recurso) if recurso is not None else None,
+        payload=payload,
+        status='pendente',
+        tentativas=0,
+        recebido_em=agora,
+        disponivel_em=agora,
+    )
+    db.session.add(evento)
+    return evento
+
+
+# ---------------------- Processamento ----------------------
+
+class TravasPorChave:
+    """Um lock por chave (ex: id do pedido), para serializar o trabalho de um mesmo pedido entre threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._travas = {}
+
+    def para(self, chave):
+        with self._lock:
+            return self._travas.setdefault(chave, threading.Lock())
+
+
+def ja_aplicado(payment_id, recebido_em=None):
+    """
+    Se a notificação já está coberta pelo registro de eventos (consulta pelo índice
+    único, sem chamar o gateway): o pagamento chegou a um status final ou foi
+    consultado depois que a notificação chegou
+    """
+    filtro = WebhookEvento.status.in_(STATUS_FINAIS)
+    if recebido_em is not None:
+        filtro = or_(filtro, WebhookEvento.consultado_em >= recebido_em)
+    return db.session.execute(
+        db.select(WebhookEvento.id).where(WebhookEvento.payment_id == payment_id, filtro).limit(1)
+    ).first() is not None
+
+
+def _registrado(payment_id, action, status):
+    return db.session.execute(
+        db.select(WebhookEvento.id).where(
+            WebhookEvento.payment_id == payment_id,
+            WebhookEvento.action == action,
+            WebhookEvento.status == status,
+        )
+    ).first() is not None
+
+
+def processar_notificacao_pagamento(dados, travas=None, recebido_em=None, webhook_id=None):
+    """
+    Consulta o pagamento no gateway e aplica o status ao pedido, uma vez por
+    (pagamento, ação, status): reenvios do gateway terminam em 'duplicado'
+
+    Args:
+        dados: JSON do webhook
+        travas: TravasPorChave para serializar a gravação por pedido
+        recebido_em: Chegada da notificação (dispensa a consulta se já houve uma depois)
+        webhook_id: Evento da caixa de entrada, guardado no registro
+
+    Returns:
+        str: desfecho ('aprovado', 'pendente', 'rejeitado', 'cancelado', 'reembolsado',
+            'ignorado', 'duplicado')
+
+    Raises:
+        ErroTemporario: pagamento não encontrado no gateway (nova tentativa depois)
+    """
+    from app.services.pagamento_service import PagamentoService
+
+    payment_id = (dados.get('data') or {}).get('id')
+    if not payment_id:
+        return 'ignorado'
+    payment_id = str(payment_id)
+    action = dados.get('action') or dados.get('type') or ''
+
+    if ja_aplicado(payment_id, recebido_em):
+        db.session.rollback()
+        return 'duplicado'
+
+    consultado_em = _agora()
+    pagamento_info = PagamentoService().consultar_pagamento(payment_id)
+    if not pagamento_info:
+        raise ErroTemporario(f'Pagamento {payment_id} não encontrado no gateway')
+
+    status = pagamento_info.get('status') or ''
+    if _registrado(payment_id, action, status):
+        db.session.rollback()
+        return 'duplicado'
+
+    pedido_id = pagamento_info.get('external_reference')
+    if not pedido_id:
+        current_app.logger.warning(f'Referência externa não encontrada no pagamento {payment_id}')
+        return 'ignorado'
+
+    trava = travas.para(str(pedido_id)) if travas else nullcontext()
+    with trava:
+        # FOR UPDATE serializa também entre processos no PostgreSQL
+        pedido = db.session.get(Pedido, int(pedido_id), with_for_update=True)
+        if not pedido:
+            current_app.logger.warning(f'Pedido {pedido_id} não encontrado')
+            db.session.rollback()
+            return 'ignorado'
+
+        status_detail = pagamento_info.get('status_detail')
+        current_app.logger.info(f'Processando pagamento {payment_id} - Status: {status} - Pedido: {pedido_id}')
+
+        desfecho = 'ignorado'
+        enviar_confirmacao = False
+        if status == 'approved':
+            if pedido.status_pagamento != 'aprovado':
+                pedido.status_pagamento = 'aprovado'
+                pedido.status = 'Pagamento confirmado'
+                pedido.data_pagamento = datetime.utcnow()
+                enviar_confirmacao = True
+            desfecho = 'aprovado'
+        elif status == 'pending':
+            pedido.status_pagamento = 'pendente'
+            pedido.status = 'Aguardando pagamento'
+            desfecho = 'pendente'
+        elif status == 'rejected':
+            pedido.status_pagamento = 'rejeitado'
+            pedido.status = 'Pagamento rejeitado'
+            pedido.motivo_rejeicao = status_detail
+            current_app.logger.warning(f'Pagamento rejeitado para pedido #{pedido.id}: {status_detail}')
+            desfecho = 'rejeitado'
+        elif status == 'cancelled':
+            # Notificação repetida não devolve o estoque duas vezes
+            if pedido.status != 'Cancelado':
+                devolver_estoque(pedido.itens)
+            pedido.status_pagamento = 'cancelado'
+            pedido.status = 'Cancelado'
+            pedido.data_cancelamento = datetime.utcnow()
+            pedido.motivo_cancelamento = 'Pagamento cancelado'
+            desfecho = 'cancelado'
+        elif status == 'refunded':
+            if pedido.status not in ('Cancelado', 'Reembolsado'):
+                devolver_estoque(pedido.itens)
+            pedido.status_pagamento = 'reembolsado'
+            pedido.status = 'Reembolsado'
+            desfecho = 'reembolsado'
+
+        db.session.add(WebhookEvento(
+            payment_id=payment_id,
+            action=action,
+            status=status,
+            pedido_id=pedido.id,
+            webhook_id=webhook_id,
+            desfecho=desfecho,
+            resposta=json.dumps(pagamento_info, default=str),
+            consultado_em=consultado_em,
+        ))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Outro worker aplicou o mesmo evento entre a consulta e o commit
+            db.session.rollback()
+            return 'duplicado'
+
+    if enviar_confirmacao:
+        EmailService().enviar_confirmacao_pagamento(pedido)
+        current_app.logger.info(f'Pagamento aprovado para pedido #{pedido.id}')
+    return desfecho
+
+
+def _atraso(tentativas):
+    """Espera antes da próxima tentativa: 30s, 1min, 2min... até 1h"""
+    return timedelta(seconds=min(30 * 2 ** max(tentativas - 1, 0), 3600))
+
+
+def reservar_webhooks(limite, agora=None):
+    """
+    Assume até `limite` eventos disponíveis (pendentes no prazo ou travados há mais de
+    WEBHOOKS_TRAVA_SEGUNDOS por um worker que parou), marcando-os com um token de lote.
+    Workers concorrentes nunca recebem o mesmo evento.
+
+    Returns:
+        list: [(id, recurso_id)] em ordem de chegada
+    """
+    agora = agora or _agora()
+    trava_expirada = agora - timedelta(seconds=current_app.config.get('WEBHOOKS_TRAVA_SEGUNDOS', 600))
+    disponivel = or_(
+        and_(WebhookRecebido.status == 'pendente', WebhookRecebido.disponivel_em <= agora),
+        and_(WebhookRecebido.status == 'processando', WebhookRecebido.travado_em < trava_expirada),
+    )
+    candidatos = db.select(WebhookRecebido.id).where(disponivel).order_by(WebhookRecebido.id).limit(limite)
+    ids = db.session.execute(candidatos).scalars().all()
+    if not ids:
+        db.session.rollback()
+        return []
+    token = secrets.token_hex(16)
+    db.session.execute(
+        db.update(WebhookRecebido).where(WebhookRecebido.id.in_(ids), disponivel).values(
+            status='processando', trava=token, travado_em=agora,
+            tentativas=WebhookRecebido.tentativas + 1,
+        ).execution_options(synchronize_session=False)
+    )
+    reservados = db.session.execute(
+        db.select(WebhookRecebido.id, WebhookRecebido.recurso_id).where(
+            WebhookRecebido.trava == token
+        ).order_by(WebhookRecebido.id)
+    ).all()
+    db.session.commit()
+    return [tuple(linha) for linha in reservados]
+
+
+def processar_webhook(evento_id, travas=None):
+    """
+    Processa um evento da caixa de entrada e registra o resultado; em caso de falha
+    o evento volta para a fila com backoff, até WEBHOOKS_MAX_TENTATIVAS
+
+    Returns:
+        str: desfecho do processamento ou 'erro' / 'reagendado'
+    """
+    evento = db.session.get(WebhookRecebido, evento_id)
+    try:
+        dados = json.loads(evento.payload)
+        if evento.tipo == 'payment':
+            desfecho = processar_notificacao_pagamento(
+                dados, travas, recebido_em=evento.recebido_em, webhook_id=evento.id
+            )
+        else:
+            desfecho = 'ignorado'
+    except Exception as e:
+        db.session.rollback()
+        evento = db.session.get(WebhookRecebido, evento_id)
+        maximo = current_app.config.get('WEBHOOKS_MAX_TENTATIVAS', 8)
+        evento.ultimo_erro = str(e)[:1000]
+        evento.trava = None
+        if evento.tentativas >= maximo:
+            evento.status = 'erro'
+            desfecho = 'erro'
+            current_app.logger.error(f'Webhook #{evento.id} falhou {evento.tentativas} vez(es): {e}')
+        else:
+            evento.status = 'pendente'
+            evento.disponivel_em = _agora() + _atraso(evento.tentativas)
+            desfecho = 'reagendado'
+            current_app.logger.warning(f'Webhook #{evento.id} reagendado: {e}')
+        db.session.commit()
+        return desfecho
+
+    evento = db.session.get(WebhookRecebido, evento_id)
+    evento.status = 'processado'
+    evento.processado_em = _agora()
+    evento.ultimo_erro = None
+    evento.trava = None
+    db.session.commit()
+    return desfecho
+
+
+def _processar_grupo(app, eventos, travas):
+    """Eventos do mesmo pagamento, em ordem de chegada, numa mesma thread"""
+    desfechos = Counter()
+    with app.app_context():
+        for evento_id in eventos:
+            desfechos[processar_webhook(evento_id, travas)] += 1
+    return desfechos
+
+
+def drenar_webhooks(concorrencia=None, lote=None):
+    """
+    Assume um lote da caixa de entrada e processa com até `concorrencia` threads.
+    Eventos do mesmo pagamento ficam na mesma thread (em ordem) e a gravação de
+    cada pedido é serializada por trava.
+
+    Returns:
+        Counter: desfechos do lote (vazio se não havia eventos)
+    """
+    config = current_app.config
+    concorrencia = concorrencia or config.get('WEBHOOKS_CONCORRENCIA', 4)
+    lote = lote or config.get('WEBHOOKS_LOTE', 100)
+    reservados = reservar_webhooks(lote)
+    if not reservados:
+        return Counter()
+
+    grupos = OrderedDict()
+    for evento_id, recurso_id in reservados:
+        grupos.setdefault(recurso_id or f'evento-{evento_id}', []).append(evento_id)
+
+    app = current_app._get_current_object()
+    travas = TravasPorChave()
+    desfechos = Counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        for resultado in executor.map(lambda eventos: _processar_grupo(app, eventos, travas), grupos.values()):
+            desfechos.update(resultado)
+    return desfechos
+
+
+# ---------------------- Reprocessamento ----------------------
+
+def reenfileirar_webhooks(status=('erro',), desde=None, ate=None, recurso_id=None):
+    """
+    Devolve para a fila, em um UPDATE, eventos já armazenados (ex: após uma queda do
+    gateway). Os que já foram aplicados terminam em 'duplicado' sem nova consulta.
+
+    Args:
+        status: Situações a reprocessar ('erro', 'processado', 'pendente')
+        desde / ate: Janela de recebimento
+        recurso_id: Só as notificações de um pagamento
+
+    Returns:
+        int: Eventos reenfileirados
+    """
+    filtros = [WebhookRecebido.status.in_(status)]
+    if desde:
+        filtros.append(WebhookRecebido.recebido_em >= desde)
+    if ate:
+        filtros.append(WebhookRecebido.recebido_em <= ate)
+    if recurso_id:
+        filtros.append(WebhookRecebido.recurso_id == str(recurso_id))
+    resultado = db.session.execute(
+        db.update(WebhookRecebido).where(*filtros).values(
+            status='pendente', tentativas=0, disponivel_em=_agora(),
+            trava=None, travado_em=None, ultimo_erro=None,
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return resultado.rowcount
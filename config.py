@@ -12,10 +12,56 @@ class Config:
     # Upload de arquivos
     MAX_CONTENT_LENGTH = 2 * 1024 * 1024  # 2MB
     
+    # Catálogo: produtos por página (paginação por cursor)
+    CATALOGO_POR_PAGINA = int(os.environ.get('CATALOGO_POR_PAGINA', 24))
+    # Cache das contagens de facetas (segundos / quantidade de combinações de filtros)
+    CATALOGO_FACETAS_TTL = int(os.environ.get('CATALOGO_FACETAS_TTL', 60))
+    CATALOGO_FACETAS_MAX = 256
+    # Sugestões de busca: índice em memória reconstruído do banco a cada N segundos
+    # (converge com gravações de outros processos; 0 desliga)
+    SUGESTOES_TTL = int(os.environ.get('SUGESTOES_TTL', 300))
+    # Categorias, pontos de retirada e taxas de entrega em memória: recarregados após
+    # gravações confirmadas neste processo ou a cada N segundos (0 desliga o prazo)
+    REFERENCIA_CACHE_TTL = int(os.environ.get('REFERENCIA_CACHE_TTL', 300))
+    
     # Configurações de Pagamento - Mercado Pago
     MERCADOPAGO_ACCESS_TOKEN = os.environ.get('MERCADOPAGO_ACCESS_TOKEN')
     MERCADOPAGO_PUBLIC_KEY = os.environ.get('MERCADOPAGO_PUBLIC_KEY')
     MERCADOPAGO_WEBHOOK_SECRET = os.environ.get('MERCADOPAGO_WEBHOOK_SECRET')
+    # Cliente HTTP do gateway: conexões mantidas por processo, timeouts (s) e retentativas
+    MERCADOPAGO_TIMEOUT_CONEXAO = float(os.environ.get('MERCADOPAGO_TIMEOUT_CONEXAO', 3.05))
+    MERCADOPAGO_TIMEOUT_LEITURA = float(os.environ.get('MERCADOPAGO_TIMEOUT_LEITURA', 10))
+    MERCADOPAGO_POOL_CONEXOES = int(os.environ.get('MERCADOPAGO_POOL_CONEXOES', 10))
+    MERCADOPAGO_RETENTATIVAS = int(os.environ.get('MERCADOPAGO_RETENTATIVAS', 3))
+    # Pagamentos por página na busca em lote (flask relatorio-divergencias)
+    MERCADOPAGO_BUSCA_LIMITE = int(os.environ.get('MERCADOPAGO_BUSCA_LIMITE', 1000))
+    # Imagens de QR Code PIX mantidas em memória por processo
+    PIX_QR_CACHE_MAX = int(os.environ.get('PIX_QR_CACHE_MAX', 256))
+    # Conciliação de pagamentos pendentes (flask verificar-pagamentos): consultas
+    # simultâneas, limite de consultas por segundo ao gateway e resultados por commit
+    RECONCILIACAO_PARALELISMO = int(os.environ.get('RECONCILIACAO_PARALELISMO', 8))
+    RECONCILIACAO_TAXA = float(os.environ.get('RECONCILIACAO_TAXA', 10))
+    RECONCILIACAO_LOTE = int(os.environ.get('RECONCILIACAO_LOTE', 50))
+    
+    # Pedidos PIX expirados por lote/commit (flask expirar-pedidos-pix)
+    PIX_EXPIRACAO_LOTE = int(os.environ.get('PIX_EXPIRACAO_LOTE', 500))
+    
+    # Agendador embutido (flask scheduler run): intervalo de cada tarefa (s), acréscimo
+    # aleatório, validade da trava no banco (s) e frequência de verificação (s)
+    AGENDADOR_INTERVALO_EXPIRAR_PIX = int(os.environ.get('AGENDADOR_INTERVALO_EXPIRAR_PIX', 60))
+    AGENDADOR_INTERVALO_VERIFICAR_PAGAMENTOS = int(os.environ.get('AGENDADOR_INTERVALO_VERIFICAR_PAGAMENTOS', 300))
+    AGENDADOR_INTERVALO_DIVERGENCIAS = int(os.environ.get('AGENDADOR_INTERVALO_DIVERGENCIAS', 86400))
+    AGENDADOR_INTERVALO_ATUALIZAR_PRECOS = int(os.environ.get('AGENDADOR_INTERVALO_ATUALIZAR_PRECOS', 3600))
+    AGENDADOR_JITTER = float(os.environ.get('AGENDADOR_JITTER', 0.1))
+    AGENDADOR_TRAVA_TTL = int(os.environ.get('AGENDADOR_TRAVA_TTL', 120))
+    AGENDADOR_TICK = float(os.environ.get('AGENDADOR_TICK', 5))
+    
+    # Caixa de entrada de webhooks (flask webhooks-worker): threads, eventos por rodada,
+    # tentativas antes de marcar como erro e tempo para reassumir eventos de um worker parado
+    WEBHOOKS_CONCORRENCIA = int(os.environ.get('WEBHOOKS_CONCORRENCIA', 4))
+    WEBHOOKS_LOTE = int(os.environ.get('WEBHOOKS_LOTE', 100))
+    WEBHOOKS_MAX_TENTATIVAS = int(os.environ.get('WEBHOOKS_MAX_TENTATIVAS', 8))
+    WEBHOOKS_TRAVA_SEGUNDOS = int(os.environ.get('WEBHOOKS_TRAVA_SEGUNDOS', 600))
     
     # URL base para webhooks (produção)
     WEBHOOK_URL = os.environ.get('WEBHOOK_URL', 'http://localhost:5000')
@@ -15,9 +15,11 @@ from app import create_app
 from app.extensions import db
 from app.models.core import (
     Usuario, Cliente, Produtor, Categoria, Produto,
-    PontoRetirada, TaxaEntrega, Pedido, ItemPedido
+    PontoRetirada, TaxaEntrega
 )
-from datetime import datetime, timedelta
+from app.services.busca_service import BuscaService
+from app.services.lote_service import inserir_em_lote
+from app.services.preco_service import atualizar_precos_efetivos
 
 app = create_app()
 
@@ -52,14 +54,10 @@ def seed_categorias():
             {"nome": "Outros", "descricao": "Produtos diversos", "icone": "box", "valor_minimo": 5.0, "quantidade_minima": 1.0},
         ]
         
-        for cat_data in categorias:
-            cat = Categoria.query.filter_by(nome=cat_data['nome']).first()
-            if not cat:
-                cat = Categoria(**cat_data)
-                db.session.add(cat)
+        inseridas = inserir_em_lote(Categoria, categorias, unicos=('nome',))
         
         db.session.commit()
-        print(f"✅ {len(categorias)} categorias inseridas!")
+        print(f"✅ {len(inseridas)} categorias inseridas!")
 
 def seed_usuarios():
     """Cria usuários de teste"""
@@ -264,31 +262,27 @@ def seed_produtos():
             },
         ]
         
-        for prod_data in produtos:
-            categoria = Categoria.query.filter_by(nome=prod_data['categoria']).first()
-            if not categoria:
-                continue
-            
-            produto = Produto.query.filter_by(
-                nome=prod_data['nome'],
-                produtor_id=prod_data['produtor'].id
-            ).first()
-            
-            if not produto:
-                produto = Produto(
-                    nome=prod_data['nome'],
-                    descricao=prod_data['descricao'],
-                    preco=prod_data['preco'],
-                    unidade=prod_data['unidade'],
-                    estoque=prod_data['estoque'],
-                    origem=prod_data['origem'],
-                    produtor_id=prod_data['produtor'].id,
-                    categoria_id=categoria.id
-                )
-                db.session.add(produto)
+        categorias = dict(db.session.query(Categoria.nome, Categoria.id).all())
+        registros = [{
+            'nome': prod_data['nome'],
+            'descricao': prod_data['descricao'],
+            'preco': prod_data['preco'],
+            'unidade': prod_data['unidade'],
+            'estoque': prod_data['estoque'],
+            'origem': prod_data['origem'],
+            'produtor_id': prod_data['produtor'].id,
+            'categoria_id': categorias[prod_data['categoria']],
+        } for prod_data in produtos if prod_data['categoria'] in categorias]
+        inseridos = inserir_em_lote(Produto, registros, unicos=('nome', 'produtor_id'))
         
+        # inserir_em_lote grava com INSERT direto na tabela, sem os eventos do ORM que
+        # materializam produtos.preco_efetivo e alimentam o índice full-text. Sem estas
+        # duas chamadas os produtos do seed ficam sem preço efetivo (somem dos filtros
+        # e da ordenação por preço) e fora da busca; não remova ao editar o seed
+        atualizar_precos_efetivos()
+        BuscaService().reconstruir_indice()
         db.session.commit()
-        print(f"✅ {len(produtos)} produtos inseridos!")
+        print(f"✅ {len(inseridos)} produtos inseridos!")
 
 def seed_logistica():
     """Cria pontos de retirada e taxas de entrega"""
@@ -318,11 +312,7 @@ def seed_logistica():
             },
         ]
         
-        for p in pontos:
-            ponto = PontoRetirada.query.filter_by(nome=p['nome']).first()
-            if not ponto:
-                ponto = PontoRetirada(**p)
-                db.session.add(ponto)
+        inserir_em_lote(PontoRetirada, pontos, unicos=('nome',))
         
         # Taxas de Entrega
         taxas = [
@@ -366,11 +356,7 @@ def seed_logistica():
             {"regiao": "Lucena", "valor": 40.0, "prazo_dias": 4, "ativo": True},
         ]
         
-        for t in taxas:
-            taxa = TaxaEntrega.query.filter_by(regiao=t['regiao']).first()
-            if not taxa:
-                taxa = TaxaEntrega(**t)
-                db.session.add(taxa)
+        inserir_em_lote(TaxaEntrega, taxas, unicos=('regiao',))
         
         db.session.commit()
         print(f"✅ {len(pontos)} pontos de retirada e {len(taxas)} taxas de entrega inseridos!")
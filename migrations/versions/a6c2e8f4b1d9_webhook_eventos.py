@@ -0,0 +1,38 @@
+"""Registro de eventos de webhook aplicados (deduplicação e reprocessamento)
+
+Revision ID: a6c2e8f4b1d9
+Revises: f9a3d5e7b2c4
+Create Date: 2026-10-18 18:02:37.215846
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c2e8f4b1d9'
+down_revision = 'f9a3d5e7b2c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhook_eventos',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('payment_id', sa.String(length=100), nullable=False),
+    sa.Column('action', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.String(length=30), nullable=False),
+    sa.Column('pedido_id', sa.Integer(), nullable=True),
+    sa.Column('webhook_id', sa.Integer(), nullable=True),
+    sa.Column('desfecho', sa.String(length=20), nullable=True),
+    sa.Column('resposta', sa.Text(), nullable=True),
+    sa.Column('consultado_em', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['pedido_id'], ['pedidos.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['webhook_id'], ['webhooks_recebidos.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('payment_id', 'action', 'status', name='uq_webhook_eventos_chave')
+    )
+
+
+def downgrade():
+    op.drop_table('webhook_eventos')
@@ -0,0 +1,39 @@
+"""Preço efetivo materializado em produtos
+
+Revision ID: a93c47e1d5f8
+Revises: f2b6d8e04c13
+Create Date: 2026-10-18 12:02:44.903117
+
+"""
+from datetime import datetime, timezone
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93c47e1d5f8'
+down_revision = 'f2b6d8e04c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('produtos', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('preco_efetivo', sa.Float(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_produtos_preco_efetivo'), ['preco_efetivo'], unique=False)
+
+    # Carga inicial com a mesma regra de preco_service.expressao_preco_efetivo
+    agora = datetime.now(timezone.utc).replace(tzinfo=None)
+    op.get_bind().execute(sa.text(
+        "UPDATE produtos SET preco_efetivo = CASE "
+        "WHEN preco_promocional IS NOT NULL AND preco_promocional > 0 "
+        "AND (sazonal_inicio IS NULL OR sazonal_inicio <= :agora) "
+        "AND (sazonal_fim IS NULL OR sazonal_fim >= :agora) "
+        "THEN preco_promocional ELSE preco END"
+    ), {'agora': agora})
+
+
+def downgrade():
+    with op.batch_alter_table('produtos', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_produtos_preco_efetivo'))
+        batch_op.drop_column('preco_efetivo')
@@ -0,0 +1,25 @@
+"""Índice para a expiração de pedidos PIX
+
+Revision ID: b3d7f1a9c5e2
+Revises: a6c2e8f4b1d9
+Create Date: 2026-10-18 18:41:09.528113
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d7f1a9c5e2'
+down_revision = 'a6c2e8f4b1d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('pedidos', schema=None) as batch_op:
+        batch_op.create_index('ix_pedidos_expiracao_pix', ['forma_pagamento', 'status_pagamento', 'expiracao_pagamento'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('pedidos', schema=None) as batch_op:
+        batch_op.drop_index('ix_pedidos_expiracao_pix')
@@ -0,0 +1,43 @@
+"""Carrinho persistente (carrinhos e itens_carrinho)
+
+Revision ID: b5e2f9c7a614
+Revises: a93c47e1d5f8
+Create Date: 2026-10-18 13:15:52.640381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e2f9c7a614'
+down_revision = 'a93c47e1d5f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('carrinhos',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=True),
+    sa.Column('token', sa.String(length=64), nullable=True),
+    sa.Column('criado_em', sa.DateTime(), nullable=True),
+    sa.Column('atualizado_em', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['usuario_id'], ['usuarios.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('token'),
+    sa.UniqueConstraint('usuario_id')
+    )
+    op.create_table('itens_carrinho',
+    sa.Column('carrinho_id', sa.Integer(), nullable=False),
+    sa.Column('produto_id', sa.Integer(), nullable=False),
+    sa.Column('quantidade', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['carrinho_id'], ['carrinhos.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['produto_id'], ['produtos.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('carrinho_id', 'produto_id')
+    )
+
+
+def downgrade():
+    op.drop_table('itens_carrinho')
+    op.drop_table('carrinhos')
@@ -0,0 +1,83 @@
+"""Índice full-text de produtos (FTS5 / tsvector)
+
+Revision ID: c1f3a9d2e4b7
+Revises: bca70e0f4357
+Create Date: 2026-10-18 09:12:40.118302
+
+"""
+import unicodedata
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c1f3a9d2e4b7'
+down_revision = 'bca70e0f4357'
+branch_labels = None
+depends_on = None
+
+# Campos indexados (colunas de produtos_fts e parâmetros do tsvector)
+CAMPOS = ('nome', 'descricao', 'tags', 'subcategoria', 'origem', 'produtor')
+
+
+def _normalizar(texto):
+    """Mesma dobra de busca_service.normalizar_texto: sem acentos e em minúsculas"""
+    if not texto:
+        return ''
+    return unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def upgrade():
+    dialeto = op.get_bind().dialect.name
+    if dialeto == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5("
+            "nome, descricao, tags, subcategoria, origem, produtor, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        # Carga completa: descarta o que já houver (ex: tabela criada pelo db.create_all)
+        op.execute("DELETE FROM produtos_fts")
+        op.execute(
+            "INSERT INTO produtos_fts (rowid, nome, descricao, tags, subcategoria, origem, produtor) "
+            "SELECT p.id, p.nome, p.descricao, p.tags, p.subcategoria, p.origem, pr.nome "
+            "FROM produtos p LEFT JOIN produtores pr ON pr.id = p.produtor_id"
+        )
+    elif dialeto == 'postgresql':
+        op.execute(
+            "CREATE TABLE IF NOT EXISTS produtos_busca ("
+            "produto_id INTEGER PRIMARY KEY REFERENCES produtos(id) ON DELETE CASCADE, "
+            "documento TSVECTOR NOT NULL)"
+        )
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_produtos_busca_documento ON produtos_busca USING GIN (documento)"
+        )
+        # Carga inicial com o texto dobrado em Python, como o app grava (o tsvector
+        # do PostgreSQL não remove acentos sem a extensão unaccent)
+        conexao = op.get_bind()
+        linhas = conexao.execute(sa.text(
+            "SELECT p.id, p.nome, p.descricao, p.tags, p.subcategoria, p.origem, pr.nome AS produtor "
+            "FROM produtos p LEFT JOIN produtores pr ON pr.id = p.produtor_id"
+        )).mappings().all()
+        inserir = sa.text(
+            "INSERT INTO produtos_busca (produto_id, documento) VALUES (:id, "
+            "setweight(to_tsvector('portuguese', :nome), 'A') || "
+            "setweight(to_tsvector('portuguese', :tags), 'B') || "
+            "setweight(to_tsvector('portuguese', :produtor), 'B') || "
+            "setweight(to_tsvector('portuguese', :subcategoria), 'C') || "
+            "setweight(to_tsvector('portuguese', :origem), 'C') || "
+            "setweight(to_tsvector('portuguese', :descricao), 'D')) "
+            "ON CONFLICT (produto_id) DO UPDATE SET documento = EXCLUDED.documento"
+        )
+        if linhas:
+            conexao.execute(inserir, [
+                {'id': linha['id'], **{campo: _normalizar(linha[campo]) for campo in CAMPOS}}
+                for linha in linhas
+            ])
+
+
+def downgrade():
+    dialeto = op.get_bind().dialect.name
+    if dialeto == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS produtos_fts")
+    elif dialeto == 'postgresql':
+        op.execute("DROP TABLE IF EXISTS produtos_busca")
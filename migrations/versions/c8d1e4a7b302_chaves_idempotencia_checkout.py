@@ -0,0 +1,35 @@
+"""Chaves de idempotência do checkout
+
+Revision ID: c8d1e4a7b302
+Revises: b5e2f9c7a614
+Create Date: 2026-10-18 13:58:21.104662
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8d1e4a7b302'
+down_revision = 'b5e2f9c7a614'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('chaves_idempotencia',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=False),
+    sa.Column('token', sa.String(length=64), nullable=False),
+    sa.Column('pedido_id', sa.Integer(), nullable=True),
+    sa.Column('url_resposta', sa.String(length=300), nullable=True),
+    sa.Column('criado_em', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['pedido_id'], ['pedidos.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['usuario_id'], ['usuarios.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('usuario_id', 'token', name='uq_chaves_idempotencia_usuario_token')
+    )
+
+
+def downgrade():
+    op.drop_table('chaves_idempotencia')
@@ -0,0 +1,49 @@
+"""Travas e histórico do agendador de tarefas
+
+Revision ID: c9e5a3d7f2b8
+Revises: b3d7f1a9c5e2
+Create Date: 2026-10-18 19:15:42.806334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e5a3d7f2b8'
+down_revision = 'b3d7f1a9c5e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('travas_tarefas',
+    sa.Column('nome', sa.String(length=100), nullable=False),
+    sa.Column('dono', sa.String(length=100), nullable=True),
+    sa.Column('expira_em', sa.DateTime(), nullable=True),
+    sa.Column('proxima_em', sa.DateTime(), nullable=True),
+    sa.Column('renovada_em', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('nome')
+    )
+    op.create_table('execucoes_tarefas',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tarefa', sa.String(length=100), nullable=False),
+    sa.Column('no', sa.String(length=100), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('iniciada_em', sa.DateTime(), nullable=False),
+    sa.Column('concluida_em', sa.DateTime(), nullable=True),
+    sa.Column('duracao', sa.Float(), nullable=True),
+    sa.Column('linhas', sa.Integer(), nullable=True),
+    sa.Column('erro', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('execucoes_tarefas', schema=None) as batch_op:
+        batch_op.create_index('ix_execucoes_tarefas_tarefa_inicio', ['tarefa', 'iniciada_em'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('execucoes_tarefas', schema=None) as batch_op:
+        batch_op.drop_index('ix_execucoes_tarefas_tarefa_inicio')
+
+    op.drop_table('execucoes_tarefas')
+    op.drop_table('travas_tarefas')
@@ -0,0 +1,75 @@
+"""Tags normalizadas de produtos (tags / produto_tags)
+
+Revision ID: d4e8b2f61a90
+Revises: c1f3a9d2e4b7
+Create Date: 2026-10-18 10:03:22.540917
+
+"""
+import re
+import unicodedata
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4e8b2f61a90'
+down_revision = 'c1f3a9d2e4b7'
+branch_labels = None
+depends_on = None
+
+
+def _slug(nome):
+    # Mesmo critério de app.services.tag_service.slug_tag (copiado para a migração não depender da app)
+    texto = unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode('ascii').lower()
+    return re.sub(r'[^a-z0-9]+', '-', texto).strip('-')[:60]
+
+
+def upgrade():
+    op.create_table('tags',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('nome', sa.String(length=50), nullable=False),
+    sa.Column('slug', sa.String(length=60), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('slug')
+    )
+    op.create_table('produto_tags',
+    sa.Column('produto_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['produto_id'], ['produtos.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('produto_id', 'tag_id')
+    )
+    op.create_index('ix_produto_tags_tag_id', 'produto_tags', ['tag_id', 'produto_id'], unique=False)
+
+    # Migração de dados: quebra o texto livre de Produto.tags
+    conn = op.get_bind()
+    tags_tbl = sa.table('tags', sa.column('id', sa.Integer), sa.column('nome', sa.String), sa.column('slug', sa.String))
+    ligacoes_tbl = sa.table('produto_tags', sa.column('produto_id', sa.Integer), sa.column('tag_id', sa.Integer))
+    produtos = conn.execute(sa.text("SELECT id, tags FROM produtos WHERE tags IS NOT NULL AND tags <> ''")).fetchall()
+
+    nomes = {}
+    por_produto = {}
+    for produto_id, texto in produtos:
+        slugs = []
+        for parte in re.split(r'[,;]', texto):
+            nome = parte.strip()[:50]
+            slug = _slug(nome)
+            if slug and slug not in slugs:
+                slugs.append(slug)
+                nomes.setdefault(slug, nome)
+        por_produto[produto_id] = slugs
+    if not nomes:
+        return
+
+    op.bulk_insert(tags_tbl, [{'nome': nome, 'slug': slug} for slug, nome in nomes.items()])
+    ids = dict((slug, tag_id) for tag_id, slug in conn.execute(sa.text('SELECT id, slug FROM tags')))
+    op.bulk_insert(ligacoes_tbl, [
+        {'produto_id': produto_id, 'tag_id': ids[slug]}
+        for produto_id, slugs in por_produto.items() for slug in slugs
+    ])
+
+
+def downgrade():
+    op.drop_index('ix_produto_tags_tag_id', table_name='produto_tags')
+    op.drop_table('produto_tags')
+    op.drop_table('tags')
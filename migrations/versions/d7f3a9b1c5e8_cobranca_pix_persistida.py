@@ -0,0 +1,28 @@
+"""Código e QR Code da cobrança PIX pendente no pedido
+
+Revision ID: d7f3a9b1c5e8
+Revises: c8d1e4a7b302
+Create Date: 2026-10-18 15:02:44.381920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7f3a9b1c5e8'
+down_revision = 'c8d1e4a7b302'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('pedidos', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('pix_codigo', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('pix_qr_code', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('pedidos', schema=None) as batch_op:
+        batch_op.drop_column('pix_qr_code')
+        batch_op.drop_column('pix_codigo')
@@ -0,0 +1,26 @@
+"""Data da última consulta do pagamento no gateway (conciliação)
+
+Revision ID: e4b8c2d6f1a7
+Revises: d7f3a9b1c5e8
+Create Date: 2026-10-18 16:11:05.227613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8c2d6f1a7'
+down_revision = 'd7f3a9b1c5e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('pedidos', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('pagamento_consultado_em', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('pedidos', schema=None) as batch_op:
+        batch_op.drop_column('pagamento_consultado_em')
@@ -0,0 +1,52 @@
+"""Agregados de avaliações em produtos
+
+Revision ID: e7a1c5d39b24
+Revises: d4e8b2f61a90
+Create Date: 2026-10-18 10:41:05.227613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a1c5d39b24'
+down_revision = 'd4e8b2f61a90'
+branch_labels = None
+depends_on = None
+
+COLUNAS_INT = ['total_reviews', 'soma_notas', 'notas_1', 'notas_2', 'notas_3', 'notas_4', 'notas_5']
+
+
+def upgrade():
+    with op.batch_alter_table('produtos', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('media_nota', sa.Float(), nullable=False, server_default='0'))
+        for coluna in COLUNAS_INT:
+            batch_op.add_column(sa.Column(coluna, sa.Integer(), nullable=False, server_default='0'))
+
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.create_index('ix_reviews_produto_criado', ['produto_id', 'criado_em', 'id'], unique=False)
+
+    # Carga inicial dos agregados a partir das avaliações existentes
+    op.execute(
+        "UPDATE produtos SET "
+        "total_reviews = (SELECT COUNT(*) FROM reviews r WHERE r.produto_id = produtos.id), "
+        "soma_notas = (SELECT COALESCE(SUM(r.nota), 0) FROM reviews r WHERE r.produto_id = produtos.id), "
+        + ', '.join(
+            f"notas_{n} = (SELECT COUNT(*) FROM reviews r WHERE r.produto_id = produtos.id AND r.nota = {n})"
+            for n in range(1, 6)
+        )
+    )
+    op.execute(
+        "UPDATE produtos SET media_nota = CAST(soma_notas AS FLOAT) / total_reviews WHERE total_reviews > 0"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.drop_index('ix_reviews_produto_criado')
+
+    with op.batch_alter_table('produtos', schema=None) as batch_op:
+        for coluna in reversed(COLUNAS_INT):
+            batch_op.drop_column(coluna)
+        batch_op.drop_column('media_nota')
@@ -0,0 +1,35 @@
+"""Coluna atualizado_em em produtos e produtores (GET condicional)
+
+Revision ID: f2b6d8e04c13
+Revises: e7a1c5d39b24
+Create Date: 2026-10-18 11:20:37.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b6d8e04c13'
+down_revision = 'e7a1c5d39b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('produtos', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('atualizado_em', sa.DateTime(), nullable=True))
+
+    with op.batch_alter_table('produtores', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('atualizado_em', sa.DateTime(), nullable=True))
+
+    op.execute('UPDATE produtos SET atualizado_em = CURRENT_TIMESTAMP')
+    op.execute('UPDATE produtores SET atualizado_em = CURRENT_TIMESTAMP')
+
+
+def downgrade():
+    with op.batch_alter_table('produtores', schema=None) as batch_op:
+        batch_op.drop_column('atualizado_em')
+
+    with op.batch_alter_table('produtos', schema=None) as batch_op:
+        batch_op.drop_column('atualizado_em')
@@ -0,0 +1,47 @@
+"""Caixa de entrada de webhooks (processamento assíncrono)
+
+Revision ID: f9a3d5e7b2c4
+Revises: e4b8c2d6f1a7
+Create Date: 2026-10-18 17:24:51.640381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f9a3d5e7b2c4'
+down_revision = 'e4b8c2d6f1a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhooks_recebidos',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('origem', sa.String(length=30), nullable=False),
+    sa.Column('tipo', sa.String(length=50), nullable=True),
+    sa.Column('acao', sa.String(length=50), nullable=True),
+    sa.Column('recurso_id', sa.String(length=100), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('tentativas', sa.Integer(), nullable=False),
+    sa.Column('ultimo_erro', sa.Text(), nullable=True),
+    sa.Column('recebido_em', sa.DateTime(), nullable=False),
+    sa.Column('disponivel_em', sa.DateTime(), nullable=False),
+    sa.Column('travado_em', sa.DateTime(), nullable=True),
+    sa.Column('trava', sa.String(length=32), nullable=True),
+    sa.Column('processado_em', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('webhooks_recebidos', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_webhooks_recebidos_recurso_id'), ['recurso_id'], unique=False)
+        batch_op.create_index('ix_webhooks_recebidos_fila', ['status', 'disponivel_em'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('webhooks_recebidos', schema=None) as batch_op:
+        batch_op.drop_index('ix_webhooks_recebidos_fila')
+        batch_op.drop_index(batch_op.f('ix_webhooks_recebidos_recurso_id'))
+
+    op.drop_table('webhooks_recebidos')
@@ -1,6 +1,7 @@
 from app import create_app
 from app.extensions import db
 from app.models.core import Categoria
+from app.services.lote_service import inserir_em_lote
 
 app = create_app()
 
@@ -21,9 +22,7 @@ if __name__ == "__main__":
                 {"nome": "Pães e Massas", "descricao": "Pães, bolos, massas", "icone": "bread", "valor_minimo": 12.0, "quantidade_minima": 1.0},
                 {"nome": "Outros", "descricao": "Produtos diversos", "icone": "box", "valor_minimo": 5.0, "quantidade_minima": 1.0},
             ]
-            for cat in categorias:
-                if not Categoria.query.filter_by(nome=cat['nome']).first():
-                    db.session.add(Categoria(**cat))
+            inserir_em_lote(Categoria, categorias, unicos=('nome',))
             db.session.commit()
             print('Categorias inseridas com sucesso!')
     elif len(sys.argv) > 1 and sys.argv[1] == 'seed-logistica':
@@ -34,9 +33,7 @@ if __name__ == "__main__":
                 {"nome": "Sede CoopVale", "endereco": "Rua Central, 100", "cidade": "Cidade A", "cep": "84000-000", "dias_funcionamento": "Seg-Sex", "horario_abertura": "08:00", "horario_fechamento": "18:00", "ativo": True},
                 {"nome": "Feira Livre", "endereco": "Praça das Flores", "cidade": "Cidade B", "cep": "84010-000", "dias_funcionamento": "Sábado", "horario_abertura": "07:00", "horario_fechamento": "12:00", "ativo": True},
             ]
-            for p in pontos:
-                if not PontoRetirada.query.filter_by(nome=p['nome']).first():
-                    db.session.add(PontoRetirada(**p))
+            inserir_em_lote(PontoRetirada, pontos, unicos=('nome',))
             taxas = [
                 # Regiões Centrais
                 {"regiao": "Centro", "valor": 8.0, "prazo_dias": 1, "ativo": True},
@@ -77,9 +74,7 @@ if __name__ == "__main__":
                 {"regiao": "Conde", "valor": 35.0, "prazo_dias": 4, "ativo": True},
                 {"regiao": "Lucena", "valor": 40.0, "prazo_dias": 4, "ativo": True},
             ]
-            for t in taxas:
-                if not TaxaEntrega.query.filter_by(regiao=t['regiao']).first():
-                    db.session.add(TaxaEntrega(**t))
+            inserir_em_lote(TaxaEntrega, taxas, unicos=('regiao',))
             db.session.commit()
             print('Logística semeada com sucesso! (pontos e taxas)')
     else:
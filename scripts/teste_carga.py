@@ -0,0 +1,354 @@
+"""
+Teste de carga do fluxo de pedidos
+
+Semeia N produtos e M clientes e dispara, em paralelo, o fluxo completo de compra
+(login -> adicionar ao carrinho -> finalizar pedido PIX -> página de pagamento ->
+pagamento simulado) contra um servidor local. Ao final mostra vazão, latências
+p50/p95/p99 por etapa e confere o estoque (vendas além do estoque, estoque negativo
+e divergência entre estoque inicial, vendido e atual).
+
+Uso:
+    # Servidor embutido com banco SQLite temporário (autocontido)
+    python scripts/teste_carga.py --produtos 20 --clientes 50 --concorrencia 16
+
+    # Contra um servidor já em execução; os dados são semeados no banco da
+    # configuração (DATABASE_URL), que precisa ser o mesmo do servidor
+    python scripts/teste_carga.py --url http://127.0.0.1:8000
+"""
+import os
+import sys
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+import argparse
+import json
+import logging
+import random
+import re
+import secrets
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy import func
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+
+from app import create_app
+from app.extensions import db
+from app.models.core import (
+    Usuario, Cliente, Produtor, Categoria, Produto, Pedido, ItemPedido, PontoRetirada
+)
+from app.services.lote_service import inserir_em_lote
+from app.services.preco_service import atualizar_precos_efetivos
+from config import Config
+
+SENHA = 'carga123'
+ETAPAS = ('login', 'carrinho', 'finalizar_form', 'finalizar', 'pagamento_pix', 'simular_pagamento', 'fluxo')
+
+_RE_CSRF = re.compile(r'<meta name="csrf-token" content="([^"]+)"')
+_RE_IDEMPOTENCIA = re.compile(r'name="idempotencia_token" value="([^"]+)"')
+_RE_PEDIDO_PIX = re.compile(r'/pagamento/pix/(\d+)')
+
+
+# ---------------------- Massa de dados ----------------------
+
+def semear(app, produtos, clientes, estoque, prefixo):
+    """
+    Cria produtor, categoria, ponto de retirada, `produtos` produtos com `estoque`
+    unidades cada e `clientes` clientes (todos com a senha SENHA), em lotes
+
+    Returns:
+        dict: {'produtos': {id: estoque_inicial}, 'clientes': [emails], 'ponto_retirada_id': id}
+    """
+    with app.app_context():
+        senha_hash = generate_password_hash(SENHA)
+        usuarios = inserir_em_lote(Usuario, [
+            {'email': f'{prefixo}-{i}@carga.local', 'senha_hash': senha_hash, 'tipo_usuario': 'cliente', 'ativo': True}
+            for i in range(clientes)
+        ] + [
+            {'email': f'{prefixo}-produtor@carga.local', 'senha_hash': senha_hash, 'tipo_usuario': 'produtor', 'ativo': True}
+        ], retornar_chaves=True)
+        produtor_usuario = usuarios.pop()
+        inserir_em_lote(Cliente, [
+            {'usuario_id': u['id'], 'nome': f'Cliente Carga {i}', 'cpf': f'{prefixo}{i:06d}'}
+            for i, u in enumerate(usuarios)
+        ])
+        produtor = inserir_em_lote(Produtor, [
+            {'usuario_id': produtor_usuario['id'], 'nome': f'Produtor Carga {prefixo}', 'cpf': f'{prefixo}P'}
+        ], retornar_chaves=True)[0]
+        inserir_em_lote(Categoria, [{'nome': 'Carga', 'descricao': 'Teste de carga'}], unicos=('nome',))
+        categoria_id = db.session.query(Categoria.id).filter_by(nome='Carga').scalar()
+        ponto = inserir_em_lote(PontoRetirada, [
+            {'nome': f'Ponto Carga {prefixo}', 'endereco': 'Teste de carga', 'ativo': True}
+        ], retornar_chaves=True)[0]
+        registros = inserir_em_lote(Produto, [
+            {'nome': f'Carga {prefixo} {i}', 'descricao': 'Produto do teste de carga', 'preco': 10.0,
+             'unidade': 'un', 'estoque': estoque, 'categoria_id': categoria_id, 'produtor_id': produtor['id']}
+            for i in range(produtos)
+        ], retornar_chaves=True)
+        atualizar_precos_efetivos()
+        db.session.commit()
+        return {
+            'produtos': {r['id']: float(estoque) for r in registros},
+            'clientes': [u['email'] for u in usuarios],
+            'ponto_retirada_id': ponto['id'],
+        }
+
+
+# ---------------------- Fluxo de compra ----------------------
+
+class Medicoes:
+    """Latências por etapa e contagem de resultados, compartilhadas entre as threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencias = defaultdict(list)
+        self.resultados = Counter()
+        self.erros = Counter()
+
+    def registrar(self, etapa, segundos):
+        with self._lock:
+            self.latencias[etapa].append(segundos)
+
+    def contar(self, resultado, detalhe=None):
+        with self._lock:
+            self.resultados[resultado] += 1
+            if detalhe:
+                self.erros[detalhe] += 1
+
+
+def _csrf(resposta):
+    encontrado = _RE_CSRF.search(resposta.text)
+    return encontrado.group(1) if encontrado else None
+
+
+class ErroFluxo(Exception):
+    pass
+
+
+def _medir(medicoes, etapa, chamada, *args, esperado=(200, 302), **kwargs):
+    inicio = time.perf_counter()
+    resposta = chamada(*args, allow_redirects=False, timeout=60, **kwargs)
+    medicoes.registrar(etapa, time.perf_counter() - inicio)
+    if resposta.status_code not in esperado:
+        raise ErroFluxo(f'{etapa}: HTTP {resposta.status_code}')
+    return resposta
+
+
+def executar_fluxo(base_url, email, dados, medicoes, itens_por_pedido, quantidade_max, semente):
+    """Uma compra completa de um cliente; o resultado vai para `medicoes`"""
+    rng = random.Random(semente)
+    http = requests.Session()
+    inicio = time.perf_counter()
+    try:
+        token = _csrf(http.get(f'{base_url}/auth/login', timeout=60))
+        cabecalhos = {'X-CSRFToken': token} if token else {}
+        resposta = _medir(medicoes, 'login', http.post, f'{base_url}/auth/login',
+                          data={'email': email, 'senha': SENHA, 'csrf_token': token or ''})
+        if 'login' in resposta.headers.get('Location', ''):
+            raise ErroFluxo('login: credenciais recusadas')
+
+        produtos = list(dados['produtos'])
+        for produto_id in rng.sample(produtos, min(itens_por_pedido, len(produtos))):
+            _medir(medicoes, 'carrinho', http.post, f'{base_url}/pedidos/carrinho/adicionar/{produto_id}',
+                   data={'quantidade': rng.randint(1, quantidade_max)}, headers=cabecalhos)
+
+        pagina = _medir(medicoes, 'finalizar_form', http.get, f'{base_url}/pedidos/finalizar', esperado=(200,))
+        idempotencia = _RE_IDEMPOTENCIA.search(pagina.text)
+        resposta = _medir(medicoes, 'finalizar', http.post, f'{base_url}/pedidos/finalizar', data={
+            'forma_pagamento': 'pix', 'tipo_recebimento': 'retirada',
+            'ponto_retirada_id': str(dados['ponto_retirada_id']),
+            'idempotencia_token': idempotencia.group(1) if idempotencia else '',
+        }, headers=cabecalhos, esperado=(302,))
+        destino = resposta.headers.get('Location', '')
+        pedido = _RE_PEDIDO_PIX.search(destino)
+        if not pedido:
+            if not destino.endswith('/pedidos/carrinho'):
+                raise ErroFluxo(f'finalizar: redirecionado para {destino}')
+            # Checkout recusado por estoque insuficiente: resultado esperado sob disputa
+            medicoes.registrar('fluxo', time.perf_counter() - inicio)
+            medicoes.contar('sem_estoque')
+            return
+
+        pedido_id = pedido.group(1)
+        _medir(medicoes, 'pagamento_pix', http.get, f'{base_url}/pedidos/pagamento/pix/{pedido_id}', esperado=(200,))
+        simulado = _medir(medicoes, 'simular_pagamento', http.post,
+                          f'{base_url}/webhooks/simular-pagamento/{pedido_id}',
+                          headers=cabecalhos, esperado=(200, 403))
+        medicoes.registrar('fluxo', time.perf_counter() - inicio)
+        medicoes.contar('pago' if simulado.status_code == 200 else 'aguardando_pagamento')
+    except (ErroFluxo, requests.RequestException) as e:
+        medicoes.contar('erro', str(e).split('\n')[0][:120])
+    finally:
+        http.close()
+
+
+# ---------------------- Conferência do estoque ----------------------
+
+def verificar_estoque(app, estoque_inicial):
+    """
+    Compara, para cada produto semeado, estoque inicial, quantidade vendida em pedidos
+    não cancelados e estoque atual
+
+    Returns:
+        list: Violações encontradas (texto)
+    """
+    with app.app_context():
+        ids = list(estoque_inicial)
+        atual = dict(db.session.query(Produto.id, Produto.estoque).filter(Produto.id.in_(ids)).all())
+        vendido = dict(db.session.query(ItemPedido.produto_id, func.sum(ItemPedido.quantidade)).join(
+            Pedido, Pedido.id == ItemPedido.pedido_id
+        ).filter(
+            ItemPedido.produto_id.in_(ids), Pedido.status != 'Cancelado'
+        ).group_by(ItemPedido.produto_id).all())
+    violacoes = []
+    for produto_id, inicial in sorted(estoque_inicial.items()):
+        estoque = atual.get(produto_id, 0) or 0
+        total_vendido = vendido.get(produto_id, 0) or 0
+        if estoque < 0:
+            violacoes.append(f'Produto #{produto_id}: estoque negativo ({estoque:g})')
+        if total_vendido > inicial:
+            violacoes.append(f'Produto #{produto_id}: vendido {total_vendido:g} com estoque inicial {inicial:g}')
+        if abs(inicial - total_vendido - estoque) > 1e-6:
+            violacoes.append(
+                f'Produto #{produto_id}: inicial {inicial:g} - vendido {total_vendido:g} != atual {estoque:g}'
+            )
+    return violacoes
+
+
+# ---------------------- Execução e relatório ----------------------
+
+def percentil(valores, p):
+    """Percentil por posição mais próxima (valores já ordenados)"""
+    if not valores:
+        return 0.0
+    posicao = max(0, min(len(valores) - 1, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[posicao]
+
+
+def executar_carga(app, base_url, produtos=20, clientes=50, estoque=10, concorrencia=16,
+                   itens_por_pedido=3, quantidade_max=3, semente=None):
+    """
+    Semeia os dados, dispara um fluxo de compra por cliente e confere o estoque
+
+    Returns:
+        dict: Relatório (vazão, latências por etapa, resultados, violações)
+    """
+    semente = semente if semente is not None else random.randrange(1 << 30)
+    dados = semear(app, produtos, clientes, estoque, prefixo=secrets.token_hex(3))
+    medicoes = Medicoes()
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        for i, email in enumerate(dados['clientes']):
+            executor.submit(executar_fluxo, base_url, email, dados, medicoes,
+                            itens_por_pedido, quantidade_max, semente + i)
+    duracao = time.perf_counter() - inicio
+
+    concluidos = medicoes.resultados['pago'] + medicoes.resultados['aguardando_pagamento']
+    latencias = {}
+    for etapa in ETAPAS:
+        valores = sorted(medicoes.latencias.get(etapa, []))
+        if valores:
+            latencias[etapa] = {
+                'n': len(valores),
+                'p50_ms': percentil(valores, 50) * 1000,
+                'p95_ms': percentil(valores, 95) * 1000,
+                'p99_ms': percentil(valores, 99) * 1000,
+                'max_ms': valores[-1] * 1000,
+            }
+    return {
+        'duracao_s': duracao,
+        'fluxos': clientes,
+        'checkouts_por_s': concluidos / duracao if duracao else 0.0,
+        'fluxos_por_s': clientes / duracao if duracao else 0.0,
+        'resultados': dict(medicoes.resultados),
+        'erros': dict(medicoes.erros),
+        'latencias': latencias,
+        'violacoes': verificar_estoque(app, dados['produtos']),
+        'semente': semente,
+    }
+
+
+def imprimir_relatorio(relatorio):
+    print(f"\nFluxos: {relatorio['fluxos']} em {relatorio['duracao_s']:.2f}s "
+          f"({relatorio['fluxos_por_s']:.1f} fluxos/s, {relatorio['checkouts_por_s']:.1f} checkouts/s)")
+    print('Resultados: ' + ', '.join(f'{k}={v}' for k, v in sorted(relatorio['resultados'].items())))
+    for erro, quantidade in sorted(relatorio['erros'].items(), key=lambda item: -item[1]):
+        print(f'  erro x{quantidade}: {erro}')
+    print(f"\n{'etapa':<20}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for etapa, dados in relatorio['latencias'].items():
+        print(f"{etapa:<20}{dados['n']:>6}{dados['p50_ms']:>10.1f}{dados['p95_ms']:>10.1f}"
+              f"{dados['p99_ms']:>10.1f}{dados['max_ms']:>10.1f}")
+    if relatorio['violacoes']:
+        print(f"\n{len(relatorio['violacoes'])} violação(ões) de estoque:")
+        for violacao in relatorio['violacoes']:
+            print(f'  {violacao}')
+    else:
+        print('\nEstoque consistente: nenhuma venda além do estoque.')
+    print(f"(semente {relatorio['semente']})")
+
+
+def servidor_embutido(app):
+    """Sobe a aplicação em uma porta livre, com uma thread por requisição"""
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    servidor = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f'http://127.0.0.1:{servidor.server_port}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Teste de carga do fluxo de pedidos (carrinho -> checkout -> pagamento)')
+    parser.add_argument('--url', help='Servidor já em execução (padrão: servidor embutido com banco temporário)')
+    parser.add_argument('--banco', help='URI do banco do servidor embutido (padrão: SQLite temporário)')
+    parser.add_argument('--produtos', type=int, default=20)
+    parser.add_argument('--clientes', type=int, default=50, help='Um fluxo de compra por cliente')
+    parser.add_argument('--estoque', type=float, default=10, help='Estoque inicial de cada produto')
+    parser.add_argument('--concorrencia', type=int, default=16, help='Fluxos simultâneos (threads)')
+    parser.add_argument('--itens', type=int, default=3, help='Produtos distintos por pedido')
+    parser.add_argument('--quantidade-max', type=int, default=3, help='Quantidade máxima por item')
+    parser.add_argument('--semente', type=int)
+    parser.add_argument('--json', action='store_true', help='Relatório em JSON')
+    args = parser.parse_args(argv)
+
+    servidor = None
+    if args.url:
+        app = create_app()
+        base_url = args.url.rstrip('/')
+    else:
+        class ConfigCarga(Config):
+            SQLALCHEMY_DATABASE_URI = args.banco or 'sqlite:///' + os.path.join(
+                tempfile.mkdtemp(prefix='coopvale-carga-'), 'carga.db'
+            )
+            # Escritas concorrentes no SQLite esperam o lock em vez de falhar
+            SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}} if not args.banco else {}
+
+        app = create_app(ConfigCarga)
+        # O pagamento simulado (/webhooks/simular-pagamento) só responde em modo debug
+        app.debug = True
+        servidor, base_url = servidor_embutido(app)
+
+    try:
+        relatorio = executar_carga(
+            app, base_url, produtos=args.produtos, clientes=args.clientes, estoque=args.estoque,
+            concorrencia=args.concorrencia, itens_por_pedido=args.itens,
+            quantidade_max=args.quantidade_max, semente=args.semente,
+        )
+    finally:
+        if servidor:
+            servidor.shutdown()
+
+    if args.json:
+        print(json.dumps(relatorio, indent=2, ensure_ascii=False))
+    else:
+        imprimir_relatorio(relatorio)
+    return 1 if relatorio['violacoes'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
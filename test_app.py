@@ -1,12 +1,16 @@
 import pytest
 from app import create_app, db
+from config import Config
+
+class TestConfig(Config):
+    # Definida antes do create_app: o engine é criado no init_app
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    WTF_CSRF_ENABLED = False  # Disable CSRF for simplified form testing
 
 @pytest.fixture
 def app():
-    app = create_app()
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-    app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for simplified form testing
+    app = create_app(TestConfig)
     with app.app_context():
         db.create_all()
     yield app
@@ -1,17 +1,20 @@
 import pytest
 from app import create_app, db
 from app.models.core import Usuario, Cliente, Produtor, Categoria, Produto
+from config import Config
+
+
+class TestConfig(Config):
+    # A URI precisa estar na config antes do create_app: o engine é criado no init_app
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    WTF_CSRF_ENABLED = False
+    SECRET_KEY = 'test-secret-key'
 
 @pytest.fixture(scope='function')
 def app():
     """Criar aplicação Flask para testes."""
-    app = create_app()
-    app.config.update({
-        'TESTING': True,
-        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
-        'WTF_CSRF_ENABLED': False,
-        'SECRET_KEY': 'test-secret-key'
-    })
+    app = create_app(TestConfig)
     
     with app.app_context():
         db.create_all()
@@ -0,0 +1,331 @@
+"""Testes do catálogo de produtos (busca, filtros)."""
+import pytest
+from app.extensions import db
+
+
+def seed_catalogo(app):
+    from app.models.core import Usuario, Produtor, Produto, Categoria
+    from app.services.busca_service import BuscaService
+    from app.services.tag_service import sincronizar_tags
+    with app.app_context():
+        # 'Verduras' já vem do seed do conftest
+        verduras = Categoria.query.filter_by(nome='Verduras').one()
+        frutas = Categoria(nome='Frutas', descricao='Frutas', icone='apple')
+        db.session.add(frutas)
+        usuario = Usuario(email='sitio@example.com', tipo_usuario='produtor')
+        usuario.set_senha('teste123')
+        usuario.produtor_perfil = Produtor(nome='Sítio Boa Vista', cpf='00000000001')
+        db.session.add(usuario)
+        db.session.flush()
+        produtor_id = usuario.produtor_perfil.id
+        produtos = [
+            Produto(nome='Alface Crespa', descricao='Folhas frescas', preco=4.0, unidade='un',
+                    categoria_id=verduras.id, estoque=10, tags='orgânico, folhosa', produtor_id=produtor_id),
+            Produto(nome='Tomate Cereja', descricao='Doce e suculento', preco=12.0, unidade='kg',
+                    categoria_id=frutas.id, estoque=5, tags='convencional', origem='Serra', produtor_id=produtor_id),
+            Produto(nome='Banana Prata', descricao='Combina com salada de alface', preco=6.5, unidade='kg',
+                    categoria_id=frutas.id, estoque=20, tags='orgânico', produtor_id=produtor_id),
+        ]
+        db.session.add_all(produtos)
+        for produto in produtos:
+            sincronizar_tags(produto)
+        db.session.flush()
+        busca_service = BuscaService()
+        for produto in produtos:
+            busca_service.indexar_produto(produto)
+        db.session.commit()
+        return [p.id for p in produtos]
+
+
+def test_busca_full_text_ranqueada(app):
+    from app.models.core import Produto
+    from app.services.busca_service import BuscaService
+    seed_catalogo(app)
+    with app.app_context():
+        busca_service = BuscaService()
+        assert busca_service.disponivel
+        nomes = [p.nome for p in busca_service.aplicar_busca(Produto.query, 'alface').all()]
+        # Nome pesa mais que descrição no ranking
+        assert nomes == ['Alface Crespa', 'Banana Prata']
+        # Busca ignora acentos e aceita prefixos
+        nomes = {p.nome for p in busca_service.aplicar_busca(Produto.query, 'organ').all()}
+        assert nomes == {'Alface Crespa', 'Banana Prata'}
+        # Nome do produtor também é indexado
+        assert busca_service.aplicar_busca(Produto.query, 'sitio boa').count() == 3
+
+
+def test_busca_catalogo_por_parametro(client, app):
+    seed_catalogo(app)
+    resp = client.get('/produtos/?busca=tomate')
+    assert resp.status_code == 200
+    assert 'Tomate Cereja'.encode() in resp.data
+    assert b'Alface Crespa' not in resp.data
+
+
+def test_paginacao_por_cursor(app):
+    from app.services.catalogo_service import FiltrosCatalogo, consultar_pagina
+    seed_catalogo(app)
+    with app.app_context():
+        filtros = FiltrosCatalogo(ordem='preco')
+        pagina1 = consultar_pagina(filtros, por_pagina=2)
+        assert [p.nome for p in pagina1.itens] == ['Alface Crespa', 'Banana Prata']
+        assert pagina1.anterior is None and pagina1.proximo
+
+        pagina2 = consultar_pagina(filtros, cursor=pagina1.proximo, por_pagina=2)
+        assert [p.nome for p in pagina2.itens] == ['Tomate Cereja']
+        assert pagina2.proximo is None and pagina2.anterior
+
+        voltar = consultar_pagina(filtros, cursor=pagina2.anterior, por_pagina=2)
+        assert [p.nome for p in voltar.itens] == ['Alface Crespa', 'Banana Prata']
+        assert voltar.anterior is None and voltar.proximo
+
+
+def test_paginacao_respeita_filtros(app):
+    from app.services.catalogo_service import FiltrosCatalogo, consultar_pagina
+    seed_catalogo(app)
+    with app.app_context():
+        filtros = FiltrosCatalogo(so_organico='1', preco_max=10, ordem='preco_desc')
+        pagina = consultar_pagina(filtros, por_pagina=1)
+        assert [p.nome for p in pagina.itens] == ['Banana Prata']
+        pagina = consultar_pagina(filtros, cursor=pagina.proximo, por_pagina=1)
+        assert [p.nome for p in pagina.itens] == ['Alface Crespa']
+        assert pagina.proximo is None
+
+
+def test_catalogo_cursor_invalido(client, app):
+    seed_catalogo(app)
+    resp = client.get('/produtos/catalogo?cursor=nao-e-um-cursor&por_pagina=1')
+    assert resp.status_code == 200
+    assert b'Alface Crespa' in resp.data
+    assert b'Banana Prata' not in resp.data
+    # Cursor adulterado com valor de tipo errado para a ordenação: primeira página
+    from app.services.catalogo_service import codificar_cursor
+    for ordem, valor in (('nome', None), ('nome', 3), ('preco', {}), ('preco', []), ('preco', 'a')):
+        cursor = codificar_cursor(valor, 1, 'prox')
+        resp = client.get(f'/produtos/catalogo?ordem={ordem}&cursor={cursor}&por_pagina=1')
+        assert resp.status_code == 200
+        assert resp.data == client.get(f'/produtos/catalogo?ordem={ordem}&por_pagina=1').data
+    # Tamanho de página negativo vira 1, em vez de uma página vazia
+    resp = client.get('/produtos/catalogo?por_pagina=-1')
+    assert resp.status_code == 200
+    assert b'Alface Crespa' in resp.data
+
+
+def test_facetas_catalogo(app):
+    from app.models.core import Categoria, Produto
+    from app.services.catalogo_service import FiltrosCatalogo, calcular_facetas
+    seed_catalogo(app)
+    with app.app_context():
+        frutas = Categoria.query.filter_by(nome='Frutas').first()
+        verduras = Categoria.query.filter_by(nome='Verduras').first()
+
+        facetas = calcular_facetas(FiltrosCatalogo())
+        assert facetas['total'] == 3
+        assert facetas['categorias'] == {verduras.id: 1, frutas.id: 2}
+        assert facetas['organicos'] == 2 and facetas['nao_organicos'] == 1
+        assert [(f['min'], f['total']) for f in facetas['faixas_preco']] == [(0, 1), (5, 1), (10, 1)]
+        assert facetas['produtores'][0]['total'] == 3
+
+        # A faceta de categoria continua mostrando as alternativas da seleção atual
+        facetas = calcular_facetas(FiltrosCatalogo(categoria_id=frutas.id))
+        assert facetas['total'] == 2
+        assert facetas['categorias'] == {verduras.id: 1, frutas.id: 2}
+        assert facetas['organicos'] == 1
+
+        # Gravação em produtos descarta as contagens em cache no commit
+        alface = Produto.query.filter_by(nome='Alface Crespa').first()
+        alface.categoria_id = frutas.id
+        db.session.commit()
+        assert calcular_facetas(FiltrosCatalogo())['categorias'] == {frutas.id: 3}
+
+
+def test_tags_normalizadas(app):
+    from app.models.core import Produto, Tag
+    from app.services.catalogo_service import FiltrosCatalogo, consultar_pagina
+    from app.services.tag_service import dividir_tags, listar_tags
+    assert dividir_tags(' Orgânico, orgânico ;Pão caseiro,, ') == [('organico', 'Orgânico'), ('pao-caseiro', 'Pão caseiro')]
+    seed_catalogo(app)
+    with app.app_context():
+        assert Tag.query.count() == 3
+        assert listar_tags()[0] == ('orgânico', 'organico', 2)
+        # Filtro por tag é exato (sem casar substrings) e ignora acentos
+        pagina = consultar_pagina(FiltrosCatalogo(tag='ORGANICO'))
+        assert {p.nome for p in pagina.itens} == {'Alface Crespa', 'Banana Prata'}
+        assert consultar_pagina(FiltrosCatalogo(tag='organ')).itens == []
+        alface = Produto.query.filter_by(nome='Alface Crespa').first()
+        assert sorted(t.slug for t in alface.tags_normalizadas) == ['folhosa', 'organico']
+
+
+def _criar_clientes(n):
+    from app.models.core import Usuario, Cliente
+    clientes = []
+    for i in range(n):
+        usuario = Usuario(email=f'cliente{i}@example.com', tipo_usuario='cliente')
+        usuario.set_senha('cliente123')
+        usuario.cliente_perfil = Cliente(nome=f'Cliente {i}', cpf=f'1111111110{i}')
+        db.session.add(usuario)
+        clientes.append(usuario.cliente_perfil)
+    db.session.flush()
+    return clientes
+
+
+def test_agregados_de_avaliacao_incrementais(app):
+    from app.models.core import Produto
+    from app.services.avaliacao_service import registrar_avaliacao, recalcular_agregados, pagina_reviews
+    ids = seed_catalogo(app)
+    with app.app_context():
+        c1, c2, c3 = _criar_clientes(3)
+        assert registrar_avaliacao(ids[0], c1.id, 5, 'Ótimo')
+        assert registrar_avaliacao(ids[0], c2.id, 3, '')
+        assert registrar_avaliacao(ids[0], c3.id, 4, '')
+        # Atualização move a nota de faixa sem alterar o total
+        assert not registrar_avaliacao(ids[0], c2.id, 1, 'Mudei de ideia')
+        db.session.commit()
+
+        produto = db.session.get(Produto, ids[0])
+        assert produto.total_reviews == 3
+        assert produto.media_nota == pytest.approx(10 / 3)
+        assert produto.histograma_notas == {5: 1, 4: 1, 3: 0, 2: 0, 1: 1}
+
+        # Reconstrução a partir de reviews chega ao mesmo resultado
+        recalcular_agregados()
+        db.session.commit()
+        db.session.refresh(produto)
+        assert produto.total_reviews == 3 and produto.soma_notas == 10
+
+        pagina = pagina_reviews(ids[0], por_pagina=2)
+        assert len(pagina.itens) == 2 and pagina.proximo
+        resto = pagina_reviews(ids[0], cursor=pagina.proximo, por_pagina=2)
+        assert len(resto.itens) == 1 and resto.proximo is None
+        assert {r.id for r in pagina.itens}.isdisjoint(r.id for r in resto.itens)
+
+
+def test_detalhe_produto_get_condicional(app, client):
+    from app.models.core import Produto
+    ids = seed_catalogo(app)
+    url = f'/produtos/detalhe/{ids[0]}'
+    client.get(url)  # primeira visita cria a sessão
+    resposta = client.get(url)
+    assert resposta.status_code == 200
+    etag = resposta.headers['ETag']
+    assert resposta.headers['Last-Modified']
+    assert 'private' in resposta.headers['Cache-Control']
+
+    revalidada = client.get(url, headers={'If-None-Match': etag})
+    assert revalidada.status_code == 304
+    assert revalidada.data == b''
+
+    with app.app_context():
+        db.session.get(Produto, ids[0]).preco = 4.5
+        db.session.commit()
+    alterada = client.get(url, headers={'If-None-Match': etag})
+    assert alterada.status_code == 200
+    assert alterada.headers['ETag'] != etag
+
+
+def test_preco_efetivo_materializado(app):
+    from datetime import datetime, timedelta
+    from app.models.core import Produto
+    from app.services.catalogo_service import FiltrosCatalogo, consultar_pagina
+    from app.services.preco_service import atualizar_precos_efetivos, proxima_virada
+    ids = seed_catalogo(app)
+    agora = datetime(2026, 5, 10, 12, 0)
+    with app.app_context():
+        tomate = db.session.get(Produto, ids[1])
+        tomate.preco_promocional = 3.0
+        tomate.sazonal_inicio = agora - timedelta(days=1)
+        tomate.sazonal_fim = agora + timedelta(days=1)
+        db.session.flush()
+        atualizar_precos_efetivos(agora)
+        db.session.commit()
+        db.session.refresh(tomate)
+        assert tomate.preco_efetivo == 3.0 and tomate.promocao_ativa
+
+        # Filtro e ordenação por preço usam o valor materializado
+        pagina = consultar_pagina(FiltrosCatalogo(preco_max=5, ordem='preco'), por_pagina=10)
+        assert [p.nome for p in pagina.itens] == ['Tomate Cereja', 'Alface Crespa']
+        assert proxima_virada(agora) == agora + timedelta(days=1)
+
+        # Após o fim da janela o job devolve o preço normal, só para o produto afetado
+        assert atualizar_precos_efetivos(agora + timedelta(days=2)) == 1
+        db.session.commit()
+        db.session.refresh(tomate)
+        assert tomate.preco_efetivo == 12.0 and not tomate.promocao_ativa
+
+        # Carrinho lê o mesmo valor materializado que o catálogo exibe
+        from app.services.carrinho_service import LinhaCarrinho
+        assert LinhaCarrinho(tomate, 2).subtotal == 2 * tomate.preco_efetivo
+
+        # Regra em Python (eventos do ORM) e em SQL (atualização em massa) coincidem
+        from app.services.preco_service import calcular_preco_efetivo, expressao_preco_efetivo
+        casos = [(None, None, None), (0.0, None, None), (-1.0, None, None), (3.0, None, None),
+                 (3.0, agora, agora), (3.0, agora + timedelta(hours=1), None),
+                 (3.0, None, agora - timedelta(hours=1)), (3.0, None, agora + timedelta(hours=1))]
+        for promocional, inicio, fim in casos:
+            tomate.preco_promocional, tomate.sazonal_inicio, tomate.sazonal_fim = promocional, inicio, fim
+            db.session.flush()
+            em_sql = db.session.execute(
+                db.select(expressao_preco_efetivo(agora)).where(Produto.id == tomate.id)
+            ).scalar()
+            assert calcular_preco_efetivo(tomate, agora) == em_sql, (promocional, inicio, fim)
+        db.session.rollback()
+
+
+def test_sugestoes_de_busca(app, client):
+    from app.models.core import Produto, Produtor
+    from app.services.sugestao_service import indice_sugestoes
+    ids = seed_catalogo(app)
+
+    # O índice é carregado na primeira consulta, não na inicialização
+    assert not indice_sugestoes(app).construido_em
+    dados = client.get('/produtos/sugestoes?q=tom').get_json()
+    assert [s['texto'] for s in dados['sugestoes']] == ['Tomate Cereja']
+    assert dados['sugestoes'][0]['url'] == f'/produtos/detalhe/{ids[1]}'
+
+    # Sem acento, por palavra interna, tags e produtores
+    tipos = {s['tipo']: s['texto'] for s in client.get('/produtos/sugestoes?q=organ').get_json()['sugestoes']}
+    assert tipos == {'tag': 'orgânico'}
+    assert client.get('/produtos/sugestoes?q=cer').get_json()['sugestoes'][0]['texto'] == 'Tomate Cereja'
+    assert client.get('/produtos/sugestoes?q=sitio boa').get_json()['sugestoes'][0]['tipo'] == 'produtor'
+
+    # Gravações confirmadas atualizam o índice sem reconstruí-lo
+    with app.app_context():
+        db.session.get(Produto, ids[1]).nome = 'Tomate Italiano'
+        db.session.delete(db.session.get(Produto, ids[2]))
+        db.session.commit()
+    assert client.get('/produtos/sugestoes?q=tomate it').get_json()['sugestoes'][0]['texto'] == 'Tomate Italiano'
+    assert client.get('/produtos/sugestoes?q=banana').get_json()['sugestoes'] == []
+
+    # Índice vencido com recarga em andamento: responde com o atual, sem recarregar
+    indice = indice_sugestoes(app)
+    indice.construido_em -= app.config['SUGESTOES_TTL'] + 1
+    with indice.recarga:
+        construido_em = indice.construido_em
+        assert client.get('/produtos/sugestoes?q=tomate it').get_json()['sugestoes'][0]['texto'] == 'Tomate Italiano'
+        assert indice.construido_em == construido_em
+
+    # Commit durante a leitura da recarga não se perde quando a foto antiga é instalada
+    indice.iniciar_recarga()
+    foto = (db.session.query(Produto.id, Produto.nome, Produto.tags).all(),
+            db.session.query(Produtor.id, Produtor.nome).all())
+    db.session.get(Produto, ids[1]).nome = 'Tomate Grape'
+    db.session.commit()
+    indice.carregar(*foto)
+    assert [s[2] for s in indice.sugerir('tomate')] == ['Tomate Grape']
+
+    # Limite fora da faixa vira 1..20, em vez de fatiar a lista pelo fim
+    assert len(client.get('/produtos/sugestoes?q=a&limite=-5').get_json()['sugestoes']) == 1
+
+
+def test_insercao_em_lote_com_chaves_e_unicos(app):
+    from app.models.core import Categoria
+    from app.services.lote_service import inserir_em_lote
+    with app.app_context():
+        db.session.add(Categoria(nome='Frutas'))
+        db.session.commit()
+        registros = [{'nome': nome} for nome in ('Frutas', 'Legumes', 'Verduras', 'Raízes', 'Legumes')]
+        inseridos = inserir_em_lote(Categoria, registros, retornar_chaves=True, unicos=('nome',))
+        db.session.commit()
+        assert [r['nome'] for r in inseridos] == ['Legumes', 'Raízes']
+        assert all(db.session.get(Categoria, r['id']).nome == r['nome'] for r in inseridos)
+        assert Categoria.query.count() == 4
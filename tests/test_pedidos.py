@@ -0,0 +1,716 @@
+"""Testes do fluxo de pedidos (carrinho, checkout, detalhe)."""
+import pytest
+from sqlalchemy import event
+from app import create_app
+from app.extensions import db
+from tests.conftest import TestConfig
+
+
+def seed_loja(app, n_produtos=3):
+    """Cria um cliente, um produtor por produto e n produtos; retorna os ids dos produtos"""
+    from app.models.core import Usuario, Cliente, Produtor, Produto, Categoria
+    with app.app_context():
+        cat = Categoria(nome='Geral', descricao='Teste', icone='box')
+        db.session.add(cat)
+        usuario = Usuario(email='cliente@example.com', tipo_usuario='cliente')
+        usuario.set_senha('cliente123')
+        usuario.cliente_perfil = Cliente(nome='Cliente Teste', cpf='12345678900')
+        db.session.add(usuario)
+        ids = []
+        for i in range(n_produtos):
+            dono = Usuario(email=f'produtor{i}@example.com', tipo_usuario='produtor')
+            dono.set_senha('produtor123')
+            dono.produtor_perfil = Produtor(nome=f'Produtor {i}', cpf=f'000000000{i:02d}')
+            db.session.add(dono)
+            db.session.flush()
+            produto = Produto(nome=f'Produto {i}', descricao='Desc', preco=10.0 + i, unidade='kg',
+                              categoria_id=cat.id, estoque=100, produtor_id=dono.produtor_perfil.id)
+            db.session.add(produto)
+            db.session.flush()
+            ids.append(produto.id)
+        db.session.commit()
+        return ids
+
+
+def login(client, email='cliente@example.com', senha='cliente123'):
+    return client.post('/auth/login', data={'email': email, 'senha': senha})
+
+
+def criar_pedido(app, produto_ids, quantidade=1):
+    from app.models.core import Pedido, ItemPedido, Produto, Cliente
+    with app.app_context():
+        cliente = Cliente.query.first()
+        pedido = Pedido(cliente_id=cliente.id, forma_pagamento='dinheiro', tipo_recebimento='retirada', total=0)
+        db.session.add(pedido)
+        for produto_id in produto_ids:
+            produto = db.session.get(Produto, produto_id)
+            db.session.add(ItemPedido(pedido=pedido, produto=produto, quantidade=quantidade, preco_unitario=produto.preco))
+            pedido.total += produto.preco * quantidade
+        db.session.commit()
+        return pedido.id
+
+
+def contar_consultas(app, funcao):
+    """Executa funcao() e retorna quantos SELECTs foram emitidos"""
+    consultas = []
+    with app.app_context():
+        engine = db.engine
+
+    def registrar(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith('SELECT'):
+            consultas.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', registrar)
+    try:
+        funcao()
+    finally:
+        event.remove(engine, 'before_cursor_execute', registrar)
+    return len(consultas)
+
+
+def test_detalhe_pedido_sem_n_mais_um(client, app):
+    ids = seed_loja(app, n_produtos=6)
+    login(client)
+    pedido_pequeno = criar_pedido(app, ids[:1])
+    pedido_grande = criar_pedido(app, ids)
+
+    def abrir(pedido_id):
+        resp = client.get(f'/pedidos/pedido/{pedido_id}')
+        assert resp.status_code == 200
+
+    consultas_pequeno = contar_consultas(app, lambda: abrir(pedido_pequeno))
+    consultas_grande = contar_consultas(app, lambda: abrir(pedido_grande))
+    assert consultas_grande == consultas_pequeno
+
+
+def test_carrinho_e_checkout_hidratados_em_lote(client, app):
+    from app.models.core import Pedido, Produto, PontoRetirada
+    ids = seed_loja(app, n_produtos=6)
+    login(client)
+    client.post(f'/pedidos/carrinho/adicionar/{ids[0]}', data={'quantidade': 2})
+
+    def abrir_carrinho():
+        assert client.get('/pedidos/carrinho').status_code == 200
+
+    consultas_uma_linha = contar_consultas(app, abrir_carrinho)
+    for produto_id in ids[1:]:
+        client.post(f'/pedidos/carrinho/adicionar/{produto_id}', data={'quantidade': 1})
+    assert contar_consultas(app, abrir_carrinho) == consultas_uma_linha
+
+    with app.app_context():
+        db.session.get(Produto, ids[0]).preco_promocional = 5.0
+        ponto = PontoRetirada(nome='Feira Central', endereco='Praça 1', ativo=True)
+        db.session.add(ponto)
+        db.session.commit()
+        ponto_id = ponto.id
+    resp = client.post('/pedidos/finalizar', data={
+        'forma_pagamento': 'dinheiro', 'tipo_recebimento': 'retirada', 'ponto_retirada_id': str(ponto_id)
+    })
+    assert resp.status_code == 302
+    with app.app_context():
+        pedido = Pedido.query.one()
+        # Preço promocional na linha com desconto; demais pelo preço normal (11 + 12 + ... + 15)
+        assert pedido.total == pytest.approx(2 * 5.0 + sum(10.0 + i for i in range(1, 6)))
+        assert db.session.get(Produto, ids[0]).estoque == 98
+
+
+def test_carrinho_persistente_mescla_no_login(client, app):
+    from app.models.core import Carrinho, ItemCarrinho
+    ids = seed_loja(app, n_produtos=3)
+    # Visitante monta o carrinho antes de entrar
+    client.post(f'/pedidos/carrinho/adicionar/{ids[0]}', data={'quantidade': 2})
+    client.post(f'/pedidos/carrinho/adicionar/{ids[0]}', data={'quantidade': 1})
+    client.post(f'/pedidos/carrinho/adicionar/{ids[1]}', data={'quantidade': 1})
+    assert b'Produto 0' in client.get('/pedidos/carrinho').data
+
+    login(client)
+    with app.app_context():
+        carrinho = Carrinho.query.one()
+        assert carrinho.usuario_id is not None and carrinho.token is None
+        itens = {i.produto_id: i.quantidade for i in ItemCarrinho.query.filter_by(carrinho_id=carrinho.id)}
+        assert itens == {ids[0]: 3, ids[1]: 1}
+
+    # Outro dispositivo (nova sessão) vê o mesmo carrinho
+    outro = app.test_client()
+    login(outro)
+    assert b'Produto 1' in outro.get('/pedidos/carrinho').data
+
+
+def test_carrinho_legado_do_cookie_migrado_em_get(client, app):
+    from app.models.core import ItemCarrinho
+    ids = seed_loja(app, n_produtos=2)
+    login(client)
+    with client.session_transaction() as sessao:
+        sessao['carrinho'] = {str(ids[0]): 2, str(ids[1]): {'quantidade': 1}}
+
+    assert b'Produto 0' in client.get('/pedidos/carrinho').data
+    # O contexto da app fica aberto entre as requisições do teste; rollback do teardown
+    db.session.rollback()
+    # A conversão foi confirmada: a segunda visita ainda vê os itens
+    segunda = client.get('/pedidos/carrinho').data
+    assert b'Produto 0' in segunda and b'Produto 1' in segunda
+    with client.session_transaction() as sessao:
+        assert 'carrinho' not in sessao
+    with app.app_context():
+        assert {i.produto_id: i.quantidade for i in ItemCarrinho.query.all()} == {ids[0]: 2, ids[1]: 1}
+
+
+def test_recomprar_soma_itens_ao_carrinho(client, app):
+    from app.models.core import ItemCarrinho
+    ids = seed_loja(app, n_produtos=2)
+    pedido_id = criar_pedido(app, ids, quantidade=2)
+    login(client)
+    resp = client.post(f'/cliente/recomprar/{pedido_id}')
+    assert resp.status_code == 302 and resp.headers['Location'].endswith('/pedidos/carrinho')
+    with app.app_context():
+        assert {i.produto_id: i.quantidade for i in ItemCarrinho.query.all()} == {ids[0]: 2, ids[1]: 2}
+
+
+def test_checkout_sem_estoque_nao_cria_pedido(client, app):
+    from app.models.core import Pedido, Produto, PontoRetirada
+    ids = seed_loja(app, n_produtos=2)
+    with app.app_context():
+        db.session.get(Produto, ids[1]).estoque = 1
+        ponto = PontoRetirada(nome='Feira Central', endereco='Praça 1', ativo=True)
+        db.session.add(ponto)
+        db.session.commit()
+        ponto_id = ponto.id
+    login(client)
+    client.post(f'/pedidos/carrinho/adicionar/{ids[0]}', data={'quantidade': 2})
+    client.post(f'/pedidos/carrinho/adicionar/{ids[1]}', data={'quantidade': 3})
+    resp = client.post('/pedidos/finalizar', data={
+        'forma_pagamento': 'dinheiro', 'tipo_recebimento': 'retirada', 'ponto_retirada_id': str(ponto_id)
+    }, follow_redirects=True)
+    assert 'Produto 1: solicitado 3, disponível 1' in resp.get_data(as_text=True)
+    with app.app_context():
+        assert Pedido.query.count() == 0
+        # A baixa da linha com estoque também foi desfeita
+        assert db.session.get(Produto, ids[0]).estoque == 100
+
+
+def test_reserva_concorrente_nao_vende_alem_do_estoque(tmp_path):
+    import threading
+    from app.models.core import Produto
+    from app.services.estoque_service import reservar_estoque, EstoqueInsuficiente
+
+    class ConfigArquivo(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "estoque.db"}'
+
+    app = create_app(ConfigArquivo)
+    with app.app_context():
+        db.create_all()
+    produto_id = seed_loja(app, n_produtos=1)[0]
+    with app.app_context():
+        db.session.get(Produto, produto_id).estoque = 5
+        db.session.commit()
+
+    vendidos = []
+
+    def comprar():
+        with app.app_context():
+            try:
+                reservar_estoque({produto_id: 1})
+                db.session.commit()
+                vendidos.append(1)
+            except EstoqueInsuficiente:
+                db.session.rollback()
+
+    threads = [threading.Thread(target=comprar) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with app.app_context():
+        assert len(vendidos) == 5
+        assert db.session.get(Produto, produto_id).estoque == 0
+
+
+def test_checkout_repetido_com_mesmo_token(client, app):
+    import re
+    from app.models.core import Pedido, Produto, PontoRetirada
+    ids = seed_loja(app, n_produtos=1)
+    with app.app_context():
+        ponto = PontoRetirada(nome='Feira Central', endereco='Praça 1', ativo=True)
+        db.session.add(ponto)
+        db.session.commit()
+        ponto_id = ponto.id
+    login(client)
+    client.post(f'/pedidos/carrinho/adicionar/{ids[0]}', data={'quantidade': 2})
+    pagina = client.get('/pedidos/finalizar').get_data(as_text=True)
+    token = re.search(r'name="idempotencia_token" value="([^"]+)"', pagina).group(1)
+    dados = {'forma_pagamento': 'pix', 'tipo_recebimento': 'retirada',
+             'ponto_retirada_id': str(ponto_id), 'idempotencia_token': token}
+
+    primeira = client.post('/pedidos/finalizar', data=dados)
+    repetida = client.post('/pedidos/finalizar', data=dados)
+    assert primeira.status_code == repetida.status_code == 302
+    assert repetida.headers['Location'] == primeira.headers['Location']
+    with app.app_context():
+        assert Pedido.query.count() == 1
+        assert db.session.get(Produto, ids[0]).estoque == 98
+
+
+def test_dados_de_referencia_em_cache_no_checkout(client, app):
+    from app.models.core import TaxaEntrega
+    ids = seed_loja(app, n_produtos=1)
+    with app.app_context():
+        db.session.add(TaxaEntrega(regiao='Centro', valor=5.0, prazo_dias=1, ativo=True))
+        db.session.commit()
+    login(client)
+    client.post(f'/pedidos/carrinho/adicionar/{ids[0]}', data={'quantidade': 1})
+    assert 'Centro' in client.get('/pedidos/finalizar').get_data(as_text=True)
+
+    consultas = []
+    with app.app_context():
+        engine = db.engine
+
+    def registrar(conn, cursor, statement, *args):
+        consultas.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', registrar)
+    try:
+        assert client.get('/pedidos/finalizar').status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', registrar)
+    tabelas = ('categorias', 'pontos_retirada', 'taxas_entrega')
+    assert not [sql for sql in consultas if any(f'FROM {t}' in sql for t in tabelas)]
+
+    # Gravação confirmada invalida o cache: a nova taxa aparece na próxima página
+    with app.app_context():
+        db.session.add(TaxaEntrega(regiao='Zona Rural', valor=12.0, prazo_dias=2, ativo=True))
+        db.session.commit()
+    assert 'Zona Rural' in client.get('/pedidos/finalizar').get_data(as_text=True)
+
+
+def test_checkout_grava_itens_em_um_insert(client, app):
+    from app.models.core import ItemPedido, PontoRetirada
+    ids = seed_loja(app, n_produtos=8)
+    with app.app_context():
+        ponto = PontoRetirada(nome='Feira Central', endereco='Praça 1', ativo=True)
+        db.session.add(ponto)
+        db.session.commit()
+        ponto_id = ponto.id
+    login(client)
+    for produto_id in ids:
+        client.post(f'/pedidos/carrinho/adicionar/{produto_id}', data={'quantidade': 1})
+
+    instrucoes = []
+    with app.app_context():
+        engine = db.engine
+
+    def registrar(conn, cursor, statement, *args):
+        instrucoes.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', registrar)
+    try:
+        client.post('/pedidos/finalizar', data={
+            'forma_pagamento': 'dinheiro', 'tipo_recebimento': 'retirada', 'ponto_retirada_id': str(ponto_id)
+        })
+    finally:
+        event.remove(engine, 'before_cursor_execute', registrar)
+    assert len([sql for sql in instrucoes if sql.startswith('INSERT INTO itens_pedido')]) == 1
+    with app.app_context():
+        assert ItemPedido.query.count() == 8
+
+
+def test_teste_de_carga_sem_venda_alem_do_estoque(tmp_path):
+    from scripts.teste_carga import executar_carga, servidor_embutido
+
+    class CargaConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'carga.db'}"
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}}
+
+    app = create_app(CargaConfig)
+    app.debug = True
+    servidor, base_url = servidor_embutido(app)
+    try:
+        relatorio = executar_carga(app, base_url, produtos=2, clientes=12, estoque=4,
+                                   concorrencia=6, itens_por_pedido=2, quantidade_max=2, semente=7)
+    finally:
+        servidor.shutdown()
+    resultados = relatorio['resultados']
+    assert not relatorio['erros'] and not relatorio['violacoes']
+    assert resultados.get('pago', 0) + resultados.get('sem_estoque', 0) == 12
+    assert resultados.get('sem_estoque', 0) > 0
+    assert relatorio['latencias']['finalizar']['n'] == 12
+
+
+def test_cliente_http_do_gateway_reaproveitado(app, monkeypatch):
+    from app.services.pagamento_service import PagamentoService
+    app.config['MERCADOPAGO_ACCESS_TOKEN'] = 'TEST-token'
+    chamadas = []
+
+    class Resposta:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'id': 123, 'status': 'approved'}
+
+    with app.test_request_context():
+        primeiro, segundo = PagamentoService(), PagamentoService()
+        assert primeiro.http is segundo.http
+        adaptador = primeiro.http.get_adapter('https://api.mercadopago.com')
+        assert adaptador.max_retries.total == app.config['MERCADOPAGO_RETENTATIVAS']
+        assert 'POST' not in adaptador.max_retries.allowed_methods
+
+        monkeypatch.setattr(primeiro.http, 'get', lambda url, **kw: chamadas.append((url, kw)) or Resposta())
+        assert segundo.consultar_pagamento('123')['status'] == 'approved'
+    assert chamadas[0][0].endswith('/v1/payments/123')
+    assert chamadas[0][1]['timeout'] == (app.config['MERCADOPAGO_TIMEOUT_CONEXAO'], app.config['MERCADOPAGO_TIMEOUT_LEITURA'])
+
+
+def test_pagamento_pix_reaproveita_cobranca_pendente(client, app):
+    from datetime import datetime, timedelta
+    from app.models.core import Pedido
+    ids = seed_loja(app, n_produtos=1)
+    pedido_id = criar_pedido(app, ids)
+    login(client)
+
+    assert client.get(f'/pedidos/pagamento/pix/{pedido_id}').status_code == 200
+    with app.app_context():
+        pedido = db.session.get(Pedido, pedido_id)
+        primeira = pedido.pagamento_id
+        assert pedido.pix_codigo
+
+    escritas = []
+    with app.app_context():
+        engine = db.engine
+
+    def registrar(conn, cursor, statement, *args):
+        if not statement.lstrip().upper().startswith('SELECT'):
+            escritas.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', registrar)
+    try:
+        resp = client.get(f'/pedidos/pagamento/pix/{pedido_id}')
+    finally:
+        event.remove(engine, 'before_cursor_execute', registrar)
+    assert resp.status_code == 200
+    assert not [sql for sql in escritas if 'pedidos' in sql]
+    with app.app_context():
+        pedido = db.session.get(Pedido, pedido_id)
+        assert pedido.pagamento_id == primeira
+        assert pedido.pix_codigo in resp.get_data(as_text=True)
+        # Cobrança expirada: a próxima visita gera outra
+        pedido.expiracao_pagamento = datetime.utcnow() - timedelta(minutes=1)
+        pedido.pagamento_id = 'SIM-expirado'
+        db.session.commit()
+    client.get(f'/pedidos/pagamento/pix/{pedido_id}')
+    with app.app_context():
+        assert db.session.get(Pedido, pedido_id).pagamento_id != 'SIM-expirado'
+
+
+def test_qr_code_pix_em_endpoint_cacheavel(client, app):
+    ids = seed_loja(app, n_produtos=1)
+    pedido_id = criar_pedido(app, ids)
+    login(client)
+    pagina = client.get(f'/pedidos/pagamento/pix/{pedido_id}').get_data(as_text=True)
+    assert 'data:image/png;base64' not in pagina
+    assert f'/pedidos/pagamento/pix/{pedido_id}/qr.svg' in pagina
+
+    svg = client.get(f'/pedidos/pagamento/pix/{pedido_id}/qr.svg')
+    assert svg.status_code == 200 and svg.mimetype == 'image/svg+xml'
+    assert svg.data.lstrip().startswith(b'<?xml') or b'<svg' in svg.data[:200]
+    assert 'private' in svg.headers['Cache-Control'] and svg.headers['ETag']
+
+    png = client.get(f'/pedidos/pagamento/pix/{pedido_id}/qr.png')
+    assert png.mimetype == 'image/png' and png.data.startswith(b'\x89PNG')
+    assert png.headers['ETag'] != svg.headers['ETag']
+
+    revalidado = client.get(f'/pedidos/pagamento/pix/{pedido_id}/qr.svg',
+                            headers={'If-None-Match': svg.headers['ETag']})
+    assert revalidado.status_code == 304 and not revalidado.data
+    assert client.get(f'/pedidos/pagamento/pix/{pedido_id}/qr.gif').status_code == 404
+
+    # PNG do gateway: outra origem, outra ETag (o PNG local em cache não é reaproveitado)
+    import base64
+    from app.models.core import Pedido
+    png_gateway = b'\x89PNG\r\n\x1a\ngateway'
+    db.session.get(Pedido, pedido_id).pix_qr_code = base64.b64encode(png_gateway).decode()
+    db.session.commit()
+    do_gateway = client.get(f'/pedidos/pagamento/pix/{pedido_id}/qr.png',
+                            headers={'If-None-Match': png.headers['ETag']})
+    assert do_gateway.status_code == 200 and do_gateway.data == png_gateway
+    assert do_gateway.headers['ETag'] != png.headers['ETag']
+
+
+def test_verificar_pagamentos_concorrente(app, monkeypatch):
+    import time
+    from datetime import datetime, timedelta
+    from app.models.core import Pedido, Produto
+    from app.services.pagamento_service import PagamentoService
+    ids = seed_loja(app, n_produtos=1)
+    pedidos = [criar_pedido(app, ids, quantidade=2) for _ in range(6)]
+    with app.app_context():
+        for i, pedido_id in enumerate(pedidos):
+            pedido = db.session.get(Pedido, pedido_id)
+            pedido.pagamento_id = f'MP-{i}'
+            pedido.status_pagamento = 'pendente'
+        # Pedido antigo já consultado há pouco: fica para o próximo intervalo
+        db.session.get(Pedido, pedidos[4]).data = datetime.utcnow() - timedelta(days=2)
+        db.session.commit()
+        estoque_inicial = db.session.get(Produto, ids[0]).estoque
+
+    respostas = {'MP-0': 'approved', 'MP-1': 'approved', 'MP-2': 'rejected', 'MP-3': 'cancelled', 'MP-4': 'pending'}
+
+    def consultar(self, pagamento_id):
+        time.sleep(0.1)
+        status = respostas.get(pagamento_id)
+        return {'status': status} if status else None
+
+    monkeypatch.setattr(PagamentoService, 'consultar_pagamento', consultar)
+    runner = app.test_cli_runner()
+    inicio = time.perf_counter()
+    resultado = runner.invoke(args=['cli', 'verificar-pagamentos', '--paralelismo', '6', '--taxa', '0', '--lote', '2'])
+    assert resultado.exit_code == 0, resultado.output
+    assert time.perf_counter() - inicio < 0.5
+    assert 'aprovado=2' in resultado.output and 'erro=1' in resultado.output and 'p95' in resultado.output
+
+    with app.app_context():
+        status = [db.session.get(Pedido, p).status_pagamento for p in pedidos]
+        assert status == ['aprovado', 'aprovado', 'rejeitado', 'cancelado', 'pendente', 'pendente']
+        assert db.session.get(Pedido, pedidos[4]).pagamento_consultado_em is not None
+        assert db.session.get(Pedido, pedidos[5]).pagamento_consultado_em is None
+        assert db.session.get(Produto, ids[0]).estoque == estoque_inicial + 2
+
+    segunda = runner.invoke(args=['cli', 'verificar-pagamentos', '--taxa', '0'])
+    assert '1 consulta(s)' in segunda.output and '1 pedido(s) aguardando' in segunda.output
+
+
+def test_webhook_enfileirado_e_processado_pelo_worker(app, client, monkeypatch):
+    from app.models.core import Pedido, WebhookRecebido
+    from app.services.pagamento_service import PagamentoService
+    ids = seed_loja(app, n_produtos=1)
+    pedido_id = criar_pedido(app, ids)
+    consultas = []
+    respostas = {'MP-1': {'status': 'approved', 'external_reference': str(pedido_id)}}
+
+    def consultar(self, pagamento_id):
+        consultas.append(pagamento_id)
+        return respostas.get(pagamento_id)
+
+    monkeypatch.setattr(PagamentoService, 'consultar_pagamento', consultar)
+    for pagamento_id in ('MP-1', 'MP-2'):
+        resposta = client.post('/webhooks/mercadopago', json={
+            'type': 'payment', 'action': 'payment.updated', 'data': {'id': pagamento_id},
+        })
+        assert resposta.status_code == 200
+    assert client.post('/webhooks/mercadopago', data='x', content_type='text/plain').status_code == 400
+
+    # O endpoint só grava: nenhuma consulta ao gateway na requisição
+    assert consultas == []
+    with app.app_context():
+        assert db.session.get(Pedido, pedido_id).status_pagamento != 'aprovado'
+        assert WebhookRecebido.query.filter_by(status='pendente').count() == 2
+
+    resultado = app.test_cli_runner().invoke(args=['cli', 'webhooks-worker', '--uma-vez', '--concorrencia', '1'])
+    assert resultado.exit_code == 0, resultado.output
+    assert sorted(consultas) == ['MP-1', 'MP-2']
+    with app.app_context():
+        assert db.session.get(Pedido, pedido_id).status_pagamento == 'aprovado'
+        processado = WebhookRecebido.query.filter_by(recurso_id='MP-1').one()
+        assert processado.status == 'processado' and processado.processado_em is not None
+        # Pagamento ainda não visível no gateway: volta para a fila com backoff
+        reagendado = WebhookRecebido.query.filter_by(recurso_id='MP-2').one()
+        assert reagendado.status == 'pendente' and reagendado.tentativas == 1
+        assert reagendado.disponivel_em > processado.processado_em
+
+
+def test_webhook_duplicado_e_reprocessamento(app, client, monkeypatch):
+    from app.models.core import Pedido, Produto, WebhookRecebido, WebhookEvento
+    from app.services.pagamento_service import PagamentoService
+    ids = seed_loja(app, n_produtos=1)
+    pedido_id = criar_pedido(app, ids, quantidade=2)
+    with app.app_context():
+        estoque_inicial = db.session.get(Produto, ids[0]).estoque
+    consultas = []
+    gateway = {'no_ar': False, 'status': 'cancelled'}
+
+    def consultar(self, pagamento_id):
+        consultas.append(pagamento_id)
+        if not gateway['no_ar']:
+            return None
+        return {'status': gateway['status'], 'external_reference': str(pedido_id)}
+
+    monkeypatch.setattr(PagamentoService, 'consultar_pagamento', consultar)
+    app.config['WEBHOOKS_MAX_TENTATIVAS'] = 1
+    notificacao = {'type': 'payment', 'action': 'payment.updated', 'data': {'id': 'MP-9'}}
+    runner = app.test_cli_runner()
+
+    # Gateway fora do ar: o evento esgota as tentativas
+    client.post('/webhooks/mercadopago', json=notificacao)
+    runner.invoke(args=['cli', 'webhooks-worker', '--uma-vez', '--concorrencia', '1'])
+    with app.app_context():
+        assert WebhookRecebido.query.one().status == 'erro'
+
+    gateway['no_ar'] = True
+    resultado = runner.invoke(args=['cli', 'webhooks-replay', '--processar'])
+    assert resultado.exit_code == 0, resultado.output
+    assert '1 webhook(s) devolvido(s)' in resultado.output and 'cancelado=1' in resultado.output
+    assert len(consultas) == 2
+
+    # Reenvios do gateway: resolvidos pelo registro, sem consulta nem nova gravação
+    for _ in range(3):
+        client.post('/webhooks/mercadopago', json=notificacao)
+    resultado = runner.invoke(args=['cli', 'webhooks-worker', '--uma-vez', '--concorrencia', '1'])
+    assert 'duplicado=3' in resultado.output
+    assert len(consultas) == 2
+    with app.app_context():
+        assert WebhookEvento.query.count() == 1
+        assert db.session.get(Pedido, pedido_id).status_pagamento == 'cancelado'
+        assert db.session.get(Produto, ids[0]).estoque == estoque_inicial + 2
+
+
+def test_expirar_pedidos_pix_em_lotes(app):
+    from datetime import datetime, timedelta
+    from app.models.core import Pedido, Produto
+    from app.services.email_service import mail
+    ids = seed_loja(app, n_produtos=2)
+    pedidos = [criar_pedido(app, ids, quantidade=3) for _ in range(5)]
+    agora = datetime.utcnow()
+    with app.app_context():
+        for i, pedido_id in enumerate(pedidos):
+            pedido = db.session.get(Pedido, pedido_id)
+            pedido.forma_pagamento = 'pix'
+            pedido.status_pagamento = 'aprovado' if i == 4 else 'pendente'
+            pedido.expiracao_pagamento = agora + timedelta(minutes=10 if i == 3 else -5 - i)
+        db.session.commit()
+        estoque_inicial = [db.session.get(Produto, p).estoque for p in ids]
+        engine = db.engine
+
+    atualizacoes = []
+
+    def registrar(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith('UPDATE PRODUTOS'):
+            atualizacoes.append(statement)
+
+    app.config['MAIL_ENABLED'] = True
+    event.listen(engine, 'before_cursor_execute', registrar)
+    try:
+        with mail.record_messages() as enviados:
+            resultado = app.test_cli_runner().invoke(args=['cli', 'expirar-pedidos-pix', '--lote', '2'])
+    finally:
+        event.remove(engine, 'before_cursor_execute', registrar)
+    assert resultado.exit_code == 0, resultado.output
+    assert '3 pedido(s) PIX expirado(s)' in resultado.output
+    # Um UPDATE agregado de estoque por lote (2 + 1), não um por item
+    assert len(atualizacoes) == 2
+    assert sorted(m.subject for m in enviados) == [f'Pagamento Expirado - Pedido #{p}' for p in sorted(pedidos[:3])]
+
+    with app.app_context():
+        status = [db.session.get(Pedido, p).status_pagamento for p in pedidos]
+        assert status == ['expirado', 'expirado', 'expirado', 'pendente', 'aprovado']
+        assert [db.session.get(Produto, p).estoque for p in ids] == [e + 9 for e in estoque_inicial]
+
+
+def test_agendador_com_trava_no_banco(app):
+    from datetime import datetime, timedelta
+    from app.models.core import Pedido, Produto, ExecucaoTarefa, TravaTarefa
+    from app.services.agendador_service import Tarefa, adquirir_trava, executar_tarefa
+    ids = seed_loja(app, n_produtos=1)
+    pedido_id = criar_pedido(app, ids)
+    fim_promocao = datetime.utcnow() + timedelta(minutes=10)
+    with app.app_context():
+        pedido = db.session.get(Pedido, pedido_id)
+        pedido.forma_pagamento = 'pix'
+        pedido.status_pagamento = 'pendente'
+        pedido.expiracao_pagamento = datetime.utcnow() - timedelta(minutes=1)
+        produto = db.session.get(Produto, ids[0])
+        produto.preco_promocional = 1.0
+        produto.sazonal_fim = fim_promocao
+        db.session.commit()
+
+    runner = app.test_cli_runner()
+    resultado = runner.invoke(args=['scheduler', 'run', '--uma-vez'])
+    assert resultado.exit_code == 0, resultado.output
+    assert 'expirar-pedidos-pix: 1 registro(s)' in resultado.output
+    # Segunda rodada (outro nó ou o mesmo): as tarefas só voltam no próximo intervalo
+    runner.invoke(args=['scheduler', 'run', '--uma-vez'])
+    with app.app_context():
+        assert db.session.get(Pedido, pedido_id).status_pagamento == 'expirado'
+        execucoes = ExecucaoTarefa.query.order_by(ExecucaoTarefa.id).all()
+        assert [(e.tarefa, e.status) for e in execucoes] == [
+            ('expirar-pedidos-pix', 'sucesso'), ('verificar-pagamentos', 'sucesso'),
+            ('relatorio-divergencias', 'sucesso'), ('atualizar-precos', 'sucesso')]
+        assert execucoes[0].linhas == 1 and execucoes[0].duracao is not None
+        trava = db.session.get(TravaTarefa, 'expirar-pedidos-pix')
+        assert trava.dono is None and trava.proxima_em > datetime.utcnow() + timedelta(seconds=50)
+        # Preços: próxima execução na virada da promoção, antes do intervalo de 1h
+        assert db.session.get(TravaTarefa, 'atualizar-precos').proxima_em == fim_promocao
+
+        # Trava válida de outro nó bloqueia; vencida (nó caiu) pode ser assumida
+        agora = datetime.utcnow()
+        assert adquirir_trava('manutencao', 'no-a', ttl=60, agora=agora)
+        assert not adquirir_trava('manutencao', 'no-b', ttl=60, agora=agora + timedelta(seconds=30))
+        assert adquirir_trava('manutencao', 'no-b', ttl=60, agora=agora + timedelta(seconds=61))
+
+        def falha(parar):
+            raise RuntimeError('gateway fora do ar')
+
+        execucao = executar_tarefa(Tarefa('falha', falha, intervalo=60), 'no-a', ttl=60)
+        assert execucao.status == 'erro' and 'gateway fora do ar' in execucao.erro
+        assert db.session.get(TravaTarefa, 'falha').dono is None
+
+        # Trava assumida por outro nó no meio da execução: a tarefa é avisada e para
+        def em_lotes(parar):
+            db.session.execute(db.update(TravaTarefa).where(TravaTarefa.nome == 'lotes').values(dono='no-b'))
+            db.session.commit()
+            return 1 if parar.wait(5) else 0
+
+        execucao = executar_tarefa(Tarefa('lotes', em_lotes, intervalo=60), 'no-a', ttl=0.3)
+        assert execucao.linhas == 1 and 'trava perdida' in execucao.erro
+        assert db.session.get(TravaTarefa, 'lotes').dono == 'no-b'
+
+
+def test_relatorio_divergencias_com_busca_em_lote(app, monkeypatch):
+    from app.models.core import Pedido
+    from app.services import pagamento_service
+    ids = seed_loja(app, n_produtos=1)
+    pedidos = [criar_pedido(app, ids) for _ in range(250)]
+    with app.app_context():
+        for pedido_id in pedidos:
+            pedido = db.session.get(Pedido, pedido_id)
+            pedido.pagamento_id = f'MP-{pedido_id}'
+            pedido.status_pagamento = 'aprovado'
+        # Gateway reembolsou, webhook perdido; e um pedido sem pagamento no gateway
+        db.session.get(Pedido, pedidos[0]).status_pagamento = 'pendente'
+        db.session.commit()
+
+    gateway = [{'id': f'MP-{p}', 'external_reference': str(p), 'status': 'approved',
+                'date_created': '2026-10-18T10:00:00.000-03:00'} for p in pedidos[:-1]]
+    gateway[0]['status'] = 'refunded'
+    gateway.append({'id': 'MP-X', 'external_reference': '999999', 'status': 'approved'})
+    chamadas = []
+
+    class Resposta:
+        def __init__(self, dados):
+            self.dados = dados
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return self.dados
+
+    class SessaoFalsa:
+        def get(self, url, params=None, headers=None, timeout=None):
+            chamadas.append(params)
+            assert url.endswith('/v1/payments/search')
+            inicio = params['offset']
+            return Resposta({'paging': {'total': len(gateway), 'limit': params['limit'], 'offset': inicio},
+                             'results': gateway[inicio:inicio + params['limit']]})
+
+    monkeypatch.setattr(pagamento_service, 'sessao_http', lambda: SessaoFalsa())
+    app.config['MERCADOPAGO_ACCESS_TOKEN'] = 'TEST-token'
+    app.config['MERCADOPAGO_BUSCA_LIMITE'] = 100
+
+    resultado = app.test_cli_runner().invoke(args=['cli', 'relatorio-divergencias', '--estrito'])
+    assert resultado.exit_code == 1, resultado.output
+    # 250 pedidos em 3 chamadas paginadas, não 250 consultas
+    assert len(chamadas) == 3 and [c['offset'] for c in chamadas] == [0, 100, 200]
+    assert '250 pedido(s) conferido(s) com 3 chamada(s)' in resultado.output
+    assert f'Pedido #{pedidos[0]} (MP-{pedidos[0]}): local pendente, gateway refunded' in resultado.output
+    assert f'Pedido #{pedidos[-1]} (MP-{pedidos[-1]}): local aprovado, gateway não encontrado' in resultado.output
+    assert 'referência 999999 sem pedido' in resultado.output
+    assert '2 divergência(s)' in resultado.output